@@ -1,11 +1,15 @@
 from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 from pydantic import BaseModel
 from app.db.session import get_db
 from app.models import models, schemas
 from app.services.mailbox_service import MailboxService
 from app.services.cleanup_service import MailboxCleanupService
+from app.services.mailcow_domains import mailcow_domains
+from app.services.mailcow_jobs import DELETE_MAILBOX, mailcow_jobs
+from app.services.email_detail import forget_cached_mail
 
 admin_router = APIRouter(prefix="/admin", tags=["admin"])
 
@@ -26,7 +30,7 @@ class DomainUpdate(BaseModel):
     is_mailcow_managed: bool | None = None
 
 @admin_router.post("/domains", response_model=schemas.DomainResponse)
-async def create_domain(domain: DomainCreate, db: Session = Depends(get_db)):
+async def create_domain(domain: DomainCreate, db: AsyncSession = Depends(get_db)):
     """
     Add a new email domain configuration.
     """
@@ -40,19 +44,20 @@ async def create_domain(domain: DomainCreate, db: Session = Depends(get_db)):
     )
     db.add(db_domain)
     try:
-        db.commit()
-        db.refresh(db_domain)
+        await db.commit()
+        await db.refresh(db_domain)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail="Domain already exists")
+    mailcow_domains.invalidate()
     return db_domain
 
 @admin_router.put("/domains/{domain}", response_model=schemas.DomainResponse)
-async def update_domain(domain: str, domain_update: DomainUpdate, db: Session = Depends(get_db)):
+async def update_domain(domain: str, domain_update: DomainUpdate, db: AsyncSession = Depends(get_db)):
     """
     Update an existing domain configuration.
     """
-    db_domain = db.query(models.Domain).filter(models.Domain.domain == domain).first()
+    db_domain = await db.scalar(select(models.Domain).where(models.Domain.domain == domain))
     if not db_domain:
         raise HTTPException(status_code=404, detail="Domain not found")
     
@@ -61,56 +66,59 @@ async def update_domain(domain: str, domain_update: DomainUpdate, db: Session =
         setattr(db_domain, field, value)
     
     try:
-        db.commit()
-        db.refresh(db_domain)
+        await db.commit()
+        await db.refresh(db_domain)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail="Error updating domain")
+    mailcow_domains.invalidate()
     return db_domain
 
 @admin_router.get("/domains", response_model=List[schemas.DomainResponse])
-async def list_all_domains(db: Session = Depends(get_db)):
+async def list_all_domains(db: AsyncSession = Depends(get_db)):
     """
     List all domains, including inactive ones.
     """
-    return db.query(models.Domain).all()
+    return (await db.scalars(select(models.Domain))).all()
 
 @admin_router.delete("/domains/{domain}")
-async def delete_domain(domain: str, db: Session = Depends(get_db)):
+async def delete_domain(domain: str, db: AsyncSession = Depends(get_db)):
     """
     Soft delete a domain by setting is_active to False.
     """
-    db_domain = db.query(models.Domain).filter(models.Domain.domain == domain).first()
+    db_domain = await db.scalar(select(models.Domain).where(models.Domain.domain == domain))
     if not db_domain:
         raise HTTPException(status_code=404, detail="Domain not found")
     
     db_domain.is_active = False
-    db.commit()
+    await db.commit()
+    mailcow_domains.invalidate()
     return {"message": "Domain deactivated successfully"}
 
 @admin_router.get("/mailboxes", response_model=List[schemas.MailboxInfoResponse])
 async def list_mailboxes(
     domain: str = None,
     active_only: bool = True,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     List all mailboxes, optionally filtered by domain.
     """
-    query = db.query(models.Mailbox)
+    # Pooled mailboxes belong to nobody yet
+    query = select(models.Mailbox).where(models.Mailbox.pooled == False)
     
     if domain:
-        query = query.join(models.Domain).filter(models.Domain.domain == domain)
+        query = query.join(models.Domain).where(models.Domain.domain == domain)
     
     if active_only:
         # Filter out expired mailboxes
         from datetime import datetime
-        query = query.filter(
+        query = query.where(
             (models.Mailbox.expires_at.is_(None)) | 
             (models.Mailbox.expires_at > datetime.utcnow())
         )
     
-    mailboxes = query.all()
+    mailboxes = (await db.scalars(query)).all()
     
     return [
         schemas.MailboxInfoResponse(
@@ -128,28 +136,24 @@ async def list_mailboxes(
     ]
 
 @admin_router.delete("/mailboxes/{email}")
-async def delete_mailbox(email: str, db: Session = Depends(get_db)):
+async def delete_mailbox(email: str, db: AsyncSession = Depends(get_db)):
     """
     Delete a specific mailbox from both database and Mailcow.
     """
-    db_mailbox = db.query(models.Mailbox).filter(models.Mailbox.email == email).first()
+    db_mailbox = await db.scalar(select(models.Mailbox).where(models.Mailbox.email == email))
     if not db_mailbox:
         raise HTTPException(status_code=404, detail="Mailbox not found")
     
-    # Delete from Mailcow if it's managed by Mailcow
+    # Delete from Mailcow (through the job queue) if it's managed by Mailcow
     if db_mailbox.mailcow_managed:
-        mailbox_service = MailboxService()
-        success = await mailbox_service.delete_mailbox(email)
-        
-        if not success:
-            raise HTTPException(
-                status_code=500,
-                detail="Failed to delete mailbox from Mailcow"
-            )
+        await mailcow_jobs.enqueue(db, DELETE_MAILBOX, [email])
     
     # Delete from database
-    db.delete(db_mailbox)
-    db.commit()
+    imap_host = db_mailbox.domain.imap_host
+    await db.delete(db_mailbox)
+    await db.commit()
+    mailcow_jobs.notify()
+    await forget_cached_mail([(imap_host, email)])
     
     return {"message": f"Mailbox {email} deleted successfully"}
 
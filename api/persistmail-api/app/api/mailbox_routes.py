@@ -2,18 +2,29 @@
 Mailbox management routes for Mailcow integration.
 """
 
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import Dict, Any, List
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Response
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
+from urllib.parse import quote
+import asyncio
 import random
+import re
 import string
 
 from app.db.session import get_db
 from app.models import models, schemas
 from app.services.mailcow_client import MailcowClient
 from app.services.mailcow_email_service import MailcowEmailService
+from app.services.mailbox_pool import mailbox_pool
+from app.services.mailcow_jobs import CREATE_MAILBOX, DELETE_MAILBOX, mailcow_jobs
+from app.services.last_access import last_access
+from app.services.imap_fetch import listing_etag, etag_matches, since_date
+from app.services.message_index import message_index
+from app.services.message_search import message_search
+from app.services.attachment_stream import AttachmentResponse, parse_range
+from app.services.email_detail import forget_cached_mail
 from app.core.config import settings
 
 mailbox_router = APIRouter()
@@ -42,7 +53,7 @@ def generate_random_prefix(length: int = 8) -> str:
 @mailbox_router.post("/mailbox", response_model=schemas.MailboxCreateResponse)
 async def create_temporary_mailbox(
     request: schemas.MailboxCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     mailcow: MailcowClient = Depends(get_mailcow_client)
 ):
     """
@@ -51,51 +62,60 @@ async def create_temporary_mailbox(
     try:
         # Get domain - either specified or auto-select
         if request.domain:
-            domain = db.query(models.Domain).filter(
+            domain = await db.scalar(select(models.Domain).where(
                 models.Domain.domain == request.domain,
                 models.Domain.is_active == True,
                 models.Domain.is_mailcow_managed == True
-            ).first()
+            ))
             if not domain:
                 raise HTTPException(status_code=400, detail="Domain not found or not available")
         else:
             # Auto-select first available domain
-            domain = db.query(models.Domain).filter(
+            domain = await db.scalar(select(models.Domain).where(
                 models.Domain.is_active == True,
                 models.Domain.is_mailcow_managed == True
-            ).first()
+            ).limit(1))
             if not domain:
                 raise HTTPException(status_code=500, detail="No active domains available")
         
+        # Validate quota
+        quota_mb = min(request.quota_mb or settings.MAILCOW_DEFAULT_QUOTA_MB, settings.MAILCOW_MAX_QUOTA_MB)
+        
+        # Validate expiry
+        expiry_hours = min(request.expiry_hours or settings.DEFAULT_MAILBOX_EXPIRY_HOURS, settings.MAX_MAILBOX_EXPIRY_HOURS)
+        expires_at = datetime.utcnow() + timedelta(hours=expiry_hours)
+        
+        # Hand out a pre-created mailbox when the caller has no name in mind
+        if not request.prefix:
+            pooled_mailbox = await mailbox_pool.claim(db, domain, quota_mb, expires_at)
+            if pooled_mailbox:
+                return schemas.MailboxCreateResponse(
+                    email=pooled_mailbox.email,
+                    password=pooled_mailbox.password,
+                    created_at=pooled_mailbox.created_at,
+                    expires_at=expires_at,
+                    quota_mb=quota_mb,
+                    domain_info={
+                        "domain": domain.domain,
+                        "is_premium": domain.is_premium
+                    }
+                )
+        
         # Generate email address
         prefix = request.prefix if request.prefix else generate_random_prefix()
         email_address = f"{prefix}@{domain.domain}"
         
         # Check if mailbox already exists
-        existing_mailbox = db.query(models.Mailbox).filter(
+        existing_mailbox = await db.scalar(select(models.Mailbox.id).where(
             models.Mailbox.email == email_address
-        ).first()
+        ))
         if existing_mailbox:
             raise HTTPException(status_code=409, detail="Mailbox already exists")
         
-        # Validate quota
-        quota_mb = min(request.quota_mb or settings.MAILCOW_DEFAULT_QUOTA_MB, settings.MAILCOW_MAX_QUOTA_MB)
-        
-        # Validate expiry
-        expiry_hours = min(request.expiry_hours or settings.DEFAULT_MAILBOX_EXPIRY_HOURS, settings.MAX_MAILBOX_EXPIRY_HOURS)
-        expires_at = datetime.utcnow() + timedelta(hours=expiry_hours)
-        
-        # Create mailbox in Mailcow
-        mailcow_result = await mailcow.create_mailbox(
-            email=email_address,
-            domain=domain.domain,
-            quota=quota_mb
-        )
-        
-        # Store in database
+        # Store in database; the mailbox is created in Mailcow by the job worker
         db_mailbox = models.Mailbox(
             email=email_address,
-            password=mailcow_result["password"],
+            password=settings.IMAP_SECRET,
             domain_id=domain.id,
             quota_mb=quota_mb,
             quota_used_mb=0,
@@ -104,39 +124,42 @@ async def create_temporary_mailbox(
         )
         
         db.add(db_mailbox)
-        db.commit()
-        db.refresh(db_mailbox)
+        await mailcow_jobs.enqueue(db, CREATE_MAILBOX, [email_address], quota_mb=quota_mb)
+        await db.commit()
+        await db.refresh(db_mailbox)
+        mailcow_jobs.notify()
         
         return schemas.MailboxCreateResponse(
             email=email_address,
-            password=mailcow_result["password"],
+            password=db_mailbox.password,
             created_at=db_mailbox.created_at,
             expires_at=expires_at,
             quota_mb=quota_mb,
             domain_info={
                 "domain": domain.domain,
                 "is_premium": domain.is_premium
-            }
+            },
+            status="provisioning"
         )
         
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Error creating mailbox: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to create mailbox")
 
 @mailbox_router.get("/mailbox/{email}/info", response_model=schemas.MailboxInfoResponse)
 async def get_mailbox_info(
     email: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     mailcow: MailcowClient = Depends(get_mailcow_client)
 ):
     """
     Get detailed mailbox information including usage statistics.
     """
     # Get from database
-    db_mailbox = db.query(models.Mailbox).filter(models.Mailbox.email == email).first()
+    db_mailbox = await db.scalar(select(models.Mailbox).where(models.Mailbox.email == email))
     if not db_mailbox:
         raise HTTPException(status_code=404, detail="Mailbox not found")
     
@@ -145,7 +168,7 @@ async def get_mailbox_info(
     if quota_usage:
         # Update quota usage in database
         db_mailbox.quota_used_mb = quota_usage["used"] // (1024 * 1024)
-        db.commit()
+        await db.commit()
     
     # Determine status
     status = "active"
@@ -173,13 +196,13 @@ async def get_mailbox_info(
 async def extend_mailbox_expiry(
     email: str,
     request: schemas.MailboxExtendRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Extend mailbox expiry time (premium feature).
     """
     # Get mailbox
-    db_mailbox = db.query(models.Mailbox).filter(models.Mailbox.email == email).first()
+    db_mailbox = await db.scalar(select(models.Mailbox).where(models.Mailbox.email == email))
     if not db_mailbox:
         raise HTTPException(status_code=404, detail="Mailbox not found")
     
@@ -205,7 +228,7 @@ async def extend_mailbox_expiry(
     
     # Update database
     db_mailbox.expires_at = new_expires_at
-    db.commit()
+    await db.commit()
     
     return schemas.MailboxExtendResponse(
         email=email,
@@ -218,109 +241,116 @@ async def extend_mailbox_expiry(
 @mailbox_router.delete("/mailbox/{email}")
 async def delete_mailbox(
     email: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     mailcow: MailcowClient = Depends(get_mailcow_client)
 ):
     """
     Delete a temporary mailbox immediately.
     """
     # Get mailbox from database
-    db_mailbox = db.query(models.Mailbox).filter(models.Mailbox.email == email).first()
+    db_mailbox = await db.scalar(select(models.Mailbox).where(models.Mailbox.email == email))
     if not db_mailbox:
         raise HTTPException(status_code=404, detail="Mailbox not found")
     
     try:
-        # Delete from Mailcow
-        await mailcow.delete_mailbox(email)
-        
-        # Remove from database
-        db.delete(db_mailbox)
-        db.commit()
+        # Remove from database; the job worker deletes it from Mailcow
+        await mailcow_jobs.enqueue(db, DELETE_MAILBOX, [email])
+        quota_freed_mb = db_mailbox.quota_used_mb
+        imap_host = db_mailbox.domain.imap_host
+        await db.delete(db_mailbox)
+        await db.commit()
+        mailcow_jobs.notify()
+        await forget_cached_mail([(imap_host, email)])
         
         return {
             "message": f"Mailbox {email} deleted successfully",
             "deleted_at": datetime.utcnow(),
             "emails_deleted": "unknown",  # Mailcow doesn't provide this info
-            "quota_freed_mb": db_mailbox.quota_used_mb
+            "quota_freed_mb": quota_freed_mb
         }
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Error deleting mailbox: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to delete mailbox")
 
 @mailbox_router.post("/mailbox/cleanup")
 async def cleanup_expired_mailboxes(
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     mailcow: MailcowClient = Depends(get_mailcow_client)
 ):
     """
     Cleanup expired mailboxes (admin endpoint).
-    """
     
-    async def cleanup_task():
-        """Background task to cleanup expired mailboxes."""
-        try:
-            # Find expired mailboxes
-            expired_mailboxes = db.query(models.Mailbox).filter(
+    Expired mailboxes are removed from the database right away and queued
+    for deletion from Mailcow.
+    """
+    try:
+        # Find expired mailboxes
+        expired_mailboxes = (await db.execute(
+            select(
+                models.Mailbox.id, models.Mailbox.email, models.Mailbox.quota_used_mb, models.Domain.imap_host
+            ).join(models.Domain).where(
                 models.Mailbox.expires_at < datetime.utcnow(),
                 models.Mailbox.mailcow_managed == True
-            ).all()
-            
-            deleted_count = 0
-            freed_quota = 0
-            
-            for mailbox in expired_mailboxes:
-                try:
-                    # Delete from Mailcow
-                    await mailcow.delete_mailbox(mailbox.email)
-                    
-                    # Track statistics
-                    freed_quota += mailbox.quota_used_mb
-                    deleted_count += 1
-                    
-                    # Remove from database
-                    db.delete(mailbox)
-                    
-                except Exception as e:
-                    print(f"Failed to delete expired mailbox {mailbox.email}: {str(e)}")
-                    continue
-            
-            db.commit()
-            print(f"Cleanup completed: {deleted_count} mailboxes deleted, {freed_quota}MB freed")
-            
-        except Exception as e:
-            print(f"Cleanup task failed: {str(e)}")
-            db.rollback()
-    
-    # Run cleanup in background
-    background_tasks.add_task(cleanup_task)
-    
-    return {"message": "Cleanup task started"}
+            )
+        )).all()
+        
+        if expired_mailboxes:
+            await mailcow_jobs.enqueue(db, DELETE_MAILBOX, [mailbox.email for mailbox in expired_mailboxes])
+            await db.execute(
+                delete(models.Mailbox)
+                .where(models.Mailbox.id.in_([mailbox.id for mailbox in expired_mailboxes]))
+                .execution_options(synchronize_session=False)
+            )
+        await db.commit()
+        mailcow_jobs.notify()
+        
+    except Exception as e:
+        await db.rollback()
+        print(f"Cleanup failed: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to clean up mailboxes")
+    
+    await forget_cached_mail((mailbox.imap_host, mailbox.email) for mailbox in expired_mailboxes)
+    freed_quota = sum(mailbox.quota_used_mb or 0 for mailbox in expired_mailboxes)
+    print(f"Cleanup queued: {len(expired_mailboxes)} mailboxes, {freed_quota}MB freed")
+    return {
+        "message": "Cleanup completed",
+        "count": len(expired_mailboxes),
+        "quota_freed_mb": freed_quota
+    }
 
 # Update emails endpoint to use Mailcow authentication
 @mailbox_router.get("/emails/{mailbox}", response_model=List[schemas.EmailList])
 async def get_emails_mailcow(
     mailbox: str,
+    response: Response,
     hours: int = 24,
     limit: int = 25,
-    db: Session = Depends(get_db)
+    before_uid: Optional[int] = Query(default=None, ge=1),
+    after_uid: Optional[int] = Query(default=None, ge=0),
+    sender: Optional[str] = Query(default=None, alias="from"),
+    subject: Optional[str] = None,
+    text: Optional[str] = None,
+    unseen: bool = False,
+    if_none_match: str = Header(default=None),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Retrieve emails using Mailcow individual authentication.
+    Supports conditional requests through ETag / If-None-Match, UID cursors
+    (before_uid/after_uid with X-Next-Cursor) and server-side filters.
     """
     # Get mailbox info
-    db_mailbox = db.query(models.Mailbox).filter(models.Mailbox.email == mailbox).first()
+    db_mailbox = await db.scalar(select(models.Mailbox).where(models.Mailbox.email == mailbox))
     if not db_mailbox:
         raise HTTPException(status_code=404, detail="Mailbox not found")
     
     if not db_mailbox.password:
         raise HTTPException(status_code=500, detail="Mailbox password not available")
     
-    # Update last accessed
-    db_mailbox.last_accessed = func.now()
-    db.commit()
+    # Record the access; written to the database in the next bulk flush
+    last_access.touch(db_mailbox)
     
     # Use Mailcow email service with individual credentials
     email_service = MailcowEmailService(
@@ -330,20 +360,42 @@ async def get_emails_mailcow(
         password=db_mailbox.password
     )
     
-    # Fetch emails
-    return await email_service.fetch_emails(hours=hours, limit=limit)
+    # End the read transaction so no pooled connection is held across IMAP round trips
+    await db.commit()
+    
+    # Revalidate with STATUS only; skip SELECT/SEARCH/FETCH when nothing changed
+    filters = (before_uid, after_uid, sender, subject, text, unseen)
+    etag = listing_etag(await email_service.mailbox_status(), since_date(hours), limit, *filters)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    
+    if before_uid is not None or after_uid is not None or sender or subject or text or unseen:
+        # Cursor pages and filters go straight to UID SEARCH
+        page = await email_service.fetch_email_page(hours, limit, *filters)
+        if page.next_cursor is not None:
+            response.headers["X-Next-Cursor"] = str(page.next_cursor)
+        return page.entries
+    
+    # Index anything new, then list from the database
+    emails = await message_index.list_emails(db_mailbox, email_service, hours, limit)
+    if emails and len(emails) == limit:
+        # Older mail may exist; continue with before_uid
+        response.headers["X-Next-Cursor"] = emails[0].id
+    return emails
 
 @mailbox_router.get("/email/{message_id}", response_model=schemas.EmailDetail)
 async def get_email_detail_mailcow(
     message_id: str,
     mailbox: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get email detail using Mailcow individual authentication.
     """
     # Get mailbox info
-    db_mailbox = db.query(models.Mailbox).filter(models.Mailbox.email == mailbox).first()
+    db_mailbox = await db.scalar(select(models.Mailbox).where(models.Mailbox.email == mailbox))
     if not db_mailbox:
         raise HTTPException(status_code=404, detail="Mailbox not found")
     
@@ -358,8 +410,87 @@ async def get_email_detail_mailcow(
         password=db_mailbox.password
     )
     
+    # End the read transaction so no pooled connection is held across IMAP round trips
+    await db.commit()
+    
     email_detail = await email_service.get_email(message_id)
     if not email_detail:
         raise HTTPException(status_code=404, detail="Email not found")
     
+    # Make the body searchable now that it has been read
+    await message_search.store_body(db, db_mailbox.id, email_detail)
+    
     return email_detail
+
+@mailbox_router.get("/email/{message_id}/attachments/{part}")
+async def download_attachment_mailcow(
+    message_id: str,
+    part: str,
+    mailbox: str,
+    range_header: str = Header(default=None, alias="Range"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Download one attachment, streamed from the mail server in chunks.
+    `part` is the IMAP section number from `attachment_parts` in the email detail.
+    Single byte ranges (Range: bytes=start-end) are supported when the size is known.
+    """
+    # The part number goes into the FETCH command, so only accept section numbers
+    if not message_id.isdigit() or not re.fullmatch(r"\d+(\.\d+)*", part):
+        raise HTTPException(status_code=400, detail="Invalid message id or part")
+    
+    # Get mailbox info
+    db_mailbox = await db.scalar(select(models.Mailbox).where(models.Mailbox.email == mailbox))
+    if not db_mailbox:
+        raise HTTPException(status_code=404, detail="Mailbox not found")
+    
+    if not db_mailbox.password:
+        raise HTTPException(status_code=500, detail="Mailbox password not available")
+    
+    # Use Mailcow email service
+    email_service = MailcowEmailService(
+        imap_host=db_mailbox.domain.imap_host,
+        imap_port=db_mailbox.domain.imap_port,
+        email_address=mailbox,
+        password=db_mailbox.password
+    )
+    
+    # End the read transaction so no pooled connection is held across IMAP round trips
+    await db.commit()
+    
+    opening = asyncio.ensure_future(email_service.open_attachment(message_id, part))
+    try:
+        download = await asyncio.shield(opening)
+    except asyncio.CancelledError:
+        # The IMAP worker still finishes opening it; log out the session nobody will stream
+        def discard(task: asyncio.Task) -> None:
+            if not task.cancelled() and task.exception() is None and task.result() is not None:
+                task.result().discard()
+        opening.add_done_callback(discard)
+        raise
+    if not download:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    
+    headers = {
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(download.filename)}",
+        "Accept-Ranges": "bytes" if download.length is not None else "none",
+    }
+    try:
+        byte_range = parse_range(range_header, download.length)
+    except ValueError:
+        await download.close()
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{download.length}"}
+        )
+    
+    if byte_range is None:
+        if download.length is not None:
+            headers["Content-Length"] = str(download.length)
+        return AttachmentResponse(download, headers=headers)
+    
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{download.length}"
+    headers["Content-Length"] = str(end - start + 1)
+    return AttachmentResponse(download, start, end, status_code=206, headers=headers)
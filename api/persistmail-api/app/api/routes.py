@@ -1,12 +1,20 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import List
-from app.db.session import get_db
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Header, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from app.db.session import AsyncSessionLocal, get_db
 from app.models import models, schemas
 from app.services.email_service import EmailService
-from app.services.mailbox_service import MailboxService
+from app.services.last_access import last_access
+from app.services.mailbox_provisioning import mailbox_provisioner
+from app.services.mailbox_fanout import mailbox_fanout
+from app.services.mailbox_watcher import mailbox_watchers
+from app.services.imap_fetch import listing_etag, etag_matches, since_date
+from app.services.message_index import message_index
+from app.services.message_search import message_search
 from app.core.config import settings
+import json
 import random
 import string
 
@@ -18,56 +26,80 @@ def generate_random_mailbox(domain: str, length: int = 10) -> str:
     random_str = ''.join(random.choice(chars) for _ in range(length))
     return f"{random_str}@{domain}"
 
+@email_router.post("/emails/batch")
+async def get_emails_for_mailboxes(batch: schemas.MailboxBatchRequest):
+    """
+    List several mailboxes at once, as NDJSON.
+    
+    Mailboxes are listed concurrently (a few at a time per mail server) and
+    each line is sent as soon as its mailbox is done: {"mailbox", "emails"}
+    with entries shaped like /emails/{mailbox}, or {"mailbox", "status_code",
+    "error"}. Mailboxes are not created automatically.
+    """
+    mailboxes = list(dict.fromkeys(batch.mailboxes))
+    if not mailboxes or len(mailboxes) > settings.MAILBOX_FANOUT_MAX_MAILBOXES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Send between 1 and {settings.MAILBOX_FANOUT_MAX_MAILBOXES} mailboxes"
+        )
+    hours = settings.DEFAULT_HOURS_RETENTION if batch.hours is None else batch.hours
+    limit = settings.DEFAULT_EMAIL_LIMIT if batch.limit is None else batch.limit
+    if not 0 <= hours <= 72 or not 0 <= limit <= settings.MAX_EMAIL_LIMIT:
+        raise HTTPException(status_code=400, detail="Invalid hours or limit")
+    
+    async def result_lines():
+        async for result in mailbox_fanout.list_mailboxes(mailboxes, hours, limit):
+            yield json.dumps(result) + "\n"
+    
+    return StreamingResponse(result_lines(), media_type="application/x-ndjson")
+
 @email_router.get("/emails/{mailbox}", response_model=List[schemas.EmailList])
 async def get_emails(
     mailbox: str,
+    response: Response,
     hours: int = Query(default=settings.DEFAULT_HOURS_RETENTION, le=72),
     limit: int = Query(default=settings.DEFAULT_EMAIL_LIMIT, le=settings.MAX_EMAIL_LIMIT),
-    db: Session = Depends(get_db)
+    before_uid: Optional[int] = Query(default=None, ge=1),
+    after_uid: Optional[int] = Query(default=None, ge=0),
+    sender: Optional[str] = Query(default=None, alias="from"),
+    subject: Optional[str] = None,
+    text: Optional[str] = None,
+    unseen: bool = False,
+    if_none_match: str = Header(default=None),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Retrieve emails for a given mailbox.
     If mailbox doesn't exist, it will be created automatically using Mailcow API.
+    Responses carry an ETag; send it back in If-None-Match to get 304 when nothing changed.
+    Page with before_uid/after_uid using the X-Next-Cursor header; from, subject,
+    text and unseen filter on the mail server.
     """
     # Check if mailbox exists in database
-    db_mailbox = db.query(models.Mailbox).filter(models.Mailbox.email == mailbox).first()
+    db_mailbox = await db.scalar(select(models.Mailbox).where(models.Mailbox.email == mailbox))
     
     if not db_mailbox:
         # Get domain from email
         domain_name = mailbox.split('@')[1]
         
         # Check if domain exists in database
-        domain = db.query(models.Domain).filter(
+        domain = await db.scalar(select(models.Domain).where(
             models.Domain.domain == domain_name,
             models.Domain.is_active == True
-        ).first()
+        ))
         
         if not domain:
             raise HTTPException(status_code=500, detail=f"Domain {domain_name} not configured")
         
-        # Create mailbox using Mailcow API
-        mailbox_service = MailboxService()
-        
+        # Create mailbox using Mailcow API; concurrent requests for the
+        # same new address share one creation
         try:
-            mailbox_result = await mailbox_service.create_mailbox(mailbox, domain_name)
-            
-            # Create mailbox record in database
-            # Store shared password (IMAP_SECRET) for consistency
-            db_mailbox = models.Mailbox(
-                email=mailbox,
-                domain_id=domain.id,
-                password=settings.IMAP_SECRET,  # Use shared password from config
-                quota_mb=mailbox_result["quota"],
-                mailcow_managed=True
-            )
-            
-            # Set expiration time
-            db_mailbox.set_expiry(settings.MAILBOX_EXPIRY_HOURS)
-            
-            db.add(db_mailbox)
-            db.commit()
-            db.refresh(db_mailbox)
+            mailbox_id = await mailbox_provisioner.ensure(mailbox, domain.id, domain_name)
+            db_mailbox = await db.get(models.Mailbox, mailbox_id)
             
+        except HTTPException:
+            # e.g. 503 while another worker is still creating it: keep the retry signal
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=500,
@@ -78,9 +110,8 @@ async def get_emails(
     if db_mailbox.is_expired:
         raise HTTPException(status_code=410, detail="Mailbox has expired")
     
-    # Update last accessed time
-    db_mailbox.last_accessed = func.now()
-    db.commit()
+    # Record the access; written to the database in the next bulk flush
+    last_access.touch(db_mailbox)
     
     # Always use shared secret (IMAP_SECRET) for authentication
     # This ensures consistency and easy password rotation
@@ -94,19 +125,171 @@ async def get_emails(
         auth_password  # Shared secret from IMAP_SECRET
     )
     
-    # Fetch emails
-    return await email_service.fetch_emails(hours=hours, limit=limit)
+    # End the read transaction so no pooled connection is held across IMAP round trips
+    await db.commit()
+    
+    # Revalidate with STATUS only; skip SELECT/SEARCH/FETCH when nothing changed
+    filters = (before_uid, after_uid, sender, subject, text, unseen)
+    etag = listing_etag(await email_service.mailbox_status(), since_date(hours), limit, *filters)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    
+    if before_uid is not None or after_uid is not None or sender or subject or text or unseen:
+        # Cursor pages and filters go straight to UID SEARCH
+        page = await email_service.fetch_email_page(hours, limit, *filters)
+        if page.next_cursor is not None:
+            response.headers["X-Next-Cursor"] = str(page.next_cursor)
+        return page.entries
+    
+    # Index anything new, then list from the database
+    emails = await message_index.list_emails(db_mailbox, email_service, hours, limit)
+    if emails and len(emails) == limit:
+        # Older mail may exist; continue with before_uid
+        response.headers["X-Next-Cursor"] = emails[0].id
+    return emails
+
+@email_router.get("/emails/{mailbox}/stream")
+async def stream_emails(
+    mailbox: str,
+    request: Request,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Stream new-mail events for a mailbox as Server-Sent Events.
+    
+    Events are "message" (a new email, shaped like the list endpoint),
+    "expunge" (ids of removed emails), "resync" (refetch the list) and "error".
+    One IMAP IDLE session per mailbox is shared by all of its subscribers.
+    """
+    db_mailbox = await db.scalar(select(models.Mailbox).where(models.Mailbox.email == mailbox))
+    if not db_mailbox:
+        raise HTTPException(status_code=404, detail="Mailbox not found")
+    
+    if db_mailbox.is_expired:
+        raise HTTPException(status_code=410, detail="Mailbox has expired")
+    
+    # A watched mailbox is in use: keep it out of the inactivity cleanup
+    last_access.touch(db_mailbox)
+    
+    email_service = EmailService(
+        db_mailbox.domain.imap_host,
+        db_mailbox.domain.imap_port,
+        mailbox,
+        settings.IMAP_SECRET
+    )
+    subscription = mailbox_watchers.subscribe(email_service.pool_key, email_service.connect)
+    
+    async def event_stream():
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                event = await subscription.next_event(settings.IMAP_STREAM_HEARTBEAT_SECONDS)
+                # Still open after every event or keep-alive; the buffer writes it at most once per flush
+                last_access.touch(db_mailbox)
+                if event is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+        finally:
+            mailbox_watchers.unsubscribe(email_service.pool_key, subscription)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@email_router.get("/emails/{mailbox}/search", response_model=List[schemas.EmailList])
+async def search_emails(
+    mailbox: str,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(default=settings.DEFAULT_EMAIL_LIMIT, ge=1, le=settings.MAX_EMAIL_LIMIT),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Search emails the API has already indexed for a mailbox, newest first.
+    
+    Every word of q must match subject, sender, preview or (for emails that
+    have been opened) body text; words match as prefixes. New mail becomes
+    searchable once the mailbox has been listed.
+    """
+    db_mailbox = await db.scalar(select(models.Mailbox).where(models.Mailbox.email == mailbox))
+    if not db_mailbox:
+        raise HTTPException(status_code=404, detail="Mailbox not found")
+    
+    if db_mailbox.is_expired:
+        raise HTTPException(status_code=410, detail="Mailbox has expired")
+    
+    return await message_search.search(db, db_mailbox.id, q, limit)
+
+@email_router.post("/emails/{mailbox}/batch")
+async def get_email_batch(
+    mailbox: str,
+    batch: schemas.EmailBatchRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Retrieve the details of several emails at once, as NDJSON.
+    
+    Each line is an email shaped like the detail endpoint, or
+    {"id": ..., "error": "Email not found"}. Lines arrive as soon as each email
+    is ready (cached ones first), not in request order. All emails are read
+    over one IMAP session and are not marked as read.
+    """
+    uids = list(dict.fromkeys(batch.uids))
+    if not uids or len(uids) > settings.MAX_EMAIL_LIMIT:
+        raise HTTPException(status_code=400, detail=f"Send between 1 and {settings.MAX_EMAIL_LIMIT} uids")
+    if any(uid < 1 for uid in uids):
+        raise HTTPException(status_code=400, detail="Invalid uid")
+    
+    db_mailbox = await db.scalar(select(models.Mailbox).where(models.Mailbox.email == mailbox))
+    if not db_mailbox:
+        raise HTTPException(status_code=404, detail="Mailbox not found")
+    
+    if db_mailbox.is_expired:
+        raise HTTPException(status_code=410, detail="Mailbox has expired")
+    
+    mailbox_id = db_mailbox.id
+    email_service = EmailService(
+        db_mailbox.domain.imap_host,
+        db_mailbox.domain.imap_port,
+        mailbox,
+        settings.IMAP_SECRET
+    )
+    
+    async def detail_lines():
+        details = []
+        try:
+            async for uid, email_detail in email_service.get_emails(uids):
+                if email_detail is None:
+                    yield json.dumps({"id": str(uid), "error": "Email not found"}) + "\n"
+                    continue
+                details.append(email_detail)
+                yield email_detail.model_dump_json() + "\n"
+        except HTTPException as e:
+            yield json.dumps({"error": e.detail}) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": f"Failed to get email detail: {str(e)}"}) + "\n"
+        
+        # The request's session is already closed while streaming
+        async with AsyncSessionLocal() as index_db:
+            for email_detail in details:
+                await message_search.store_body(index_db, mailbox_id, email_detail)
+    
+    return StreamingResponse(detail_lines(), media_type="application/x-ndjson")
 
 @email_router.get("/email/{message_id}", response_model=schemas.EmailDetail)
 async def get_email_detail(
     message_id: str,
     mailbox: str = Query(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Retrieve detailed information about a specific email.
     """
-    db_mailbox = db.query(models.Mailbox).filter(models.Mailbox.email == mailbox).first()
+    db_mailbox = await db.scalar(select(models.Mailbox).where(models.Mailbox.email == mailbox))
     if not db_mailbox:
         raise HTTPException(status_code=404, detail="Mailbox not found")
     
@@ -124,16 +307,22 @@ async def get_email_detail(
         auth_password
     )
     
+    # End the read transaction so no pooled connection is held across IMAP round trips
+    await db.commit()
+    
     email_detail = await email_service.get_email(message_id)
     if not email_detail:
         raise HTTPException(status_code=404, detail="Email not found")
+    
+    # Make the body searchable now that it has been read
+    await message_search.store_body(db, db_mailbox.id, email_detail)
         
     return email_detail
 
 @email_router.get("/domains", response_model=List[schemas.DomainResponse])
-async def get_domains(db: Session = Depends(get_db)):
+async def get_domains(db: AsyncSession = Depends(get_db)):
     """
     Retrieve list of available domains.
     """
-    domains = db.query(models.Domain).filter(models.Domain.is_active == True).all()
-    return domains
+    domains = await db.scalars(select(models.Domain).where(models.Domain.is_active == True))
+    return domains.all()
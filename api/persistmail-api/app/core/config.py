@@ -16,6 +16,20 @@ class Settings(BaseSettings):
     # Database Settings
     DATABASE_URL: str = "sqlite:///./persistmail.db"
     
+    # SQLite Profile Settings (applied to every connection of a file database)
+    DB_SQLITE_JOURNAL_MODE: str = "WAL"       # Readers and the writer don't block each other
+    DB_SQLITE_SYNCHRONOUS: str = "NORMAL"     # No fsync per commit; safe with WAL
+    DB_SQLITE_BUSY_TIMEOUT_MS: int = 5000     # Wait this long for the write lock before "database is locked"
+    DB_SQLITE_MMAP_SIZE_MB: int = 256
+    
+    # PostgreSQL Pool Settings (per process, for each of the blocking and asyncio engines)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT_SECONDS: int = 30         # Wait for a free connection before failing
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+    DB_POOL_PRE_PING: bool = True             # Replace connections the server or a proxy dropped
+    DB_STATEMENT_TIMEOUT_MS: int = 30000      # 0 disables the server-side statement timeout
+    
     # Mail Server Settings
     MAIL_DOMAIN: str = ""         # e.g., example.com
     IMAP_HOST: str = ""          # e.g., imap.example.com
@@ -33,12 +47,42 @@ class Settings(BaseSettings):
     MAILCOW_ENABLED: bool = True        # Enable Mailcow integration
     MAILCOW_DEFAULT_QUOTA_MB: int = 25  # Default quota for new mailboxes
     MAILCOW_MAX_QUOTA_MB: int = 25     # Maximum quota allowed
+    MAILCOW_DELETE_BATCH_SIZE: int = 100  # Mailboxes per Mailcow delete call
+    
+    # Mailbox Warm Pool Settings (per domain; high watermark 0 disables the pool)
+    MAILBOX_POOL_LOW_WATERMARK: int = 10             # Refill when fewer unassigned mailboxes remain
+    MAILBOX_POOL_HIGH_WATERMARK: int = 0             # Refill up to this many
+    MAILBOX_POOL_REFILL_INTERVAL_SECONDS: int = 30   # How often pool depth is checked
+    MAILBOX_POOL_REFILL_CONCURRENCY: int = 4         # Mailcow add calls in flight while refilling
+    
+    # Mailbox Auto-Creation Settings (concurrent requests for a new address share one creation)
+    MAILBOX_PROVISIONING_DB_LEASE: bool = True       # Also coordinate workers through the database
+    MAILBOX_PROVISIONING_LEASE_SECONDS: int = 60     # A lease older than this is taken over
+    MAILBOX_PROVISIONING_WAIT_SECONDS: int = 30      # How long a request waits for another worker
+    
+    # Mailcow Job Queue Settings (mailbox creates/deletes requested by API calls)
+    MAILCOW_JOB_BATCH_SIZE: int = 100            # Jobs claimed per worker pass
+    MAILCOW_JOB_CONCURRENCY: int = 4             # Mailbox creations in flight
+    MAILCOW_JOB_MAX_ATTEMPTS: int = 8            # Attempts before a job is marked failed
+    MAILCOW_JOB_RETRY_BASE_SECONDS: int = 5      # First retry delay, doubled per attempt
+    MAILCOW_JOB_RETRY_MAX_SECONDS: int = 600     # Longest retry delay
+    MAILCOW_JOB_POLL_SECONDS: int = 5            # Queue check interval when idle
+    MAILCOW_JOB_LOCK_SECONDS: int = 300          # A running job older than this is picked up again
+    MAILCOW_JOB_RETENTION_HOURS: int = 24        # Finished jobs are kept this long
+    
+    # Mailcow Domain Cache Settings
+    MAILCOW_DOMAIN_CACHE_TTL_SECONDS: int = 300     # Domain list age before a refresh is due
+    MAILCOW_DOMAIN_CACHE_STALE_SECONDS: int = 3600  # How long past that a stale list is served while refreshing
     
     # Mailbox Lifecycle Settings
     DEFAULT_MAILBOX_EXPIRY_HOURS: int = 24    # Default expiry time
     MAX_MAILBOX_EXPIRY_HOURS: int = 168       # Maximum expiry time (7 days)
     CLEANUP_INTERVAL_MINUTES: int = 60        # How often to run cleanup
     
+    # Last Access Settings (mailbox polls are written behind, in one bulk UPDATE per flush)
+    LAST_ACCESS_FLUSH_INTERVAL_SECONDS: int = 30   # How often recorded accesses are written
+    LAST_ACCESS_STALENESS_SECONDS: int = 300       # A stored last access this recent is not refreshed
+    
     # Email Settings
     DEFAULT_HOURS_RETENTION: int = 24
     DEFAULT_EMAIL_LIMIT: int = 25
@@ -57,6 +101,49 @@ class Settings(BaseSettings):
     HTTP_TIMEOUT_SECONDS: int = 30
     ATTACHMENT_SIZE_THRESHOLD: int = 50000  # Bytes to consider email has attachments
     EMAIL_SNIPPET_LENGTH: int = 100
+    EMAIL_SNIPPET_FETCH_BYTES: int = 2048   # Partial body bytes fetched per message for snippets
+    EMAIL_DETAIL_FULL_FETCH_BYTES: int = 262144  # Larger messages only fetch their text parts
+    EMAIL_BATCH_FETCH_BYTES: int = 4194304       # Message bytes per FETCH when loading a batch of emails
+    
+    # Mailcow API Client Settings (one pooled keep-alive client per process)
+    HTTP_MAX_CONNECTIONS: int = 20             # Open connections to the Mailcow API
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 10   # Idle connections kept for reuse
+    HTTP_KEEPALIVE_EXPIRY_SECONDS: int = 30    # Close idle connections after this long
+    HTTP2_ENABLED: bool = False                # Needs the h2 package (httpx[http2])
+    
+    # IMAP Session Pool Settings
+    IMAP_POOL_MAX_SESSIONS: int = 200          # Idle sessions kept across all mailboxes
+    IMAP_POOL_IDLE_TIMEOUT_SECONDS: int = 300  # Close sessions idle longer than this
+    IMAP_POOL_PRUNE_INTERVAL_SECONDS: int = 60  # How often idle sessions are swept
+    
+    # IMAP Worker Settings
+    IMAP_WORKER_THREADS: int = 16              # Threads running blocking IMAP calls
+    IMAP_MAX_QUEUED_TASKS: int = 200           # Queued IMAP calls before returning 503
+    
+    # New-Mail Stream (IMAP IDLE) Settings
+    IMAP_IDLE_MAX_SESSIONS_PER_HOST: int = 100  # Concurrent IDLE sessions per IMAP host
+    IMAP_IDLE_CHECK_SECONDS: int = 10          # How long each IDLE wait blocks
+    IMAP_IDLE_RENEW_SECONDS: int = 1500        # Re-issue IDLE before the server's 30 min cutoff
+    IMAP_IDLE_RECONNECT_SECONDS: int = 5       # Delay before reconnecting a dropped IDLE session
+    IMAP_STREAM_QUEUE_SIZE: int = 100          # Pending events per subscriber before resync
+    IMAP_STREAM_HEARTBEAT_SECONDS: int = 15    # Keep-alive comment interval for idle streams
+    
+    # Mailbox Sync Cache Settings
+    MAILBOX_SYNC_CACHE_SIZE: int = 1000        # Mailboxes whose header cache is kept in memory
+    
+    # Attachment Download Settings
+    ATTACHMENT_CHUNK_BYTES: int = 262144       # Encoded bytes per partial FETCH while streaming
+    
+    # Raw Message Cache Settings
+    MESSAGE_CACHE_DIR: str = "./message-cache"           # Where raw messages are cached on disk
+    MESSAGE_CACHE_MAX_BYTES: int = 512 * 1024 * 1024     # Disk budget, 0 disables the cache
+    
+    # Search Settings
+    SEARCH_BODY_MAX_CHARS: int = 20000         # Body text kept per message for full-text search
+    
+    # Multi-Mailbox Listing Settings
+    MAILBOX_FANOUT_MAX_MAILBOXES: int = 100    # Mailboxes per POST /emails/batch request
+    MAILBOX_FANOUT_PER_HOST: int = 8           # Concurrent listings per IMAP host
     
     # Security Settings
     SSL_VERIFY_CERTS: bool = False  # For self-signed certificates
@@ -1,6 +1,6 @@
 from sqlalchemy.orm import Session
 from app.models.models import Domain
-from app.db.session import get_db, engine
+from app.db.session import SessionLocal, engine
 from app.core.config import settings
 import sys
 import os
@@ -65,7 +65,7 @@ def init_db():
         print("Please check your .env file and set all required variables")
         return False
         
-    db = next(get_db())
+    db = SessionLocal()
     try:
         domain = create_default_domain(db)
         if domain:
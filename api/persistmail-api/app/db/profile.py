@@ -0,0 +1,90 @@
+"""
+Engine settings per database backend.
+
+SQLite runs in WAL mode, so readers no longer block the writer and the
+writer doesn't block readers. Concurrent writers (last_accessed updates,
+cleanup deletes, job claims) wait up to DB_SQLITE_BUSY_TIMEOUT_MS for the
+write lock instead of failing with "database is locked". synchronous=NORMAL
+skips the fsync on every commit, which WAL keeps crash-safe (a power loss
+can only drop the last commits), and mmap_size lets reads come straight
+from the page cache.
+
+PostgreSQL gets a sized connection pool per engine, pre-ping so
+connections dropped by the server or a proxy are replaced before use, and
+a server-side statement timeout so one runaway query cannot hold a pooled
+connection indefinitely.
+"""
+
+from typing import Any, Dict
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from app.core.config import settings
+
+
+def async_database_url(url: str) -> str:
+    """DATABASE_URL with its asyncio driver (aiosqlite for SQLite, asyncpg for PostgreSQL)."""
+    parsed = make_url(url)
+    if parsed.drivername in ("sqlite", "sqlite+pysqlite"):
+        return parsed.set(drivername="sqlite+aiosqlite").render_as_string(hide_password=False)
+    if parsed.get_backend_name() == "postgresql" and parsed.drivername != "postgresql+asyncpg":
+        return parsed.set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+    return url
+
+
+def engine_options(url: str) -> Dict[str, Any]:
+    """
+    Keyword arguments for create_engine/create_async_engine.
+
+    Args:
+        url: Database URL the engine is created for (sync or async driver)
+
+    Returns:
+        Options for the backend of the URL
+    """
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend == "sqlite":
+        return {"connect_args": {"check_same_thread": False}}
+    if backend != "postgresql":
+        return {}
+
+    options: Dict[str, Any] = {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT_SECONDS,
+        "pool_recycle": settings.DB_POOL_RECYCLE_SECONDS,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+    if settings.DB_STATEMENT_TIMEOUT_MS > 0:
+        timeout = str(settings.DB_STATEMENT_TIMEOUT_MS)
+        if parsed.get_driver_name() == "asyncpg":
+            options["connect_args"] = {"server_settings": {"statement_timeout": timeout}}
+        elif parsed.get_driver_name() in ("psycopg2", "psycopg"):
+            options["connect_args"] = {"options": f"-c statement_timeout={timeout}"}
+    return options
+
+
+def apply_profile(engine: Engine) -> None:
+    """
+    Set the per-connection pragmas on a SQLite engine (no-op for other backends).
+
+    Args:
+        engine: Blocking engine, or the sync_engine of an asyncio engine
+    """
+    if engine.dialect.name != "sqlite":
+        return
+    database = engine.url.database
+    on_disk = bool(database) and database != ":memory:" and not database.startswith("file::memory:")
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # SQLite ignores ON DELETE CASCADE unless asked per connection
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.DB_SQLITE_BUSY_TIMEOUT_MS)}")
+        if on_disk:
+            cursor.execute(f"PRAGMA journal_mode={settings.DB_SQLITE_JOURNAL_MODE}")
+            cursor.execute(f"PRAGMA synchronous={settings.DB_SQLITE_SYNCHRONOUS}")
+            cursor.execute(f"PRAGMA mmap_size={int(settings.DB_SQLITE_MMAP_SIZE_MB) * 1024 * 1024}")
+        cursor.close()
@@ -0,0 +1,73 @@
+"""
+Full-text index of the messages table.
+
+On SQLite the messages table is mirrored into an FTS5 external-content
+table kept current by triggers, so every insert, update and delete on
+messages (including the ON DELETE CASCADE from a removed mailbox) updates
+the search index in the same transaction.
+
+The FTS rows are linked to messages by rowid. SQLite may renumber rowids on
+VACUUM, so after a manual VACUUM run
+``INSERT INTO messages_fts(messages_fts) VALUES('rebuild')``.
+"""
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+_FTS_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        mailbox_id, subject, sender, snippet, body_text,
+        content='messages', tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, mailbox_id, subject, sender, snippet, body_text)
+        VALUES (new.rowid, new.mailbox_id, new.subject, new.sender, new.snippet, new.body_text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, mailbox_id, subject, sender, snippet, body_text)
+        VALUES ('delete', old.rowid, old.mailbox_id, old.subject, old.sender, old.snippet, old.body_text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, mailbox_id, subject, sender, snippet, body_text)
+        VALUES ('delete', old.rowid, old.mailbox_id, old.subject, old.sender, old.snippet, old.body_text);
+        INSERT INTO messages_fts(rowid, mailbox_id, subject, sender, snippet, body_text)
+        VALUES (new.rowid, new.mailbox_id, new.subject, new.sender, new.snippet, new.body_text);
+    END
+    """,
+]
+
+
+def create_search_index(engine: Engine) -> bool:
+    """
+    Create the FTS5 table and triggers if the database supports them.
+
+    Args:
+        engine: Blocking engine the tables were created with
+
+    Returns:
+        True if full-text search is available
+    """
+    if engine.dialect.name != "sqlite":
+        return False
+    try:
+        with engine.begin() as conn:
+            existed = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")
+            ).first() is not None
+            for statement in _FTS_SCHEMA:
+                conn.execute(text(statement))
+            if not existed:
+                # Index rows written before search existed
+                conn.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"))
+        return True
+    except OperationalError as e:
+        print(f"Full-text search unavailable, using LIKE matching: {str(e)}")
+        return False
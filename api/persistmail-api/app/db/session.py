@@ -1,21 +1,29 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
+from app.db.profile import apply_profile, async_database_url, engine_options
+from app.db.search_index import create_search_index
 from app.models.models import Base
 
-engine = create_engine(
-    settings.DATABASE_URL,
-    connect_args={"check_same_thread": False}  # Needed for SQLite
-)
+# Blocking engine: schema setup at startup and the maintenance scripts
+engine = create_engine(settings.DATABASE_URL, **engine_options(settings.DATABASE_URL))
+apply_profile(engine)
+
+# Request handlers and background services use the asyncio engine, so
+# database round trips don't hold up the event loop
+ASYNC_DATABASE_URL = async_database_url(settings.DATABASE_URL)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+apply_profile(async_engine.sync_engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Loaded attributes stay usable after commit; lazy loads are not possible under asyncio
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 # Create tables
 Base.metadata.create_all(bind=engine)
+FTS_ENABLED = create_search_index(engine)
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, create_engine, Text
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, ForeignKey, Index, create_engine, Text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime, timedelta
@@ -22,6 +22,9 @@ class Domain(Base):
 
 class Mailbox(Base):
     __tablename__ = "mailboxes"
+    __table_args__ = (
+        Index("ix_mailboxes_domain_pooled", "domain_id", "pooled"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String, unique=True, index=True, nullable=False)
@@ -31,10 +34,14 @@ class Mailbox(Base):
     quota_used_mb = Column(Integer, default=0)  # Used quota in MB
     expires_at = Column(DateTime, nullable=True)  # When mailbox expires
     mailcow_managed = Column(Boolean, default=True)  # Whether managed by Mailcow
+    pooled = Column(Boolean, default=False)  # Created ahead of time, not yet handed out
     last_accessed = Column(DateTime, default=datetime.utcnow)
     created_at = Column(DateTime, default=datetime.utcnow)
     
-    domain = relationship("Domain", back_populates="mailboxes")
+    # Loaded with the mailbox: every caller needs the IMAP host, and async sessions can't lazy-load
+    domain = relationship("Domain", back_populates="mailboxes", lazy="joined")
+    # Rows are removed by ON DELETE CASCADE, not loaded and deleted one by one
+    messages = relationship("Message", back_populates="mailbox", passive_deletes=True)
 
     @property
     def quota_percentage(self) -> float:
@@ -61,3 +68,52 @@ class Mailbox(Base):
     def set_expiry(self, hours: int) -> None:
         """Set the expiration time for the mailbox."""
         self.expires_at = datetime.utcnow() + timedelta(hours=hours)
+
+class Message(Base):
+    """Header index of a message in a mailbox's INBOX, as shown by the list endpoints."""
+    __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_mailbox_received", "mailbox_id", "received_date"),
+    )
+    
+    mailbox_id = Column(Integer, ForeignKey("mailboxes.id", ondelete="CASCADE"), primary_key=True)
+    uidvalidity = Column(BigInteger, primary_key=True)
+    uid = Column(BigInteger, primary_key=True)
+    subject = Column(Text, nullable=False)
+    sender = Column(Text, nullable=False)
+    received_date = Column(DateTime, nullable=False)  # Date header, as returned by the API
+    internal_date = Column(DateTime, nullable=True)  # Server arrival time, used for the hours window
+    size = Column(Integer, default=0)
+    has_attachments = Column(Boolean, default=False)
+    snippet = Column(Text, nullable=False)
+    body_text = Column(Text, nullable=True)  # Decoded body, filled in once the email is opened; searchable
+    indexed_at = Column(DateTime, default=datetime.utcnow)
+    
+    mailbox = relationship("Mailbox", back_populates="messages")
+
+class MailboxProvisioning(Base):
+    """Lease held by the worker that is creating a mailbox, so other workers wait instead of creating it too."""
+    __tablename__ = "mailbox_provisioning"
+    
+    email = Column(String, primary_key=True)
+    started_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class MailcowJob(Base):
+    """Mailcow call queued by a request and carried out by the job worker (outbox)."""
+    __tablename__ = "mailcow_jobs"
+    __table_args__ = (
+        Index("ix_mailcow_jobs_status_run_after", "status", "run_after"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)  # create_mailbox, delete_mailbox
+    email = Column(String, nullable=False, index=True)
+    quota_mb = Column(Integer, nullable=True)
+    status = Column(String, nullable=False, default="pending")  # pending, running, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)  # Not retried before this
+    locked_by = Column(String, nullable=True)  # Worker running the job
+    locked_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
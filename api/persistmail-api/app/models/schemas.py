@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from typing import List, Optional
 from datetime import datetime
 
@@ -15,15 +15,32 @@ class EmailList(EmailBase):
     class Config:
         from_attributes = True
 
+class AttachmentInfo(BaseModel):
+    part: str           # IMAP section number, e.g. "2" or "1.3"
+    filename: str
+    content_type: str
+    size: int           # Encoded size in bytes as stored on the server
+
 class EmailDetail(EmailBase):
     id: str
     body_html: Optional[str]
     body_text: str
     attachments: List[str]
+    attachment_parts: List[AttachmentInfo] = []
+    # UIDVALIDITY the message was read under; internal, not part of the response
+    uidvalidity: Optional[int] = Field(default=None, exclude=True)
     
     class Config:
         from_attributes = True
 
+class EmailBatchRequest(BaseModel):
+    uids: List[int]     # Message UIDs (the "id" of list entries)
+
+class MailboxBatchRequest(BaseModel):
+    mailboxes: List[str]
+    hours: Optional[int] = None     # Defaults to DEFAULT_HOURS_RETENTION
+    limit: Optional[int] = None     # Defaults to DEFAULT_EMAIL_LIMIT
+
 # Mailbox Schemas
 class MailboxCreate(BaseModel):
     domain: Optional[str] = None
@@ -38,6 +55,7 @@ class MailboxCreateResponse(BaseModel):
     expires_at: Optional[datetime]
     quota_mb: int
     domain_info: dict
+    status: str = "active"  # "provisioning" until Mailcow has created it
     
     class Config:
         from_attributes = True
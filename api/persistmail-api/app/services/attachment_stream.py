@@ -0,0 +1,260 @@
+"""
+Stream a single MIME part to the client in bounded chunks.
+
+Each chunk is one BODY.PEEK[part]<offset.length> partial fetch, decoded as
+it arrives, so memory per download stays at roughly one chunk whatever the
+attachment size. Byte ranges refer to the decoded content. They can be
+served directly for unencoded parts and for base64 with fixed line
+lengths (what every MIME encoder writes), because decoded offsets map onto
+encoded offsets. Other parts are streamed whole without a known length.
+"""
+
+import asyncio
+import base64
+import binascii
+import quopri
+import re
+from typing import AsyncIterator, Iterator, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from imapclient import IMAPClient
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+from app.core.config import settings
+from app.services.imap_executor import imap_executor
+from app.services.imap_fetch import BodyPart
+from app.services.imap_pool import PoolKey, imap_pool
+
+# Bytes read from the start and end of a base64 part to learn its line layout
+_PROBE_BYTES = 4096
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# Logouts still running; the loop itself only keeps weak references to tasks
+_logouts: Set[asyncio.Task] = set()
+
+
+class AttachmentDownload:
+    """
+    One attachment being served, holding a pooled IMAP session until it is
+    streamed or closed.
+
+    Serve it with AttachmentResponse, which closes it however the response
+    ends; a stream that never started (the client left first) would
+    otherwise never give the session back.
+    """
+
+    def __init__(self, key: PoolKey, server: IMAPClient, uid: int, part: BodyPart):
+        self.key = key
+        self.server = server
+        self.uid = uid
+        self.part = part
+        self.length: Optional[int] = None   # Decoded size, when it can be known up front
+        self._line_length = 0               # Base64 characters per line
+        self._newline = 0                   # Bytes in each line break
+        self._closed = False
+        self._streaming = False             # A stream started and has not finished
+
+    @property
+    def filename(self) -> str:
+        return self.part.filename or f"part-{self.part.section}"
+
+    @property
+    def content_type(self) -> str:
+        return self.part.content_type
+
+    def prepare(self) -> None:
+        """Work out the decoded length; runs on the IMAP worker thread."""
+        if self.part.encoding == "base64":
+            self._probe_base64()
+        elif self.part.encoding != "quoted-printable":
+            # 7bit, 8bit and binary are stored as-is
+            self.length = self.part.size
+
+    async def stream(self, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """
+        Yield decoded bytes start..end (inclusive), then return the session to the pool.
+
+        Args:
+            start: First decoded byte; must be 0 unless length is known
+            end: Last decoded byte, or None for the rest of the part
+        """
+        if self._closed:
+            return
+        self._streaming = True
+        chunks = self._iter_decoded(start, end)
+        try:
+            while True:
+                chunk = await imap_executor.run(next, chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+        except BaseException:
+            # Client went away or the server failed mid-part: the session state is unknown
+            self.discard()
+            raise
+        self._streaming = False
+        await self.close()
+
+    async def close(self) -> None:
+        """Give the session back; safe to call more than once."""
+        if self._streaming:
+            # Stopped part-way through the part
+            self.discard()
+        elif not self._closed:
+            self._closed = True
+            imap_pool.release(self.key, self.server)
+
+    def discard(self) -> None:
+        """Log the session out instead of pooling it; must be called on the event loop."""
+        if not self._closed:
+            self._closed = True
+            logout = asyncio.ensure_future(self._logout())
+            _logouts.add(logout)
+            logout.add_done_callback(_logouts.discard)
+
+    async def _logout(self) -> None:
+        try:
+            await imap_executor.run(imap_pool.discard, self.server)
+        except HTTPException:
+            # IMAP queue full: still log out rather than leave the session open
+            await asyncio.get_running_loop().run_in_executor(None, imap_pool.discard, self.server)
+
+    def _fetch(self, offset: int, length: int) -> bytes:
+        section = self.part.section
+        response = self.server.fetch([self.uid], [f"BODY.PEEK[{section}]<{offset}.{length}>"])
+        return response.get(self.uid, {}).get(f"BODY[{section}]<{offset}>".encode()) or b""
+
+    def _probe_base64(self) -> None:
+        """Learn the line layout of a base64 part so decoded offsets can be mapped."""
+        size = self.part.size
+        if size <= 0:
+            return
+        head = self._fetch(0, min(size, _PROBE_BYTES))
+        lines = head.split(b"\n")
+        first = lines[0]
+        line_length = len(first.rstrip(b"\r"))
+        newline = 2 if first.endswith(b"\r") else 1
+        if len(lines) < 2 or line_length == 0 or line_length % 4:
+            return
+        # Every complete line but the last one of the part must be full length
+        complete = [line.rstrip(b"\r") for line in lines[:-1]]
+        if any(len(line) != line_length for line in complete[:-1]):
+            return
+
+        tail_length = min(size, line_length + 2 * newline + 8)
+        tail = self._fetch(size - tail_length, tail_length)
+        content_size = size - (len(tail) - len(tail.rstrip()))
+        separators = (content_size - 1) // (line_length + newline)
+        characters = content_size - separators * newline
+        last_line = tail.rstrip().rsplit(b"\n", 1)[-1].rstrip(b"\r")
+        if characters % 4 or not 0 < len(last_line) <= line_length:
+            return
+        if b"\n" in tail.rstrip() and len(last_line) != content_size - separators * (line_length + newline):
+            return
+
+        padding = len(last_line) - len(last_line.rstrip(b"="))
+        self._line_length = line_length
+        self._newline = newline
+        self.length = characters // 4 * 3 - padding
+
+    def _iter_decoded(self, start: int, end: Optional[int]) -> Iterator[bytes]:
+        """Blocking generator of decoded chunks; each next() is one FETCH."""
+        chunk_bytes = settings.ATTACHMENT_CHUNK_BYTES
+        remaining = None if end is None else end - start + 1
+        encoding = self.part.encoding
+
+        if encoding == "base64":
+            quantum = start // 3
+            characters = quantum * 4
+            offset = characters
+            if self._line_length:
+                offset += characters // self._line_length * self._newline
+            skip = start - quantum * 3
+        elif encoding == "quoted-printable":
+            offset, skip = 0, start
+        else:
+            offset, skip = start, 0
+
+        carry = b""
+        while remaining is None or remaining > 0:
+            encoded = self._fetch(offset, chunk_bytes)
+            offset += len(encoded)
+            last = len(encoded) < chunk_bytes
+            decoded, carry = _decode_chunk(encoding, carry + encoded, last)
+
+            if skip:
+                dropped = min(skip, len(decoded))
+                decoded = decoded[dropped:]
+                skip -= dropped
+            if remaining is not None:
+                decoded = decoded[:remaining]
+                remaining -= len(decoded)
+            if decoded:
+                yield decoded
+            if last:
+                break
+
+
+class AttachmentResponse(StreamingResponse):
+    """Streams an AttachmentDownload and closes it once the response is over, however it ended."""
+
+    def __init__(self, download: AttachmentDownload, start: int = 0, end: Optional[int] = None, **kwargs):
+        super().__init__(download.stream(start, end), media_type=download.content_type, **kwargs)
+        self.download = download
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.download.close()
+
+
+def _decode_chunk(encoding: str, data: bytes, last: bool) -> Tuple[bytes, bytes]:
+    """Decode what can be decoded now; return (decoded, undecoded carry)."""
+    if encoding == "base64":
+        data = b"".join(data.split())
+        usable = len(data) if last else len(data) // 4 * 4
+        try:
+            return base64.b64decode(data[:usable]), data[usable:]
+        except (binascii.Error, ValueError):
+            # Truncated or damaged tail: keep whatever decodes cleanly
+            return base64.b64decode(data[: len(data) // 4 * 4], validate=False), b""
+    if encoding == "quoted-printable":
+        # Escapes and soft breaks never span lines
+        cut = len(data) if last else data.rfind(b"\n") + 1
+        return quopri.decodestring(data[:cut]), data[cut:]
+    return data, b""
+
+
+def parse_range(header: Optional[str], length: Optional[int]) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range Range header against the decoded length.
+
+    Returns:
+        (start, end) inclusive, or None to serve the whole part
+
+    Raises:
+        ValueError: The range cannot be satisfied (answer 416)
+    """
+    if not header or length is None:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        # Multiple or malformed ranges: serving everything is always allowed
+        return None
+    first, last = match.groups()
+    if first and last and int(last) < int(first):
+        # Not a valid range at all, so it is ignored rather than unsatisfiable
+        return None
+    if first == "":
+        suffix = int(last)
+        if suffix == 0:
+            raise ValueError("empty suffix range")
+        start, end = max(0, length - suffix), length - 1
+    else:
+        start = int(first)
+        end = min(int(last), length - 1) if last else length - 1
+    if start >= length or start > end:
+        raise ValueError("range not satisfiable")
+    return start, end
@@ -1,9 +1,15 @@
 import asyncio
+import time
+from collections import defaultdict
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
-from app.db.session import SessionLocal
-from app.models.models import Mailbox
+from typing import Dict, List, Tuple
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.session import AsyncSessionLocal
+from app.models.models import Domain, Mailbox
+from app.services.email_detail import forget_cached_mail
 from app.services.mailcow_client import MailcowClient
+from app.services.last_access import last_access
 from app.core.config import settings
 
 class MailboxCleanupService:
@@ -20,41 +26,28 @@ class MailboxCleanupService:
         Returns:
             Number of mailboxes cleaned up
         """
-        db = SessionLocal()
+        db = AsyncSessionLocal()
         cleaned_count = 0
         
         try:
             # Find expired mailboxes
             now = datetime.utcnow()
-            expired_mailboxes = db.query(Mailbox).filter(
-                Mailbox.expires_at <= now,
-                Mailbox.mailcow_managed == True
-            ).all()
-            
-            for mailbox in expired_mailboxes:
-                try:
-                    # Delete from Mailcow
-                    success = await self.mailcow_client.delete_mailbox(mailbox.email)
-                    
-                    if success:
-                        # Delete from database
-                        db.delete(mailbox)
-                        cleaned_count += 1
-                        print(f"Cleaned up expired mailbox: {mailbox.email}")
-                    else:
-                        print(f"Failed to delete mailbox from Mailcow: {mailbox.email}")
-                        
-                except Exception as e:
-                    print(f"Error cleaning up mailbox {mailbox.email}: {str(e)}")
-                    continue
+            expired_mailboxes = (await db.execute(
+                select(Mailbox.id, Mailbox.email, Domain.imap_host).join(Domain).where(
+                    Mailbox.expires_at <= now,
+                    Mailbox.mailcow_managed == True
+                )
+            )).all()
+            
+            cleaned_count = await self._delete_mailboxes(db, expired_mailboxes, "expired")
             
-            db.commit()
+            await db.commit()
             
         except Exception as e:
             print(f"Error during cleanup: {str(e)}")
-            db.rollback()
+            await db.rollback()
         finally:
-            db.close()
+            await db.close()
             
         return cleaned_count
 
@@ -68,82 +61,137 @@ class MailboxCleanupService:
         Returns:
             Number of mailboxes cleaned up
         """
-        db = SessionLocal()
+        db = AsyncSessionLocal()
         cleaned_count = 0
         
         try:
+            # Accesses recorded by this process are written behind; store them first
+            try:
+                await last_access.flush()
+            except Exception as e:
+                print(f"Error writing last access times before cleanup: {str(e)}")
+            recently_accessed = last_access.pending_ids()
+            
             # Find mailboxes not accessed for specified hours
             cutoff_time = datetime.utcnow() - timedelta(hours=hours)
-            old_mailboxes = db.query(Mailbox).filter(
-                Mailbox.last_accessed <= cutoff_time,
-                Mailbox.mailcow_managed == True
-            ).all()
-            
-            for mailbox in old_mailboxes:
-                try:
-                    # Delete from Mailcow
-                    success = await self.mailcow_client.delete_mailbox(mailbox.email)
-                    
-                    if success:
-                        # Delete from database
-                        db.delete(mailbox)
-                        cleaned_count += 1
-                        print(f"Cleaned up inactive mailbox: {mailbox.email}")
-                    else:
-                        print(f"Failed to delete inactive mailbox from Mailcow: {mailbox.email}")
-                        
-                except Exception as e:
-                    print(f"Error cleaning up inactive mailbox {mailbox.email}: {str(e)}")
-                    continue
+            old_mailboxes = [
+                row for row in (await db.execute(
+                    select(Mailbox.id, Mailbox.email, Domain.imap_host).join(Domain).where(
+                        Mailbox.last_accessed <= cutoff_time,
+                        Mailbox.mailcow_managed == True,
+                        Mailbox.pooled == False
+                    )
+                )).all()
+                if row.id not in recently_accessed
+            ]
+            
+            cleaned_count = await self._delete_mailboxes(db, old_mailboxes, "inactive")
             
-            db.commit()
+            await db.commit()
             
         except Exception as e:
             print(f"Error during inactive cleanup: {str(e)}")
-            db.rollback()
+            await db.rollback()
         finally:
-            db.close()
+            await db.close()
             
         return cleaned_count
 
+    async def _delete_mailboxes(self, db: AsyncSession, mailboxes: List[Tuple[int, str, str]], reason: str) -> int:
+        """
+        Delete mailboxes from Mailcow in batches, then drop the confirmed rows.
+        
+        Args:
+            db: Session the caller commits
+            mailboxes: (id, email, imap_host) rows to delete
+            reason: Word used in the log lines ("expired", "inactive")
+            
+        Returns:
+            Number of mailboxes deleted from both Mailcow and the database
+        """
+        if not mailboxes:
+            return 0
+        
+        results = await self.mailcow_client.delete_mailboxes([email for _, email, _ in mailboxes])
+        
+        deleted_ids = []
+        deleted = []
+        for mailbox_id, email, imap_host in mailboxes:
+            error = results.get(email)
+            if error is None:
+                deleted_ids.append(mailbox_id)
+                deleted.append((imap_host, email))
+                print(f"Cleaned up {reason} mailbox: {email}")
+            else:
+                print(f"Failed to delete {reason} mailbox from Mailcow: {email} ({error})")
+        
+        if deleted_ids:
+            # One set-based DELETE; cached messages go with them via ON DELETE CASCADE
+            await db.execute(
+                delete(Mailbox).where(Mailbox.id.in_(deleted_ids))
+                .execution_options(synchronize_session=False)
+            )
+            # The on-disk raw message cache and the sync states are not in the database
+            await forget_cached_mail(deleted)
+        return len(deleted_ids)
+
     async def update_quota_usage(self) -> int:
         """
         Update quota usage for all active mailboxes.
         
+        Mailcow is asked once per domain for the usage of all its
+        mailboxes; rows whose value changed are written with one bulk UPDATE.
+        
         Returns:
-            Number of mailboxes updated
+            Number of mailboxes whose quota usage changed
         """
-        db = SessionLocal()
+        db = AsyncSessionLocal()
         updated_count = 0
+        started = time.monotonic()
         
         try:
-            # Get all active Mailcow-managed mailboxes
-            active_mailboxes = db.query(Mailbox).filter(
-                Mailbox.mailcow_managed == True
-            ).all()
-            
-            for mailbox in active_mailboxes:
-                try:
-                    # Get quota usage from Mailcow
-                    quota_info = await self.mailcow_client.get_mailbox_quota_usage(mailbox.email)
-                    
-                    if quota_info:
-                        # Convert bytes to MB
-                        used_mb = quota_info["used"] // (1024 * 1024)
-                        mailbox.quota_used_mb = used_mb
-                        updated_count += 1
-                        
-                except Exception as e:
-                    print(f"Error updating quota for {mailbox.email}: {str(e)}")
+            # Get all active Mailcow-managed mailboxes, grouped by domain
+            active_mailboxes = (await db.execute(
+                select(Mailbox.id, Mailbox.email, Mailbox.quota_used_mb).where(
+                    Mailbox.mailcow_managed == True
+                )
+            )).all()
+            by_domain: Dict[str, List[Tuple[int, str, int]]] = defaultdict(list)
+            for row in active_mailboxes:
+                by_domain[row.email.rsplit('@', 1)[-1].lower()].append(row)
+            
+            changes = []
+            for domain, mailboxes in by_domain.items():
+                # Get quota usage from Mailcow
+                quotas = await self.mailcow_client.get_mailbox_quotas(domain)
+                if quotas is None:
                     continue
-            
-            db.commit()
+                
+                for mailbox_id, email, quota_used_mb in mailboxes:
+                    used = quotas.get(email.lower())
+                    if used is None:
+                        continue
+                    # Convert bytes to MB
+                    used_mb = used // (1024 * 1024)
+                    if used_mb != quota_used_mb:
+                        changes.append({"id": mailbox_id, "quota_used_mb": used_mb})
+            
+            if changes:
+                await db.execute(update(Mailbox), changes)
+            await db.commit()
+            updated_count = len(changes)
+            
+            elapsed = time.monotonic() - started
+            print(
+                f"Quota sync: {len(active_mailboxes)} mailboxes checked, {updated_count} changed "
+                f"in {elapsed:.2f}s ({len(active_mailboxes) / max(elapsed, 1e-6):.0f} rows/s)"
+            )
             
         except Exception as e:
             print(f"Error during quota update: {str(e)}")
-            db.rollback()
+            await db.rollback()
         finally:
-            db.close()
+            await db.close()
             
         return updated_count
 
@@ -0,0 +1,205 @@
+"""
+Detail views of INBOX messages, shared by both email services.
+
+Small messages are downloaded whole, kept in the raw message cache and
+decoded in a single pass; repeat opens are served from the cache without
+touching IMAP. Large messages only have their text sections fetched.
+
+Batches do the same for many messages over one session: cache hits are
+returned first, then one FETCH describes every missing message and the
+small ones are downloaded together in as few FETCH commands as the byte
+budget allows.
+"""
+
+import asyncio
+import threading
+from typing import AsyncIterator, Callable, Iterable, Iterator, List, Optional, Tuple
+
+from imapclient import IMAPClient
+from app.core.config import settings
+from app.models.schemas import EmailDetail
+from app.services.imap_executor import imap_executor
+from app.services.imap_fetch import fetch_email_detail, fetch_message_structure, fetch_message_structures
+from app.services.imap_pool import PoolKey, imap_pool
+from app.services.mailbox_sync import mailbox_sync_cache
+from app.services.message_store import message_store
+from app.services.mime_decode import parse_message
+
+
+async def forget_cached_mail(mailboxes: Iterable[Tuple[str, str]]) -> None:
+    """
+    Forget the cached messages and sync state of deleted mailboxes.
+
+    Detail views answer from the message cache using the remembered
+    UIDVALIDITY without asking IMAP, so without this an address created
+    again would be shown the previous owner's mail.
+
+    Args:
+        mailboxes: (imap_host, mailbox address) pairs
+    """
+    mailboxes = list(mailboxes)
+    if not mailboxes:
+        return
+
+    def forget() -> None:
+        for imap_host, mailbox in mailboxes:
+            mailbox_sync_cache.forget_mailbox(mailbox)
+            try:
+                message_store.forget(imap_host, mailbox)
+            except OSError as e:
+                print(f"Failed to drop cached mail of {mailbox}: {str(e)}")
+
+    # Removing cache directories is file I/O; keep it off the event loop
+    await asyncio.get_running_loop().run_in_executor(None, forget)
+
+
+def load_email_detail(
+    pool_key: PoolKey,
+    connect: Callable[[], IMAPClient],
+    imap_host: str,
+    mailbox: str,
+    uid: int,
+) -> Optional[EmailDetail]:
+    """
+    Build the detail view of a message; runs on the IMAP worker thread.
+
+    Args:
+        pool_key: Session pool key of the mailbox
+        connect: Opens a new logged-in session when the pool has none
+        imap_host: IMAP server, part of the cache key
+        mailbox: Mailbox address, part of the cache key
+        uid: Message UID
+
+    Returns:
+        EmailDetail, or None if the message no longer exists
+    """
+    # The sync state usually knows UIDVALIDITY, so a cache hit needs no IMAP at all
+    uidvalidity = mailbox_sync_cache.get(pool_key).uidvalidity
+    raw_email = message_store.get(imap_host, mailbox, uidvalidity, uid)
+
+    if raw_email is None:
+        with imap_pool.session(pool_key, connect) as server:
+            selected = server.select_folder('INBOX', readonly=True)
+            uidvalidity = selected.get(b'UIDVALIDITY')
+            raw_email = message_store.get(imap_host, mailbox, uidvalidity, uid)
+
+            if raw_email is None:
+                structure = fetch_message_structure(server, uid)
+                if structure is None:
+                    return None
+                if structure.size > settings.EMAIL_DETAIL_FULL_FETCH_BYTES:
+                    # Only the text sections; attachments stay on the server
+                    return fetch_email_detail(server, structure, uidvalidity)
+
+                # Small enough to fetch whole and keep for the next open
+                messages = server.fetch([uid], ['BODY.PEEK[]'])
+                if uid not in messages:
+                    return None
+                raw_email = messages[uid][b'BODY[]']
+
+        message_store.put(imap_host, mailbox, uidvalidity, uid, raw_email)
+
+    return parse_message(raw_email).detail(str(uid), uidvalidity)
+
+
+def iter_email_details(
+    pool_key: PoolKey,
+    connect: Callable[[], IMAPClient],
+    imap_host: str,
+    mailbox: str,
+    uids: List[int],
+) -> Iterator[Tuple[int, Optional[EmailDetail]]]:
+    """
+    Yield (uid, detail) for each UID as soon as it is decoded; detail is None
+    for messages that no longer exist. Blocking: each next() runs on the IMAP
+    worker thread.
+
+    Messages are fetched with PEEK and INBOX is selected read-only, so a
+    batch prefetch does not mark anything as read.
+    """
+    uidvalidity = mailbox_sync_cache.get(pool_key).uidvalidity
+    missing = []
+    for uid in uids:
+        raw_email = message_store.get(imap_host, mailbox, uidvalidity, uid)
+        if raw_email is None:
+            missing.append(uid)
+        else:
+            yield uid, parse_message(raw_email).detail(str(uid), uidvalidity)
+    if not missing:
+        return
+
+    with imap_pool.session(pool_key, connect) as server:
+        selected = server.select_folder('INBOX', readonly=True)
+        if selected.get(b'UIDVALIDITY') != uidvalidity:
+            uidvalidity = selected.get(b'UIDVALIDITY')
+            pending = []
+            for uid in missing:
+                raw_email = message_store.get(imap_host, mailbox, uidvalidity, uid)
+                if raw_email is None:
+                    pending.append(uid)
+                else:
+                    yield uid, parse_message(raw_email).detail(str(uid), uidvalidity)
+            missing = pending
+
+        structures = fetch_message_structures(server, missing)
+        full, partial = [], []
+        for uid in missing:
+            structure = structures.get(uid)
+            if structure is None:
+                yield uid, None
+            elif structure.size > settings.EMAIL_DETAIL_FULL_FETCH_BYTES:
+                partial.append(structure)
+            else:
+                full.append(structure)
+
+        # As few whole-message FETCHes as the byte budget allows, usually one
+        batch, batch_bytes = [], 0
+        for structure in full + [None]:
+            if batch and (structure is None or batch_bytes + structure.size > settings.EMAIL_BATCH_FETCH_BYTES):
+                response = server.fetch([s.uid for s in batch], ['BODY.PEEK[]'])
+                for queued in batch:
+                    raw_email = response.get(queued.uid, {}).get(b'BODY[]')
+                    if raw_email is None:
+                        yield queued.uid, None
+                        continue
+                    message_store.put(imap_host, mailbox, uidvalidity, queued.uid, raw_email)
+                    yield queued.uid, parse_message(raw_email).detail(str(queued.uid), uidvalidity)
+                batch, batch_bytes = [], 0
+            if structure is not None:
+                batch.append(structure)
+                batch_bytes += structure.size
+
+        for structure in partial:
+            yield structure.uid, fetch_email_detail(server, structure, uidvalidity)
+
+
+async def stream_email_details(
+    pool_key: PoolKey,
+    connect: Callable[[], IMAPClient],
+    imap_host: str,
+    mailbox: str,
+    uids: List[int],
+) -> AsyncIterator[Tuple[int, Optional[EmailDetail]]]:
+    """Async wrapper over iter_email_details() that steps it on the IMAP worker pool."""
+    details = iter_email_details(pool_key, connect, imap_host, mailbox, uids)
+    # next() may still be running on a worker when the client goes away;
+    # the lock makes close() wait for it instead of failing
+    lock = threading.Lock()
+
+    def step():
+        with lock:
+            return next(details, None)
+
+    def close():
+        with lock:
+            details.close()
+
+    try:
+        while True:
+            item = await imap_executor.run(step)
+            if item is None:
+                break
+            yield item
+    finally:
+        # Ends the generator; a batch stopped part-way discards its session
+        asyncio.get_running_loop().run_in_executor(None, close)
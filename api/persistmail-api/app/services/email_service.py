@@ -1,13 +1,14 @@
-from typing import List, Optional
-from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from imapclient import IMAPClient
 from fastapi import HTTPException
-from app.models.schemas import EmailList, EmailDetail
+from app.models.schemas import EmailDetail
 from app.core.config import settings
-import email
+from app.services.imap_pool import imap_pool
+from app.services.imap_executor import imap_executor
+from app.services.imap_fetch import EmailPage, fetch_email_page, fetch_mailbox_status
+from app.services.email_detail import load_email_detail, stream_email_details
+from app.services.mailbox_sync import IndexSeed, SyncResult, mailbox_sync_cache, sync_mailbox
 import ssl
-from email.header import decode_header
-import base64
 
 class EmailService:
     def __init__(self, imap_host: str, imap_port: int, email: str, password: str):
@@ -15,10 +16,11 @@ class EmailService:
         self.imap_port = imap_port
         self.email = email  # Full email address as IMAP username
         self.password = password  # Individual mailbox password (from Mailcow)
-        self._server = None
+        self.pool_key = imap_pool.make_key(imap_host, imap_port, email, password)
 
-    async def connect(self) -> IMAPClient:
-        """Connect to the IMAP server and authenticate."""
+    def connect(self) -> IMAPClient:
+        """Open a new IMAP session and authenticate."""
+        server = None
         try:
             # Create SSL context that accepts self-signed certificates
             context = ssl.create_default_context()
@@ -41,14 +43,12 @@ class EmailService:
             )
             
             server.login(self.email, self.password)
-            
-            self._server = server
-            return self._server
+            return server
             
         except Exception as e:
-            if self._server:
+            if server:
                 try:
-                    self._server.logout()
+                    server.logout()
                 except:
                     pass
             raise HTTPException(
@@ -56,70 +56,98 @@ class EmailService:
                 detail=f"Failed to connect to mail server: {str(e)}"
             )
 
-    async def fetch_emails(self, hours: int = 24, limit: int = 25) -> List[EmailList]:
-        """Fetch emails from the IMAP server."""
-        server = None
+    async def mailbox_status(self) -> Dict[str, int]:
+        """Get the INBOX change counters (UIDVALIDITY, UIDNEXT, MESSAGES, HIGHESTMODSEQ)."""
+        return await imap_executor.run(self._mailbox_status)
+
+    def _mailbox_status(self) -> Dict[str, int]:
         try:
-            server = await self.connect()
-            server.select_folder('INBOX')
-            
-            # Calculate the date from hours ago
-            date_from = (datetime.now() - timedelta(hours=hours)).strftime("%d-%b-%Y")
-            messages = server.search(['SINCE', date_from])
-            
-            # Fetch only the most recent emails up to the limit
-            messages = messages[-limit:] if messages else []
-            
-            if not messages:
-                return []
+            with imap_pool.session(self.pool_key, self.connect) as server:
+                return fetch_mailbox_status(server)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to get mailbox status: {str(e)}"
+            )
+
+    async def sync_emails(self, hours: int = 24, limit: int = 25, seed: Optional[IndexSeed] = None) -> SyncResult:
+        """Sync the INBOX listing from the IMAP server, optionally re-seeding from the message index."""
+        return await imap_executor.run(self._sync_emails, hours, limit, seed)
+
+    def _sync_emails(self, hours: int, limit: int, seed: Optional[IndexSeed]) -> SyncResult:
+        try:
+            with imap_pool.session(self.pool_key, self.connect) as server:
+                return sync_mailbox(server, mailbox_sync_cache.get(self.pool_key), hours, limit, seed)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to fetch emails: {str(e)}"
+            )
 
-            email_list = []
-            for msg_id, data in server.fetch(messages, ['ENVELOPE', 'FLAGS', 'RFC822.SIZE']).items():
-                envelope = data[b'ENVELOPE']
-                
-                email_data = EmailList(
-                    id=str(msg_id),
-                    subject=envelope.subject.decode() if envelope.subject else "No Subject",
-                    sender=envelope.from_[0].mailbox.decode() + "@" + envelope.from_[0].host.decode(),
-                    received_date=envelope.date,
-                    has_attachments=self._has_attachments(data),
-                    snippet=self._get_snippet(msg_id, server)
+    async def fetch_email_page(
+        self,
+        hours: int = 24,
+        limit: int = 25,
+        before_uid: Optional[int] = None,
+        after_uid: Optional[int] = None,
+        sender: Optional[str] = None,
+        subject: Optional[str] = None,
+        text: Optional[str] = None,
+        unseen: bool = False
+    ) -> EmailPage:
+        """Fetch one filtered or cursor-paged page of emails with UID SEARCH."""
+        return await imap_executor.run(
+            self._fetch_email_page, hours, limit, before_uid, after_uid, sender, subject, text, unseen
+        )
+
+    def _fetch_email_page(self, hours, limit, before_uid, after_uid, sender, subject, text, unseen) -> EmailPage:
+        try:
+            with imap_pool.session(self.pool_key, self.connect) as server:
+                return fetch_email_page(
+                    server, hours, limit,
+                    before_uid=before_uid,
+                    after_uid=after_uid,
+                    sender=sender,
+                    subject=subject,
+                    text=text,
+                    unseen=unseen
                 )
-                email_list.append(email_data)
-                
-            return email_list
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=500,
                 detail=f"Failed to fetch emails: {str(e)}"
             )
-        finally:
-            if server and server != self._server:
-                try:
-                    server.logout()
-                except:
-                    pass
 
-    def _has_attachments(self, msg_data: dict) -> bool:
-        """Check if an email has attachments based on its size."""
-        return msg_data[b'RFC822.SIZE'] > settings.ATTACHMENT_SIZE_THRESHOLD
+    async def get_email(self, message_id: str) -> Optional[EmailDetail]:
+        """Get detailed email content."""
+        return await imap_executor.run(self._get_email, message_id)
 
-    def _get_snippet(self, msg_id: int, server: IMAPClient, length: Optional[int] = None) -> str:
-        """Get a preview snippet of the email content."""
-        if length is None:
-            length = settings.EMAIL_SNIPPET_LENGTH
-            
+    def _get_email(self, message_id: str) -> Optional[EmailDetail]:
         try:
-            # Fetch the message body
-            message = server.fetch([msg_id], ['BODY[]'])[msg_id][b'BODY[]']
-            email_message = email.message_from_bytes(message)
-            
-            # Get the first text part
-            for part in email_message.walk():
-                if part.get_content_type() == "text/plain":
-                    text = part.get_payload(decode=True).decode()
-                    return text[:length] + "..." if len(text) > length else text
-                    
-            return "No preview available"
+            return load_email_detail(self.pool_key, self.connect, self.imap_host, self.email, int(message_id))
+        except HTTPException:
+            raise
         except Exception as e:
-            return "Preview not available"
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to get email detail: {str(e)}"
+            )
+
+    def get_emails(self, uids: List[int]) -> AsyncIterator[Tuple[int, Optional[EmailDetail]]]:
+        """
+        Get several emails over one IMAP session, without marking them read.
+
+        Args:
+            uids: Message UIDs, in the order they should be looked at
+
+        Returns:
+            Async iterator of (uid, EmailDetail or None when the email is gone),
+            in the order the details become available
+        """
+        return stream_email_details(self.pool_key, self.connect, self.imap_host, self.email, uids)
@@ -0,0 +1,58 @@
+"""
+Shared outbound HTTP client.
+
+One pooled httpx.AsyncClient serves every Mailcow API call, so connections
+(and their TLS sessions) are kept alive and reused instead of being set up
+for each request. The app opens it at startup and closes it at shutdown;
+scripts that run outside the app get one created on first use.
+"""
+
+import asyncio
+from typing import Optional
+
+import httpx
+from app.core.config import settings
+
+
+class SharedHTTPClient:
+    """Owner of the process-wide AsyncClient."""
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def get(self) -> httpx.AsyncClient:
+        """Return the shared client, creating it for the running event loop if needed."""
+        loop = asyncio.get_running_loop()
+        # Pooled connections belong to the loop that opened them; scripts
+        # calling asyncio.run() more than once need a fresh client each time
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            self._client = self._create()
+            self._loop = loop
+        return self._client
+
+    async def start(self) -> None:
+        self.get()
+
+    async def close(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+        self._loop = None
+
+    def _create(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY_SECONDS,
+        )
+        timeout = httpx.Timeout(settings.HTTP_TIMEOUT_SECONDS)
+        if settings.HTTP2_ENABLED:
+            try:
+                return httpx.AsyncClient(http2=True, limits=limits, timeout=timeout)
+            except ImportError:
+                print("HTTP2_ENABLED is set but the h2 package is missing (pip install 'httpx[http2]'); using HTTP/1.1")
+        return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+
+http_client = SharedHTTPClient()
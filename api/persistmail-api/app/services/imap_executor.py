@@ -0,0 +1,113 @@
+"""
+Async facade over the blocking IMAP layer.
+
+IMAPClient is synchronous, so protocol work runs on a dedicated, bounded
+thread pool. A slow mail server then only holds up requests that need IMAP,
+while the event loop keeps serving everything else (including /health).
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from fastapi import HTTPException
+from app.core.config import settings
+
+
+class IMAPExecutor:
+    """Bounded thread pool for IMAP calls with queue depth and wait-time stats."""
+
+    def __init__(self, max_workers: int, max_queued: int):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="imap")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        Run a blocking IMAP function on the pool and await its result.
+
+        Raises:
+            HTTPException: 503 when the queue is already at capacity
+        """
+        with self._lock:
+            if self._queued >= self.max_queued:
+                self._rejected += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail="Mail server is busy, please retry shortly"
+                )
+            self._queued += 1
+        submitted = time.monotonic()
+        # Whoever dequeues first (the worker or a cancelled caller) decrements the queue
+        state = {"dequeued": False}
+
+        def dequeue_locked() -> bool:
+            if state["dequeued"]:
+                return False
+            state["dequeued"] = True
+            self._queued -= 1
+            return True
+
+        def job():
+            waited = time.monotonic() - submitted
+            with self._lock:
+                if dequeue_locked():
+                    self._total_wait += waited
+                    self._max_wait = max(self._max_wait, waited)
+                self._running += 1
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(self._executor, job)
+        except RuntimeError:
+            # Executor already shut down; the job never started
+            with self._lock:
+                dequeue_locked()
+            raise HTTPException(status_code=503, detail="Mail service is shutting down")
+
+        try:
+            return await future
+        except asyncio.CancelledError:
+            with self._lock:
+                dequeue_locked()
+            raise
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return queue depth and wait-time counters for monitoring."""
+        with self._lock:
+            started = self._completed + self._running
+            return {
+                "workers": self.max_workers,
+                "max_queued": self.max_queued,
+                "queued": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "avg_wait_ms": round(self._total_wait / started * 1000, 2) if started else 0.0,
+                "max_wait_ms": round(self._max_wait * 1000, 2),
+            }
+
+    def shutdown(self) -> None:
+        """Stop accepting work and drop anything still queued."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+imap_executor = IMAPExecutor(
+    max_workers=settings.IMAP_WORKER_THREADS,
+    max_queued=settings.IMAP_MAX_QUEUED_TASKS,
+)
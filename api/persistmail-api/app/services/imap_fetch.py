@@ -0,0 +1,617 @@
+"""
+Shared IMAP FETCH helpers for the email services.
+
+The list view is built from a single FETCH per batch of UIDs that returns
+the envelope, flags, size, BODYSTRUCTURE and the first few hundred bytes of
+section 1. Messages whose first readable text part lives in another section
+are topped up with one extra FETCH per distinct section, so the number of
+round trips no longer grows with the number of messages.
+"""
+
+import base64
+import binascii
+import hashlib
+import html
+import quopri
+import re
+from datetime import datetime, timedelta
+from email.header import decode_header, make_header
+from typing import Dict, List, Optional, Tuple, Union
+
+from imapclient import IMAPClient
+from app.models.schemas import AttachmentInfo, EmailDetail, EmailList
+from app.core.config import settings
+
+# Truncated fragments may end inside a <style> block or an unterminated tag
+_TAG_RE = re.compile(
+    r"<(script|style)\b.*?(?:</\1\s*>|\Z)|<[^>]*(?:>|\Z)", re.IGNORECASE | re.DOTALL
+)
+
+
+class BodyPart:
+    """A leaf MIME part described by BODYSTRUCTURE."""
+
+    def __init__(
+        self,
+        section: str,
+        content_type: str,
+        params: Dict[str, str],
+        encoding: str,
+        size: int,
+        disposition: Optional[str] = None,
+        filename: Optional[str] = None,
+    ):
+        self.section = section
+        self.content_type = content_type
+        self.params = params
+        self.encoding = encoding
+        self.size = size
+        self.disposition = disposition
+        self.filename = filename
+
+    @property
+    def charset(self) -> str:
+        return self.params.get("charset") or "utf-8"
+
+    @property
+    def is_attachment(self) -> bool:
+        if self.disposition == "attachment":
+            return True
+        return bool(self.filename) and not self.content_type.startswith("text/")
+
+
+def _text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return str(value)
+
+
+def decode_mime_words(value) -> str:
+    """Decode an RFC 2047 encoded header value into text."""
+    text = _text(value)
+    if not text:
+        return ""
+    try:
+        return str(make_header(decode_header(text)))
+    except Exception:
+        return text
+
+
+def _param_dict(params) -> Dict[str, str]:
+    if not isinstance(params, (list, tuple)):
+        return {}
+    items = [_text(p) for p in params]
+    return {items[i].lower(): items[i + 1] for i in range(0, len(items) - 1, 2)}
+
+
+def _disposition(ext) -> tuple:
+    """Return (disposition, params) from a BODYSTRUCTURE disposition field."""
+    if isinstance(ext, (list, tuple)) and ext and isinstance(ext[0], (bytes, str)):
+        return _text(ext[0]).lower(), _param_dict(ext[1] if len(ext) > 1 else None)
+    return None, {}
+
+
+def parse_bodystructure(structure, prefix: str = "") -> List[BodyPart]:
+    """
+    Flatten a BODYSTRUCTURE response into its leaf parts.
+
+    Args:
+        structure: BODYSTRUCTURE value as parsed by IMAPClient
+        prefix: Section prefix of the enclosing multipart
+
+    Returns:
+        Leaf parts in document order with their IMAP section numbers
+    """
+    if not structure:
+        return []
+
+    if isinstance(structure[0], (list, tuple)):
+        parts = []
+        for index, child in enumerate(structure[0], start=1):
+            section = f"{prefix}.{index}" if prefix else str(index)
+            parts.extend(parse_bodystructure(child, section))
+        return parts
+
+    content_type = f"{_text(structure[0]).lower()}/{_text(structure[1]).lower()}"
+    params = _param_dict(structure[2])
+    encoding = _text(structure[5]).lower() or "7bit"
+    size = int(structure[6] or 0)
+
+    # Extension data follows the basic fields, which vary by media type
+    if content_type == "message/rfc822":
+        ext_index = 11
+    elif content_type.startswith("text/"):
+        ext_index = 9
+    else:
+        ext_index = 8
+    disposition, disposition_params = _disposition(
+        structure[ext_index] if len(structure) > ext_index else None
+    )
+
+    filename = disposition_params.get("filename") or params.get("name")
+    return [
+        BodyPart(
+            section=prefix or "1",
+            content_type=content_type,
+            params=params,
+            encoding=encoding,
+            size=size,
+            disposition=disposition,
+            filename=decode_mime_words(filename) if filename else None,
+        )
+    ]
+
+
+def attachment_info(parts: List[BodyPart]) -> List[AttachmentInfo]:
+    """Describe the downloadable parts of a message."""
+    return [
+        AttachmentInfo(part=p.section, filename=p.filename, content_type=p.content_type, size=p.size)
+        for p in parts
+        if p.is_attachment and p.filename
+    ]
+
+
+def find_text_part(parts: List[BodyPart]) -> Optional[BodyPart]:
+    """Return the first inline text/plain part, falling back to text/html."""
+    inline = [p for p in parts if not p.is_attachment]
+    for content_type in ("text/plain", "text/html"):
+        for part in inline:
+            if part.content_type == content_type:
+                return part
+    return None
+
+
+def decode_partial(data: bytes, encoding: str, charset: str) -> str:
+    """
+    Decode a possibly truncated body section.
+
+    Partial fetches can cut a base64 quantum, a quoted-printable escape or a
+    multi-byte character in half; the incomplete tail is dropped.
+    """
+    if not data:
+        return ""
+    try:
+        if encoding == "base64":
+            compact = b"".join(data.split())
+            data = base64.b64decode(compact[: len(compact) // 4 * 4])
+        elif encoding == "quoted-printable":
+            data = re.sub(rb"=[0-9A-Fa-f]?$", b"", data)
+            data = quopri.decodestring(data)
+    except (binascii.Error, ValueError):
+        return ""
+    try:
+        return data.decode(charset, errors="ignore")
+    except LookupError:
+        return data.decode("utf-8", errors="ignore")
+
+
+def html_to_text(markup: str) -> str:
+    """Strip tags from an HTML fragment for use as preview text."""
+    return html.unescape(_TAG_RE.sub(" ", markup))
+
+
+def make_snippet(text: str, length: Optional[int] = None) -> str:
+    """Collapse whitespace and cut the preview to the configured length."""
+    if length is None:
+        length = settings.EMAIL_SNIPPET_LENGTH
+    text = " ".join(text.split())
+    if not text:
+        return "No preview available"
+    return text[:length] + "..." if len(text) > length else text
+
+
+def envelope_subject(envelope) -> str:
+    if envelope is None or not envelope.subject:
+        return "No Subject"
+    return decode_mime_words(envelope.subject) or "No Subject"
+
+
+def envelope_sender(envelope) -> str:
+    if envelope is None or not envelope.from_:
+        return "Unknown Sender"
+    from_addr = envelope.from_[0]
+    if not from_addr.mailbox or not from_addr.host:
+        return "Unknown Sender"
+    return f"{_text(from_addr.mailbox)}@{_text(from_addr.host)}"
+
+
+def _section_key(section: str) -> bytes:
+    return f"BODY[{section}]<0>".encode()
+
+
+class MessageSummary:
+    """List entry for one message plus the metadata needed to keep it cached."""
+
+    def __init__(self, uid: int, entry: EmailList, internal_date: Optional[datetime], flags: tuple, size: int):
+        self.uid = uid
+        self.entry = entry
+        self.internal_date = internal_date
+        self.flags = flags
+        self.size = size
+
+
+def fetch_message_summaries(server: IMAPClient, uids: Union[List[int], str]) -> List[MessageSummary]:
+    """
+    Describe the given messages with as few FETCH commands as possible.
+
+    Args:
+        server: Logged-in client with the mailbox selected
+        uids: Message UIDs, or a UID range such as "120:*"
+
+    Returns:
+        Summaries in server response order
+    """
+    if not uids:
+        return []
+
+    peek_bytes = settings.EMAIL_SNIPPET_FETCH_BYTES
+    response = server.fetch(
+        uids,
+        ['ENVELOPE', 'FLAGS', 'INTERNALDATE', 'RFC822.SIZE', 'BODYSTRUCTURE',
+         f'BODY.PEEK[1]<0.{peek_bytes}>'],
+    )
+
+    body_parts: Dict[int, List[BodyPart]] = {}
+    text_parts: Dict[int, Optional[BodyPart]] = {}
+    pending: Dict[str, List[int]] = {}
+    for uid, data in response.items():
+        parts = parse_bodystructure(data.get(b'BODYSTRUCTURE'))
+        body_parts[uid] = parts
+        text_part = find_text_part(parts)
+        text_parts[uid] = text_part
+        if text_part and text_part.section != "1":
+            pending.setdefault(text_part.section, []).append(uid)
+
+    # One extra FETCH per distinct section (usually "1.1" for mixed/alternative)
+    for section, section_uids in pending.items():
+        extra = server.fetch(section_uids, [f'BODY.PEEK[{section}]<0.{peek_bytes}>'])
+        for uid, data in extra.items():
+            if uid in response:
+                response[uid][_section_key(section)] = data.get(_section_key(section))
+
+    summaries = []
+    for uid, data in response.items():
+        envelope = data.get(b'ENVELOPE')
+        parts = body_parts[uid]
+        text_part = text_parts[uid]
+
+        snippet = "No preview available"
+        if text_part:
+            text = decode_partial(
+                data.get(_section_key(text_part.section)) or b"",
+                text_part.encoding,
+                text_part.charset,
+            )
+            if text_part.content_type == "text/html":
+                text = html_to_text(text)
+            snippet = make_snippet(text)
+
+        size = data.get(b'RFC822.SIZE', 0)
+        if parts:
+            has_attachments = any(p.is_attachment for p in parts)
+        else:
+            has_attachments = size > settings.ATTACHMENT_SIZE_THRESHOLD
+
+        entry = EmailList(
+            id=str(uid),
+            subject=envelope_subject(envelope),
+            sender=envelope_sender(envelope),
+            received_date=(envelope.date if envelope else None) or datetime.now(),
+            has_attachments=has_attachments,
+            snippet=snippet
+        )
+        summaries.append(MessageSummary(
+            uid=uid,
+            entry=entry,
+            internal_date=data.get(b'INTERNALDATE'),
+            flags=tuple(data.get(b'FLAGS', ())),
+            size=size,
+        ))
+
+    return summaries
+
+
+def fetch_email_list(server: IMAPClient, uids: List[int]) -> List[EmailList]:
+    """Build list entries for the given UIDs; see fetch_message_summaries()."""
+    return [summary.entry for summary in fetch_message_summaries(server, uids)]
+
+
+class MessageStructure:
+    """Envelope, size and MIME layout of one message, without its content."""
+
+    def __init__(self, uid: int, envelope, size: int, parts: List[BodyPart]):
+        self.uid = uid
+        self.envelope = envelope
+        self.size = size
+        self.parts = parts
+
+
+def fetch_message_structure(server: IMAPClient, uid: int) -> Optional[MessageStructure]:
+    """Fetch ENVELOPE, RFC822.SIZE and BODYSTRUCTURE for one message, or None if it is gone."""
+    return fetch_message_structures(server, [uid]).get(uid)
+
+
+def fetch_message_structures(server: IMAPClient, uids: List[int]) -> Dict[int, MessageStructure]:
+    """Structures of several messages in one FETCH; expunged UIDs are left out."""
+    if not uids:
+        return {}
+    response = server.fetch(uids, ['ENVELOPE', 'RFC822.SIZE', 'BODYSTRUCTURE'])
+    return {
+        uid: MessageStructure(
+            uid=uid,
+            envelope=data.get(b'ENVELOPE'),
+            size=data.get(b'RFC822.SIZE', 0),
+            parts=parse_bodystructure(data.get(b'BODYSTRUCTURE')),
+        )
+        for uid, data in response.items()
+    }
+
+
+def fetch_email_detail(server: IMAPClient, structure: MessageStructure, uidvalidity: Optional[int] = None) -> EmailDetail:
+    """
+    Build the detail view by fetching only the text sections of a message.
+
+    Attachments are described from BODYSTRUCTURE and never downloaded, so
+    transfer and memory scale with the size of the text, not the message.
+    Sections are fetched with PEEK: reading through the API leaves the
+    \\Seen flag alone, as a cache hit does.
+
+    Args:
+        server: Logged-in client with INBOX selected
+        structure: Result of fetch_message_structure()
+        uidvalidity: UIDVALIDITY of the selected INBOX, recorded on the result
+
+    Returns:
+        EmailDetail for the message
+    """
+    inline = [p for p in structure.parts if not p.is_attachment]
+    plain_part = next((p for p in inline if p.content_type == "text/plain"), None)
+    html_part = next((p for p in inline if p.content_type == "text/html"), None)
+    wanted = [p for p in (plain_part, html_part) if p is not None]
+
+    data = {}
+    if wanted:
+        data = server.fetch([structure.uid], [f"BODY.PEEK[{p.section}]" for p in wanted]).get(structure.uid, {})
+
+    def section_text(part: Optional[BodyPart]) -> str:
+        if part is None:
+            return ""
+        return decode_partial(data.get(f"BODY[{part.section}]".encode()) or b"", part.encoding, part.charset)
+
+    attachments = attachment_info(structure.parts)
+    return EmailDetail(
+        id=str(structure.uid),
+        subject=envelope_subject(structure.envelope),
+        sender=envelope_sender(structure.envelope),
+        received_date=(structure.envelope.date if structure.envelope else None) or datetime.now(),
+        has_attachments=len(attachments) > 0,
+        body_text=section_text(plain_part),
+        body_html=section_text(html_part),
+        attachments=[a.filename for a in attachments],
+        attachment_parts=attachments,
+        uidvalidity=uidvalidity,
+    )
+
+
+def since_date(hours: int) -> str:
+    """IMAP SEARCH SINCE date for a window of the given hours (day granularity)."""
+    return (datetime.now() - timedelta(hours=hours)).strftime("%d-%b-%Y")
+
+
+def search_uids(server: IMAPClient, criteria: list, limit: int, newest: bool = True) -> Tuple[List[int], int]:
+    """
+    Run UID SEARCH and keep only one end of the result.
+
+    With ESEARCH the full list of matches never crosses the wire. Servers
+    with PARTIAL return just the kept end. Others report MIN, MAX and COUNT
+    first: consecutive matches are expanded from those bounds, anything
+    else is read from a UID window at the kept end that widens until it
+    holds limit matches.
+
+    Args:
+        server: Logged-in client with the mailbox selected
+        criteria: IMAPClient-style search criteria
+        limit: Number of UIDs to keep
+        newest: Keep the highest UIDs (True) or the lowest (False)
+
+    Returns:
+        (kept UIDs in ascending order, total number of matches)
+    """
+    charset = "UTF-8" if any(isinstance(c, str) and not c.isascii() for c in criteria) else None
+    if server.has_capability('ESEARCH'):
+        try:
+            return _search_uids_esearch(server, criteria, charset, limit, newest)
+        except Exception as e:
+            print(f"ESEARCH failed, falling back to SEARCH: {str(e)}")
+
+    uids = sorted(server.search(criteria, charset))
+    kept = (uids[-limit:] if newest else uids[:limit]) if limit > 0 else []
+    return kept, len(uids)
+
+
+def _search_uids_esearch(
+    server: IMAPClient, criteria: list, charset: Optional[str], limit: int, newest: bool
+) -> Tuple[List[int], int]:
+    if limit <= 0:
+        return [], int(_esearch(server, criteria, charset, "COUNT").get("COUNT", 0))
+
+    if server.has_capability('PARTIAL'):
+        window = f"-1:-{limit}" if newest else f"1:{limit}"
+        result = _esearch(server, criteria, charset, f"PARTIAL {window} COUNT")
+        uids = _expand_uid_set(result.get("PARTIAL", ""), limit, newest)
+        return sorted(uids), int(result.get("COUNT", 0))
+
+    result = _esearch(server, criteria, charset, "MIN MAX COUNT")
+    count = int(result.get("COUNT", 0))
+    if count == 0:
+        return [], 0
+    low, high = int(result["MIN"]), int(result["MAX"])
+    if high - low + 1 == count:
+        # No gaps: the kept end follows from the bounds alone
+        return sorted(_expand_uid_set(f"{low}:{high}", limit, newest)), count
+
+    # Sized from the average gap between matches, so one window usually does
+    width = 2 * limit * (high - low + 1) // count + 1
+    while True:
+        window_low = max(low, high - width + 1) if newest else low
+        window_high = high if newest else min(high, low + width - 1)
+        found = _esearch(server, criteria + ['UID', f"{window_low}:{window_high}"], charset, "ALL")
+        uids = _expand_uid_set(found.get("ALL", ""), limit, newest)
+        if len(uids) >= limit or (window_low, window_high) == (low, high):
+            return sorted(uids), count
+        width *= 4
+
+
+def _esearch(server: IMAPClient, criteria: list, charset: Optional[str], returns: str) -> Dict[str, str]:
+    """
+    Send UID SEARCH RETURN (<returns>) and return the ESEARCH result items.
+
+    IMAPClient has no public ESEARCH API. This is the only place that uses
+    its private _normalise_search_criteria and _raw_command_untagged, as
+    they are in IMAPClient 3.0.1 (pinned in requirements.txt); search_uids
+    falls back to a plain SEARCH if they change.
+    """
+    from imapclient.imapclient import _normalise_search_criteria
+
+    args = [b"RETURN", f"({returns})".encode()]
+    if charset:
+        args.extend([b"CHARSET", charset.encode()])
+    args.extend(_normalise_search_criteria(criteria, charset))
+    data = server._raw_command_untagged(b"SEARCH", args, response_name="ESEARCH", unpack=True)
+    return _parse_esearch(data)
+
+
+def _parse_esearch(data) -> Dict[str, str]:
+    """Return the MIN, MAX, COUNT, ALL and PARTIAL items of an ESEARCH response."""
+    text = _text(data)
+    items = {
+        name.upper(): value
+        for name, value in re.findall(r"\b(MIN|MAX|COUNT|ALL)\s+([0-9:,]+)", text, re.IGNORECASE)
+    }
+    partial = re.search(r"\bPARTIAL\s+\(\s*\S+\s+([0-9:,]+)\s*\)", text, re.IGNORECASE)
+    if partial:
+        items["PARTIAL"] = partial.group(1)
+    return items
+
+
+def _expand_uid_set(uid_set: str, limit: int, newest: bool) -> List[int]:
+    """Expand at most limit UIDs from one end of a sequence set such as "1:5,9"."""
+    ranges = []
+    for segment in filter(None, uid_set.split(",")):
+        low, _, high = segment.partition(":")
+        low, high = int(low), int(high or low)
+        ranges.append((min(low, high), max(low, high)))
+    ranges.sort(reverse=newest)
+
+    uids: List[int] = []
+    for low, high in ranges:
+        for uid in (range(high, low - 1, -1) if newest else range(low, high + 1)):
+            if len(uids) >= limit:
+                return uids
+            uids.append(uid)
+    return uids
+
+
+class EmailPage:
+    """One page of a filtered or cursor-paged listing."""
+
+    def __init__(self, entries: List[EmailList], next_cursor: Optional[int]):
+        self.entries = entries
+        self.next_cursor = next_cursor
+
+
+def fetch_email_page(
+    server: IMAPClient,
+    hours: int,
+    limit: int,
+    before_uid: Optional[int] = None,
+    after_uid: Optional[int] = None,
+    sender: Optional[str] = None,
+    subject: Optional[str] = None,
+    text: Optional[str] = None,
+    unseen: bool = False,
+) -> EmailPage:
+    """
+    List one page of INBOX with every filter pushed down into UID SEARCH.
+
+    Pages walk backwards from before_uid (newest first) or forwards from
+    after_uid (oldest first); entries are always returned oldest first.
+    next_cursor is the before_uid/after_uid to pass for the following
+    page, or None when there are no more matches.
+    """
+    low = (after_uid or 0) + 1
+    if before_uid is not None and before_uid - 1 < low:
+        return EmailPage([], None)
+
+    criteria: list = ['SINCE', since_date(hours)]
+    if before_uid is not None or after_uid is not None:
+        criteria += ['UID', f"{low}:{before_uid - 1 if before_uid is not None else '*'}"]
+    if sender:
+        criteria += ['FROM', sender]
+    if subject:
+        criteria += ['SUBJECT', subject]
+    if text:
+        criteria += ['TEXT', text]
+    if unseen:
+        criteria.append('UNSEEN')
+
+    # Forward paging only when walking up from after_uid alone
+    newest = after_uid is None or before_uid is not None
+    server.select_folder('INBOX', readonly=True)
+    uids, total = search_uids(server, criteria, limit, newest)
+    # "n:*" always matches the highest UID, even if it is below n
+    uids = [uid for uid in uids if uid >= low]
+
+    entries = sorted(fetch_email_list(server, uids), key=lambda e: int(e.id))
+    next_cursor = None
+    if uids and total > len(uids):
+        next_cursor = uids[0] if newest else uids[-1]
+    return EmailPage(entries, next_cursor)
+
+
+def fetch_mailbox_status(server: IMAPClient, folder: str = 'INBOX') -> Dict[str, int]:
+    """
+    Read the folder's change counters with STATUS, without selecting it.
+
+    Returns:
+        Dict with UIDVALIDITY, UIDNEXT, MESSAGES and, when the server
+        supports CONDSTORE, HIGHESTMODSEQ
+    """
+    items = ['UIDVALIDITY', 'UIDNEXT', 'MESSAGES']
+    if server.has_capability('CONDSTORE'):
+        items.append('HIGHESTMODSEQ')
+    status = server.folder_status(folder, items)
+    return {_text(name): int(value) for name, value in status.items()}
+
+
+def listing_etag(status: Dict[str, int], *variant) -> str:
+    """
+    Build a weak ETag for a mailbox listing.
+
+    Any delivery, expunge or (with CONDSTORE) flag change moves one of the
+    STATUS counters; variant carries the request parameters that shape the
+    listing, such as the time window and limit.
+    """
+    counters = ":".join(
+        str(status.get(name, "")) for name in ('UIDVALIDITY', 'UIDNEXT', 'MESSAGES', 'HIGHESTMODSEQ')
+    )
+    raw = counters + "|" + "|".join(str(v) for v in variant)
+    return f'W/"{hashlib.sha1(raw.encode()).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against an ETag using weak comparison."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
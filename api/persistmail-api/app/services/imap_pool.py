@@ -0,0 +1,196 @@
+"""
+Process-wide pool of authenticated IMAP sessions.
+
+Opening an IMAP session costs a TCP connect, a TLS handshake and a LOGIN.
+Clients typically poll the same mailbox every few seconds, so sessions are
+kept alive between requests and handed out again after a cheap NOOP.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from imapclient import IMAPClient
+from app.core.config import settings
+
+PoolKey = Tuple[str, int, str, str]
+
+
+class _PooledSession:
+    """An idle IMAP session waiting in the pool."""
+
+    def __init__(self, client: IMAPClient):
+        self.client = client
+        self.last_used = time.monotonic()
+
+
+class IMAPSessionPool:
+    """LRU pool of logged-in IMAP sessions keyed by (host, port, mailbox)."""
+
+    def __init__(self, max_sessions: int, idle_timeout: int):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._idle: "OrderedDict[PoolKey, List[_PooledSession]]" = OrderedDict()
+        self._idle_count = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self.stats = {"created": 0, "reused": 0, "evicted": 0, "discarded": 0}
+
+    @staticmethod
+    def make_key(imap_host: str, imap_port: int, mailbox: str, password: str) -> PoolKey:
+        """
+        Build the pool key for a mailbox.
+
+        The password is folded in as a digest so a session logged in with
+        one set of credentials is never handed to a caller using another.
+        """
+        digest = hashlib.sha256(password.encode()).hexdigest()[:16]
+        return (imap_host, imap_port, mailbox.lower(), digest)
+
+    @contextmanager
+    def session(self, key: PoolKey, connect: Callable[[], IMAPClient]) -> Iterator[IMAPClient]:
+        """
+        Check out a session for exclusive use and return it afterwards.
+
+        Args:
+            key: Pool key from make_key()
+            connect: Factory that opens and logs in a new session
+
+        Yields:
+            A logged-in IMAPClient
+        """
+        client = self.acquire(key, connect)
+        try:
+            yield client
+        except BaseException:
+            # The session may be mid-command; never hand it out again
+            self.discard(client)
+            raise
+        else:
+            self.release(key, client)
+
+    def acquire(self, key: PoolKey, connect: Callable[[], IMAPClient]) -> IMAPClient:
+        """Take an idle session for key if a healthy one exists, else connect."""
+        while True:
+            pooled = self._pop_idle(key)
+            if pooled is None:
+                break
+            if time.monotonic() - pooled.last_used > self.idle_timeout:
+                self.discard(pooled.client)
+                continue
+            try:
+                pooled.client.noop()
+            except Exception:
+                self.discard(pooled.client)
+                continue
+            with self._lock:
+                self.stats["reused"] += 1
+            return pooled.client
+
+        client = connect()
+        with self._lock:
+            self.stats["created"] += 1
+        return client
+
+    def release(self, key: PoolKey, client: IMAPClient) -> None:
+        """Return a healthy session to the pool."""
+        evicted = []
+        with self._lock:
+            if self._closed or self.max_sessions <= 0:
+                evicted.append(client)
+            else:
+                self._idle.setdefault(key, []).append(_PooledSession(client))
+                self._idle.move_to_end(key)
+                self._idle_count += 1
+                while self._idle_count > self.max_sessions:
+                    evicted.append(self._evict_lru_locked())
+                    self.stats["evicted"] += 1
+        for stale in evicted:
+            close_session(stale)
+
+    def discard(self, client: IMAPClient) -> None:
+        """Close a session that must not be reused."""
+        with self._lock:
+            self.stats["discarded"] += 1
+        close_session(client)
+
+    def prune_idle(self) -> int:
+        """
+        Close sessions that have been idle longer than the idle timeout.
+
+        Returns:
+            Number of sessions closed
+        """
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key in list(self._idle):
+                sessions = self._idle[key]
+                fresh = [s for s in sessions if now - s.last_used <= self.idle_timeout]
+                expired.extend(s.client for s in sessions if now - s.last_used > self.idle_timeout)
+                if fresh:
+                    self._idle[key] = fresh
+                else:
+                    del self._idle[key]
+            self._idle_count -= len(expired)
+        for client in expired:
+            close_session(client)
+        return len(expired)
+
+    def close_all(self) -> None:
+        """Log out every idle session and refuse to pool new ones."""
+        with self._lock:
+            self._closed = True
+            clients = [s.client for sessions in self._idle.values() for s in sessions]
+            self._idle.clear()
+            self._idle_count = 0
+        for client in clients:
+            close_session(client)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Return pool counters for monitoring."""
+        with self._lock:
+            return {**self.stats, "idle": self._idle_count, "mailboxes": len(self._idle)}
+
+    def _pop_idle(self, key: PoolKey):
+        with self._lock:
+            sessions = self._idle.get(key)
+            if not sessions:
+                return None
+            # Most recently used first: it is the most likely to still be alive
+            pooled = sessions.pop()
+            if not sessions:
+                del self._idle[key]
+            else:
+                self._idle.move_to_end(key)
+            self._idle_count -= 1
+            return pooled
+
+    def _evict_lru_locked(self) -> IMAPClient:
+        key, sessions = next(iter(self._idle.items()))
+        pooled = sessions.pop(0)
+        if not sessions:
+            del self._idle[key]
+        self._idle_count -= 1
+        return pooled.client
+
+
+
+def close_session(client: IMAPClient) -> None:
+    """Log out a session, dropping the socket if LOGOUT itself fails."""
+    try:
+        client.logout()
+    except Exception:
+        try:
+            client.shutdown()
+        except Exception:
+            pass
+
+
+imap_pool = IMAPSessionPool(
+    max_sessions=settings.IMAP_POOL_MAX_SESSIONS,
+    idle_timeout=settings.IMAP_POOL_IDLE_TIMEOUT_SECONDS,
+)
@@ -0,0 +1,140 @@
+"""
+Write-behind buffer for mailbox last-access times.
+
+Every mailbox poll used to commit an UPDATE of last_accessed, turning read
+traffic into one write per request. Polls now record the time in memory
+and a background task writes all recorded times with one bulk UPDATE every
+LAST_ACCESS_FLUSH_INTERVAL_SECONDS; pending times are also written on
+shutdown. A mailbox whose stored last access is less than
+LAST_ACCESS_STALENESS_SECONDS old is not recorded again at all.
+
+The stored value therefore lags real access by at most the staleness plus
+the flush interval (per worker process), a few minutes against the days
+the inactivity cleanup works with. The cleanup flushes this process's
+buffer first and leaves mailboxes with a pending access alone.
+"""
+
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Set
+
+from sqlalchemy import bindparam, update
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.models import Mailbox
+
+
+class LastAccessBuffer:
+    """Mailbox id -> latest access time not yet written to the database."""
+
+    def __init__(self, flush_interval_seconds: int, staleness_seconds: int):
+        self.flush_interval_seconds = flush_interval_seconds
+        self.staleness_seconds = staleness_seconds
+        self._pending: Dict[int, datetime] = {}
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"recorded": 0, "skipped": 0, "written": 0, "flushes": 0, "failed_flushes": 0}
+        self._last_flush_seconds = 0.0
+
+    def touch(self, mailbox: Mailbox) -> None:
+        """
+        Record an access to the mailbox.
+
+        Args:
+            mailbox: Mailbox loaded by the request (its stored last_accessed is checked)
+        """
+        now = datetime.utcnow()
+        stored = mailbox.last_accessed
+        if (
+            mailbox.id not in self._pending
+            and isinstance(stored, datetime)
+            and now - stored < timedelta(seconds=self.staleness_seconds)
+        ):
+            # Recent enough already; nothing would notice the difference
+            self.stats["skipped"] += 1
+            return
+        self._pending[mailbox.id] = now
+        self.stats["recorded"] += 1
+
+    def pending_ids(self) -> Set[int]:
+        """Mailboxes with an access that is not in the database yet."""
+        return set(self._pending)
+
+    async def flush(self) -> int:
+        """
+        Write all pending access times with one bulk UPDATE.
+
+        Returns:
+            Number of mailboxes written
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            started = time.monotonic()
+            try:
+                async with AsyncSessionLocal() as db:
+                    # Core executemany rather than the ORM bulk update: mailboxes
+                    # deleted meanwhile just match nothing instead of failing the batch
+                    await db.execute(
+                        update(Mailbox.__table__)
+                        .where(Mailbox.__table__.c.id == bindparam("mailbox_id"))
+                        .values(last_accessed=bindparam("accessed")),
+                        [{"mailbox_id": mailbox_id, "accessed": accessed} for mailbox_id, accessed in pending.items()]
+                    )
+                    await db.commit()
+            except Exception:
+                self.stats["failed_flushes"] += 1
+                # Keep the times for the next flush; accesses recorded meanwhile are newer
+                for mailbox_id, accessed in pending.items():
+                    self._pending.setdefault(mailbox_id, accessed)
+                raise
+            self._last_flush_seconds = time.monotonic() - started
+            self.stats["flushes"] += 1
+            self.stats["written"] += len(pending)
+            return len(pending)
+
+    def start(self) -> None:
+        """Start the periodic flush on the running loop."""
+        if self._task is not None:
+            return
+        self._lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the periodic flush and write what is still pending."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error writing last access times on shutdown: {str(e)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "pending": len(self._pending),
+            "last_flush_seconds": round(self._last_flush_seconds, 3),
+        }
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval_seconds)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error writing last access times: {str(e)}")
+
+
+last_access = LastAccessBuffer(
+    flush_interval_seconds=settings.LAST_ACCESS_FLUSH_INTERVAL_SECONDS,
+    staleness_seconds=settings.LAST_ACCESS_STALENESS_SECONDS,
+)
@@ -0,0 +1,91 @@
+"""
+List many mailboxes in one request.
+
+Each mailbox is listed exactly as /emails/{mailbox} lists it (message
+index kept current from IMAP), all of them concurrently, with at most
+MAILBOX_FANOUT_PER_HOST listings in flight per IMAP host so one request
+cannot take every worker thread or open a burst of logins against one
+server. Results are handed back in completion order, so a caller waits
+roughly as long as the slowest mailbox rather than the sum of them.
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import select
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.models import Mailbox
+from app.services.email_service import EmailService
+from app.services.last_access import last_access
+from app.services.message_index import message_index
+
+
+class MailboxFanoutService:
+    """Concurrent listing of several mailboxes, bounded per IMAP host."""
+
+    def __init__(self, per_host: int):
+        self.per_host = per_host
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+
+    async def list_mailboxes(self, addresses: List[str], hours: int, limit: int) -> AsyncIterator[Dict[str, Any]]:
+        """
+        List every mailbox, yielding each result as soon as it is ready.
+
+        Args:
+            addresses: Mailbox addresses, without duplicates
+            hours: Time window of each listing
+            limit: Maximum number of emails per mailbox
+
+        Yields:
+            {"mailbox", "emails"} on success, {"mailbox", "status_code", "error"} otherwise
+        """
+        # All rows in one short session; the listings then only take a
+        # connection for their own index reads and writes
+        async with AsyncSessionLocal() as db:
+            rows = (await db.scalars(select(Mailbox).where(Mailbox.email.in_(addresses)))).all()
+        mailboxes = {mailbox.email: mailbox for mailbox in rows}
+
+        tasks = [
+            asyncio.create_task(self._list_mailbox(address, mailboxes.get(address), hours, limit))
+            for address in addresses
+        ]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            # Client went away: stop the listings nobody will read
+            for task in tasks:
+                task.cancel()
+
+    async def _list_mailbox(self, address: str, mailbox: Optional[Mailbox], hours: int, limit: int) -> Dict[str, Any]:
+        try:
+            if not mailbox:
+                raise HTTPException(status_code=404, detail="Mailbox not found")
+            if mailbox.is_expired:
+                raise HTTPException(status_code=410, detail="Mailbox has expired")
+
+            last_access.touch(mailbox)
+
+            imap_host = mailbox.domain.imap_host
+            email_service = EmailService(imap_host, mailbox.domain.imap_port, address, settings.IMAP_SECRET)
+            # Waiting listings hold no database connection
+            async with self._host_limit(imap_host):
+                emails = await message_index.list_emails(mailbox, email_service, hours, limit)
+            return {"mailbox": address, "emails": [email.model_dump(mode="json") for email in emails]}
+
+        except HTTPException as e:
+            return {"mailbox": address, "status_code": e.status_code, "error": e.detail}
+        except Exception as e:
+            print(f"Error listing {address}: {str(e)}")
+            return {"mailbox": address, "status_code": 500, "error": f"Failed to fetch emails: {str(e)}"}
+
+    def _host_limit(self, imap_host: str) -> asyncio.Semaphore:
+        limit = self._host_limits.get(imap_host)
+        if limit is None:
+            limit = self._host_limits[imap_host] = asyncio.Semaphore(self.per_host)
+        return limit
+
+
+mailbox_fanout = MailboxFanoutService(per_host=settings.MAILBOX_FANOUT_PER_HOST)
@@ -0,0 +1,254 @@
+"""
+Warm pool of pre-created Mailcow mailboxes.
+
+Creating a mailbox on request waits for Mailcow's add/mailbox call. Each
+active Mailcow domain instead keeps between MAILBOX_POOL_LOW_WATERMARK and
+MAILBOX_POOL_HIGH_WATERMARK mailboxes that already exist in Mailcow, with
+random local parts, stored as rows with pooled=True and no expiry. POST
+/mailbox without a custom prefix claims one with a single conditional
+UPDATE, so it never calls Mailcow; a background refiller tops the pools
+up again. An empty pool falls back to creating the mailbox on request.
+"""
+
+import asyncio
+import secrets
+import string
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.models import Domain, Mailbox
+from app.services.mailcow_client import MailcowClient
+
+# Candidates fetched per claim attempt; concurrent claims race for the same rows
+CLAIM_CANDIDATES = 8
+
+
+class MailboxPoolService:
+    """Per-domain pools of unassigned mailboxes and their refiller."""
+
+    def __init__(self, low_watermark: int, high_watermark: int):
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self._depth: Dict[str, int] = {}
+        # Domain -> when its pool last dropped below the low watermark
+        self._below_since: Dict[str, float] = {}
+        self._last_refill_lag: Dict[str, float] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"claimed": 0, "empty": 0, "created": 0, "failed": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.high_watermark > 0
+
+    @property
+    def quota_mb(self) -> int:
+        """Quota of pooled mailboxes; requests asking for another quota bypass the pool."""
+        return min(settings.MAILCOW_DEFAULT_QUOTA_MB, settings.MAILCOW_MAX_QUOTA_MB)
+
+    async def claim(self, db: AsyncSession, domain: Domain, quota_mb: int, expires_at: datetime) -> Optional[Mailbox]:
+        """
+        Hand out a pooled mailbox of the domain.
+
+        Args:
+            db: Database session
+            domain: Domain to take the mailbox from
+            quota_mb: Quota the caller wants
+            expires_at: Expiry of the claimed mailbox
+
+        Returns:
+            The claimed mailbox, or None if the pool has none to give
+        """
+        if not self.enabled or quota_mb != self.quota_mb:
+            return None
+
+        for _ in range(3):
+            candidates = list(await db.scalars(
+                select(Mailbox.id).where(
+                    Mailbox.domain_id == domain.id,
+                    Mailbox.pooled == True,
+                    Mailbox.quota_mb == quota_mb
+                ).limit(CLAIM_CANDIDATES)
+            ))
+            if not candidates:
+                break
+            for mailbox_id in candidates:
+                # Only one concurrent claim sees pooled=True on this row
+                now = datetime.utcnow()
+                result = await db.execute(
+                    update(Mailbox)
+                    .where(Mailbox.id == mailbox_id, Mailbox.pooled == True)
+                    .values(pooled=False, expires_at=expires_at, created_at=now, last_accessed=now)
+                )
+                await db.commit()
+                if result.rowcount == 1:
+                    self.stats["claimed"] += 1
+                    self._taken(domain.domain)
+                    return await db.get(Mailbox, mailbox_id, populate_existing=True)
+
+        self.stats["empty"] += 1
+        self._taken(domain.domain, empty=True)
+        return None
+
+    def start(self) -> None:
+        """Start the refiller on the running loop (no-op when the pool is disabled)."""
+        if not self.enabled or self._task is not None:
+            return
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._wake = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Pool depth per domain, refill lag and claim counters."""
+        now = time.monotonic()
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "depth": dict(self._depth),
+            # How long each pool has been below its low watermark
+            "refill_lag_seconds": {name: round(now - since, 1) for name, since in self._below_since.items()},
+            "last_refill_lag_seconds": {name: round(lag, 1) for name, lag in self._last_refill_lag.items()},
+        }
+
+    def _taken(self, domain_name: str, empty: bool = False) -> None:
+        depth = 0 if empty else max(0, self._depth.get(domain_name, 0) - 1)
+        self._depth[domain_name] = depth
+        if depth < self.low_watermark:
+            self._below_since.setdefault(domain_name, time.monotonic())
+            if self._wake is not None:
+                self._wake.set()
+
+    async def _run(self) -> None:
+        client = MailcowClient(settings.MAILCOW_API_URL, settings.MAILCOW_API_KEY)
+        while True:
+            try:
+                await self.refill(client)
+            except Exception as e:
+                print(f"Error refilling mailbox pool: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=settings.MAILBOX_POOL_REFILL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def refill(self, client: MailcowClient) -> int:
+        """
+        Top up every pool that is below the low watermark to the high watermark.
+
+        Args:
+            client: Mailcow client used to create the mailboxes
+
+        Returns:
+            Number of mailboxes added to the pools
+        """
+        async with AsyncSessionLocal() as db:
+            domains = (await db.execute(
+                select(Domain.id, Domain.domain).where(
+                    Domain.is_active == True,
+                    Domain.is_mailcow_managed == True
+                )
+            )).all()
+            depths = dict((await db.execute(
+                select(Mailbox.domain_id, func.count(Mailbox.id)).where(
+                    Mailbox.pooled == True
+                ).group_by(Mailbox.domain_id)
+            )).all())
+
+        added = 0
+        for domain_id, domain_name in domains:
+            depth = depths.get(domain_id, 0)
+            self._depth[domain_name] = depth
+            if depth >= self.low_watermark:
+                self._refilled(domain_name)
+                continue
+
+            self._below_since.setdefault(domain_name, time.monotonic())
+            created = await self._create(client, domain_id, domain_name, self.high_watermark - depth)
+            added += created
+            self._depth[domain_name] = depth + created
+            if depth + created >= self.low_watermark:
+                self._refilled(domain_name)
+        return added
+
+    def _refilled(self, domain_name: str) -> None:
+        since = self._below_since.pop(domain_name, None)
+        if since is not None:
+            self._last_refill_lag[domain_name] = time.monotonic() - since
+
+    async def _create(self, client: MailcowClient, domain_id: int, domain_name: str, count: int) -> int:
+        """Create count mailboxes in Mailcow and add them to the pool."""
+        limit = asyncio.Semaphore(settings.MAILBOX_POOL_REFILL_CONCURRENCY)
+        quota_mb = self.quota_mb
+
+        async def create_one() -> Optional[Dict[str, Any]]:
+            email = f"{_random_local_part()}@{domain_name}"
+            async with limit:
+                try:
+                    result = await client.create_mailbox(email=email, domain=domain_name, quota=quota_mb)
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    print(f"Failed to create pooled mailbox {email}: {str(e)}")
+                    return None
+            return {
+                "email": email,
+                "password": result["password"],
+                "domain_id": domain_id,
+                "quota_mb": quota_mb,
+                "quota_used_mb": 0,
+                "expires_at": None,
+                "mailcow_managed": True,
+                "pooled": True,
+            }
+
+        rows: List[Dict[str, Any]] = [
+            row for row in await asyncio.gather(*(create_one() for _ in range(count))) if row
+        ]
+        if not rows:
+            return 0
+
+        async with AsyncSessionLocal() as db:
+            try:
+                await db.execute(insert(Mailbox), rows)
+                await db.commit()
+            except IntegrityError as e:
+                # A random local part collided with an existing mailbox; insert the rest one by one
+                await db.rollback()
+                print(f"Pooled mailbox insert collided, retrying row by row: {str(e)}")
+                inserted = []
+                for row in rows:
+                    try:
+                        await db.execute(insert(Mailbox), [row])
+                        await db.commit()
+                        inserted.append(row)
+                    except IntegrityError:
+                        await db.rollback()
+                rows = inserted
+
+        self.stats["created"] += len(rows)
+        return len(rows)
+
+
+def _random_local_part(length: int = 10) -> str:
+    chars = string.ascii_lowercase + string.digits
+    return ''.join(secrets.choice(chars) for _ in range(length))
+
+
+mailbox_pool = MailboxPoolService(
+    low_watermark=settings.MAILBOX_POOL_LOW_WATERMARK,
+    high_watermark=settings.MAILBOX_POOL_HIGH_WATERMARK,
+)
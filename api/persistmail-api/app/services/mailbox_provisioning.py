@@ -0,0 +1,160 @@
+"""
+Single-flight creation of mailboxes requested by address.
+
+A newly shared address is often opened by many clients at once, and each
+request used to create the mailbox in Mailcow itself; all but one then
+failed on the unique email constraint. Requests for the same address now
+share one creation task in this process. With MAILBOX_PROVISIONING_DB_LEASE
+a row in mailbox_provisioning also tells other workers that a creation is
+under way, so they wait for the mailbox row instead of creating it again.
+A lease older than MAILBOX_PROVISIONING_LEASE_SECONDS (its worker died) is
+taken over.
+"""
+
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Dict
+
+from fastapi import HTTPException
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.models import Mailbox, MailboxProvisioning
+from app.services.mailbox_service import MailboxService
+
+# How often a request waiting on another worker checks for the mailbox
+POLL_INTERVAL_SECONDS = 0.2
+
+
+class MailboxProvisioner:
+    """Coalesces concurrent creations of the same mailbox."""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.stats = {"created": 0, "coalesced": 0, "waited_on_worker": 0, "failed": 0}
+
+    async def ensure(self, address: str, domain_id: int, domain_name: str) -> int:
+        """
+        Create the mailbox unless it exists or is being created, and wait for it.
+
+        Args:
+            address: Full email address
+            domain_id: Database id of its domain
+            domain_name: Domain name
+
+        Returns:
+            Database id of the mailbox
+        """
+        task = self._inflight.get(address)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.create_task(self._provision(address, domain_id, domain_name))
+            self._inflight[address] = task
+            task.add_done_callback(lambda finished: self._forget(address, finished))
+        else:
+            self.stats["coalesced"] += 1
+        # The creation carries on for the other waiters if this request goes away
+        return await asyncio.shield(task)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {**self.stats, "in_flight": len(self._inflight)}
+
+    def _forget(self, address: str, task: asyncio.Task) -> None:
+        if self._inflight.get(address) is task:
+            del self._inflight[address]
+        if not task.cancelled() and task.exception() is not None:
+            self.stats["failed"] += 1
+
+    async def _provision(self, address: str, domain_id: int, domain_name: str) -> int:
+        deadline = time.monotonic() + settings.MAILBOX_PROVISIONING_WAIT_SECONDS
+        waiting = False
+        while True:
+            async with AsyncSessionLocal() as db:
+                mailbox_id = await _mailbox_id(db, address)
+                if mailbox_id is not None:
+                    return mailbox_id
+                if not settings.MAILBOX_PROVISIONING_DB_LEASE or await _acquire_lease(db, address):
+                    try:
+                        return await self._create(db, address, domain_id, domain_name)
+                    finally:
+                        if settings.MAILBOX_PROVISIONING_DB_LEASE:
+                            await _release_lease(db, address)
+
+            # Another worker holds the lease
+            if not waiting:
+                waiting = True
+                self.stats["waited_on_worker"] += 1
+            if time.monotonic() > deadline:
+                raise HTTPException(status_code=503, detail="Mailbox is still being created, retry shortly")
+            await asyncio.sleep(POLL_INTERVAL_SECONDS)
+
+    async def _create(self, db: AsyncSession, address: str, domain_id: int, domain_name: str) -> int:
+        try:
+            mailbox_result = await MailboxService().create_mailbox(address, domain_name)
+            quota_mb = mailbox_result["quota"]
+        except HTTPException as e:
+            # Left over from an attempt that failed after Mailcow created it
+            if e.status_code != 400 or "object_exists" not in str(e.detail):
+                raise
+            quota_mb = settings.DEFAULT_MAILBOX_QUOTA
+
+        # Store shared password (IMAP_SECRET) for consistency
+        db_mailbox = Mailbox(
+            email=address,
+            domain_id=domain_id,
+            password=settings.IMAP_SECRET,
+            quota_mb=quota_mb,
+            mailcow_managed=True
+        )
+        db_mailbox.set_expiry(settings.MAILBOX_EXPIRY_HOURS)
+        db.add(db_mailbox)
+        try:
+            await db.commit()
+        except IntegrityError:
+            # Created meanwhile through another route (e.g. POST /mailbox)
+            await db.rollback()
+            return await _mailbox_id(db, address)
+
+        self.stats["created"] += 1
+        return db_mailbox.id
+
+
+async def _mailbox_id(db: AsyncSession, address: str):
+    return await db.scalar(select(Mailbox.id).where(Mailbox.email == address))
+
+
+async def _acquire_lease(db: AsyncSession, address: str) -> bool:
+    """Take the creation lease for the address; False if another worker holds a live one."""
+    stale_before = datetime.utcnow() - timedelta(seconds=settings.MAILBOX_PROVISIONING_LEASE_SECONDS)
+    await db.execute(
+        delete(MailboxProvisioning).where(
+            MailboxProvisioning.email == address,
+            MailboxProvisioning.started_at < stale_before
+        ).execution_options(synchronize_session=False)
+    )
+    db.add(MailboxProvisioning(email=address))
+    try:
+        await db.commit()
+        return True
+    except IntegrityError:
+        await db.rollback()
+        return False
+
+
+async def _release_lease(db: AsyncSession, address: str) -> None:
+    try:
+        await db.rollback()
+        await db.execute(
+            delete(MailboxProvisioning).where(MailboxProvisioning.email == address)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+    except Exception as e:
+        # The lease expires on its own
+        print(f"Error releasing provisioning lease for {address}: {str(e)}")
+        await db.rollback()
+
+
+mailbox_provisioner = MailboxProvisioner()
@@ -1,6 +1,7 @@
 from typing import Dict, Any
 from fastapi import HTTPException
 from app.services.mailcow_client import MailcowClient
+from app.services.mailcow_domains import mailcow_domains
 from app.core.config import settings
 
 class MailboxService:
@@ -25,9 +26,9 @@ class MailboxService:
             domain = email.split('@')[1]
             
         try:
-            # Check if domain exists in Mailcow
-            domain_exists = await self.mailcow_client.check_domain_exists(domain)
-            if not domain_exists:
+            # Check if domain exists in Mailcow (cached, so usually no API call)
+            domain_info = await mailcow_domains.get(self.mailcow_client, domain)
+            if domain_info is None or not domain_info.active:
                 raise HTTPException(
                     status_code=400,
                     detail=f"Domain {domain} is not configured in Mailcow"
@@ -37,7 +38,7 @@ class MailboxService:
             result = await self.mailcow_client.create_mailbox(
                 email=email,
                 domain=domain,
-                quota=settings.DEFAULT_MAILBOX_QUOTA
+                quota=domain_info.clamp_quota(settings.DEFAULT_MAILBOX_QUOTA)
             )
             
             return result
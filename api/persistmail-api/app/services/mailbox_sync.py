@@ -0,0 +1,279 @@
+"""
+Incremental mailbox synchronisation with a per-mailbox header cache.
+
+The first listing of a mailbox runs the usual SEARCH SINCE + FETCH. After
+that only the STATUS counters are compared: unchanged mailboxes are served
+straight from the cache, new mail costs a FETCH of the UIDs above the last
+one seen, and (with CONDSTORE) flag changes are picked up with
+FETCH ... (CHANGEDSINCE <modseq>). A UIDVALIDITY change discards the cache.
+
+Each sync also reports what was added and removed, so a persistent index
+(see message_index) can follow along. A cold cache can be seeded from that
+index instead of starting with a full SEARCH + FETCH.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from imapclient import IMAPClient
+from app.models.schemas import EmailList
+from app.core.config import settings
+from app.services.imap_fetch import (
+    MessageSummary,
+    fetch_mailbox_status,
+    fetch_message_summaries,
+    search_uids,
+    since_date,
+)
+from app.services.imap_pool import PoolKey
+
+# (uidvalidity, indexed UIDs) as stored in the message index
+IndexSeed = Tuple[Optional[int], List[int]]
+
+
+class SyncResult:
+    """Outcome of one sync: the cached listing plus what changed on the server."""
+
+    def __init__(
+        self,
+        uidvalidity: int,
+        entries: List[EmailList],
+        added: List[MessageSummary],
+        vanished: List[int],
+    ):
+        self.uidvalidity = uidvalidity
+        self.entries = entries
+        self.added = added
+        self.vanished = vanished
+
+
+class MailboxSyncState:
+    """What we know about one mailbox as of the last sync."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.uidvalidity: Optional[int] = None
+        self.uidnext: int = 0
+        self.last_uid: int = 0
+        self.highestmodseq: Optional[int] = None
+        self.message_count: int = 0
+        self.hours: int = 0        # Widest time window the cache covers
+        self.capacity: int = 0     # Most messages kept in the cache
+        self.truncated = False     # Older in-window messages exist beyond capacity
+        # None marks a UID known from the message index but not fetched here
+        self.messages: "OrderedDict[int, Optional[MessageSummary]]" = OrderedDict()
+        # (uidvalidity, last UID) of the message index when it last matched this state
+        self.indexed: Optional[Tuple[int, int]] = None
+
+    def seed(self, uidvalidity: Optional[int], uids: List[int]) -> None:
+        """
+        Reset the state to what the message index holds.
+
+        Counters are left unknown so the next sync fetches UIDs above the
+        last indexed one and checks the indexed ones for expunges.
+        """
+        self.__init__()
+        if uidvalidity is None or not uids:
+            return
+        self.uidvalidity = uidvalidity
+        self.last_uid = max(uids)
+        self.message_count = -1
+        # Full syncs always cover the default window, so the index does too
+        self.hours = settings.DEFAULT_HOURS_RETENTION
+        self.capacity = settings.MAX_EMAIL_LIMIT
+        self.truncated = len(uids) >= self.capacity
+        for uid in sorted(uids)[-self.capacity:]:
+            self.messages[uid] = None
+
+    def covers(self, hours: int, limit: int) -> bool:
+        return self.uidvalidity is not None and hours <= self.hours and limit <= self.capacity
+
+    def listing(self, hours: int, limit: int) -> List[EmailList]:
+        """Cached entries inside the SEARCH SINCE window, oldest first, at most limit."""
+        since_day = (datetime.now() - timedelta(hours=hours)).date()
+        entries = [
+            summary.entry for summary in self.messages.values()
+            if summary is not None
+            and (summary.internal_date is None or summary.internal_date.date() >= since_day)
+        ]
+        return entries[-limit:] if limit > 0 else []
+
+
+class MailboxSyncCache:
+    """Thread-safe LRU of sync states keyed by pool key."""
+
+    def __init__(self, max_mailboxes: int):
+        self.max_mailboxes = max_mailboxes
+        self._states: "OrderedDict[PoolKey, MailboxSyncState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: PoolKey) -> MailboxSyncState:
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                state = MailboxSyncState()
+                self._states[key] = state
+                while len(self._states) > self.max_mailboxes:
+                    self._states.popitem(last=False)
+            else:
+                self._states.move_to_end(key)
+            return state
+
+    def discard(self, key: PoolKey) -> None:
+        with self._lock:
+            self._states.pop(key, None)
+
+    def forget_mailbox(self, mailbox: str) -> None:
+        """Drop the state of a mailbox under every host and credential it was synced with."""
+        with self._lock:
+            for key in [key for key in self._states if key[2] == mailbox.lower()]:
+                del self._states[key]
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"mailboxes": len(self._states), "max_mailboxes": self.max_mailboxes}
+
+
+def sync_mailbox(
+    server: IMAPClient,
+    state: MailboxSyncState,
+    hours: int,
+    limit: int,
+    seed: Optional[IndexSeed] = None,
+) -> SyncResult:
+    """
+    Bring the cached state up to date and return the requested listing.
+
+    Args:
+        server: Logged-in client (any or no folder selected)
+        state: Cached state for this mailbox, updated in place
+        hours: Time window of the listing
+        limit: Maximum number of entries
+        seed: Contents of the message index when it no longer matches the state
+
+    Returns:
+        SyncResult with EmailList entries (oldest first) and the changes applied
+    """
+    with state.lock:
+        if seed is not None:
+            state.seed(*seed)
+        result = SyncResult(0, [], [], [])
+        status = fetch_mailbox_status(server)
+        if status['UIDVALIDITY'] != state.uidvalidity:
+            # New mailbox or UIDs were reassigned: nothing cached is trustworthy.
+            # Full syncs cover at least the default window so a seeded state can rely on it
+            state.messages.clear()
+            window = max(hours, settings.DEFAULT_HOURS_RETENTION)
+            _full_sync(server, state, status, window, limit, result)
+        elif not state.covers(hours, limit):
+            window = max(hours, state.hours, settings.DEFAULT_HOURS_RETENTION)
+            _full_sync(server, state, status, window, max(limit, state.capacity), result)
+        elif (
+            status['UIDNEXT'] != state.uidnext
+            or status['MESSAGES'] != state.message_count
+            or status.get('HIGHESTMODSEQ') != state.highestmodseq
+        ):
+            if not _incremental_sync(server, state, status, result):
+                _full_sync(server, state, status, state.hours, max(limit, state.capacity), result)
+        result.uidvalidity = state.uidvalidity
+        result.entries = state.listing(hours, limit)
+        return result
+
+
+def _full_sync(
+    server: IMAPClient,
+    state: MailboxSyncState,
+    status: Dict[str, int],
+    hours: int,
+    limit: int,
+    result: SyncResult,
+) -> None:
+    server.select_folder('INBOX', readonly=True)
+    capacity = max(limit, settings.MAX_EMAIL_LIMIT)
+    # Only the newest capacity UIDs are needed; ESEARCH avoids listing the rest
+    uids, total = search_uids(server, ['SINCE', since_date(hours)], capacity)
+
+    # Anything we knew about inside the returned range that SEARCH no longer matches is gone
+    found = set(uids)
+    result.vanished.extend(uid for uid in state.messages if uids and uid >= uids[0] and uid not in found)
+    known = {uid for uid, summary in state.messages.items() if summary is not None}
+    state.messages.clear()
+    for summary in sorted(fetch_message_summaries(server, uids), key=lambda s: s.uid):
+        state.messages[summary.uid] = summary
+        if summary.uid not in known:
+            result.added.append(summary)
+
+    state.uidvalidity = status['UIDVALIDITY']
+    state.uidnext = status['UIDNEXT']
+    state.last_uid = status['UIDNEXT'] - 1
+    state.highestmodseq = status.get('HIGHESTMODSEQ')
+    state.message_count = status['MESSAGES']
+    state.hours = hours
+    state.capacity = capacity
+    state.truncated = total > capacity
+
+
+def _incremental_sync(server: IMAPClient, state: MailboxSyncState, status: Dict[str, int], result: SyncResult) -> bool:
+    """
+    Apply new messages, flag changes and expunges since the last sync.
+
+    Returns:
+        False when the cache can no longer answer correctly and needs a full sync
+    """
+    server.select_folder('INBOX', readonly=True)
+    previous_uids = list(state.messages)
+    arrived = 0
+
+    if status['UIDNEXT'] > state.last_uid + 1:
+        if status['UIDNEXT'] - state.last_uid - 1 <= state.capacity:
+            # UID range FETCH: no SEARCH round trip needed
+            candidates = f"{state.last_uid + 1}:*"
+        else:
+            new_uids, arrived = search_uids(server, ['UID', f"{state.last_uid + 1}:*"], state.capacity)
+            candidates = [uid for uid in new_uids if uid > state.last_uid]
+        fetched = 0
+        for summary in sorted(fetch_message_summaries(server, candidates), key=lambda s: s.uid):
+            # "n:*" always matches the highest UID, even if it is below n
+            if summary.uid > state.last_uid:
+                state.messages[summary.uid] = summary
+                result.added.append(summary)
+                fetched += 1
+        arrived = max(arrived, fetched)
+
+    if (
+        state.highestmodseq is not None
+        and status.get('HIGHESTMODSEQ') not in (None, state.highestmodseq)
+        and previous_uids
+    ):
+        changed = server.fetch(
+            previous_uids, ['FLAGS'], modifiers=[f"CHANGEDSINCE {state.highestmodseq}"]
+        )
+        for uid, data in changed.items():
+            if state.messages.get(uid) is not None:
+                state.messages[uid].flags = tuple(data.get(b'FLAGS', ()))
+
+    # Fewer messages than expected means something was expunged
+    if state.message_count + arrived != status['MESSAGES'] and state.messages:
+        remaining = set(server.search(['UID', f"{min(state.messages)}:{state.last_uid}"]))
+        vanished = [uid for uid in state.messages if uid <= state.last_uid and uid not in remaining]
+        for uid in vanished:
+            del state.messages[uid]
+        result.vanished.extend(vanished)
+        if vanished and state.truncated:
+            # Older messages now fall inside the window we serve
+            return False
+
+    while len(state.messages) > state.capacity:
+        state.messages.popitem(last=False)
+        state.truncated = True
+
+    state.uidnext = status['UIDNEXT']
+    state.last_uid = max(state.last_uid, status['UIDNEXT'] - 1)
+    state.highestmodseq = status.get('HIGHESTMODSEQ')
+    state.message_count = status['MESSAGES']
+    return True
+
+
+mailbox_sync_cache = MailboxSyncCache(max_mailboxes=settings.MAILBOX_SYNC_CACHE_SIZE)
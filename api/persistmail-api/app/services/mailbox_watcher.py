@@ -0,0 +1,215 @@
+"""
+Push new-mail notifications using IMAP IDLE.
+
+One watcher thread holds an IDLE session per watched mailbox and fans its
+events out to every subscriber of that mailbox. Subscribers each get a
+bounded queue; a subscriber that falls behind has its backlog replaced by a
+single "resync" event instead of growing without limit.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from fastapi import HTTPException
+from imapclient import IMAPClient
+from app.core.config import settings
+from app.services.imap_fetch import fetch_email_list
+from app.services.imap_pool import PoolKey, close_session
+
+
+class MailboxSubscription:
+    """A single client's view of a watched mailbox."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_events: int):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_events)
+
+    def push(self, event: Dict[str, Any]) -> None:
+        """Queue an event; must run on the subscriber's event loop."""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Slow consumer: drop the backlog and ask the client to refetch
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"event": "resync", "data": {"reason": "overflow"}})
+
+    async def next_event(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """Wait for the next event, or return None after timeout."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class MailboxWatcher:
+    """Background IDLE loop for one mailbox, shared by all its subscribers."""
+
+    def __init__(self, key: PoolKey, connect: Callable[[], IMAPClient], on_exit: Callable[["MailboxWatcher"], None]):
+        self.key = key
+        self.host = key[0]
+        self._connect = connect
+        self._on_exit = on_exit
+        self._subscribers: Set[MailboxSubscription] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"imap-idle-{key[2]}", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def add(self, subscription: MailboxSubscription) -> None:
+        with self._lock:
+            self._subscribers.add(subscription)
+
+    def remove(self, subscription: MailboxSubscription) -> int:
+        """Remove a subscriber and return how many remain."""
+        with self._lock:
+            self._subscribers.discard(subscription)
+            remaining = len(self._subscribers)
+        if remaining == 0:
+            self._stop.set()
+        return remaining
+
+    def _publish(self, event: Dict[str, Any]) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.push, event)
+            except RuntimeError:
+                # Subscriber's loop is closed
+                self.remove(subscription)
+
+    def _run(self) -> None:
+        try:
+            first_attempt = True
+            while not self._stop.is_set():
+                try:
+                    self._watch(resync=not first_attempt)
+                except Exception as e:
+                    print(f"IDLE session for {self.key[2]} failed: {str(e)}")
+                    self._publish({"event": "error", "data": {"detail": "Mail server connection lost, reconnecting"}})
+                first_attempt = False
+                self._stop.wait(settings.IMAP_IDLE_RECONNECT_SECONDS)
+        finally:
+            self._on_exit(self)
+
+    def _watch(self, resync: bool) -> None:
+        server = self._connect()
+        try:
+            server.select_folder('INBOX')
+            known_uids: Set[int] = set(server.search(['ALL']))
+            if resync:
+                # Events may have been missed while reconnecting
+                self._publish({"event": "resync", "data": {"reason": "reconnected"}})
+
+            while not self._stop.is_set():
+                server.idle()
+                idle_started = time.monotonic()
+                responses: List = []
+                while not self._stop.is_set() and not responses:
+                    responses = server.idle_check(timeout=settings.IMAP_IDLE_CHECK_SECONDS)
+                    # Servers drop IDLE after ~30 minutes; renew well before that
+                    if time.monotonic() - idle_started > settings.IMAP_IDLE_RENEW_SECONDS:
+                        break
+                server.idle_done()
+
+                kinds = {r[1] for r in responses if len(r) > 1 and isinstance(r[1], bytes)}
+                if b'EXISTS' in kinds or b'EXPUNGE' in kinds:
+                    known_uids = self._sync(server, known_uids)
+        finally:
+            close_session(server)
+
+    def _sync(self, server: IMAPClient, known_uids: Set[int]) -> Set[int]:
+        """Publish message and expunge events for changes since the last check."""
+        current_uids = set(server.search(['ALL']))
+
+        vanished = sorted(known_uids - current_uids)
+        if vanished:
+            self._publish({"event": "expunge", "data": {"ids": [str(uid) for uid in vanished]}})
+
+        new_uids = sorted(current_uids - known_uids)
+        if new_uids:
+            for entry in fetch_email_list(server, new_uids):
+                self._publish({"event": "message", "data": entry.model_dump(mode="json")})
+
+        return current_uids
+
+
+class MailboxWatcherRegistry:
+    """Process-wide registry of IDLE watchers with a per-host session cap."""
+
+    def __init__(self, max_per_host: int):
+        self.max_per_host = max_per_host
+        self._watchers: Dict[PoolKey, MailboxWatcher] = {}
+        # Live IDLE threads per host, including ones still winding down
+        self._sessions_per_host: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, key: PoolKey, connect: Callable[[], IMAPClient]) -> MailboxSubscription:
+        """
+        Subscribe to new-mail events for a mailbox, starting its watcher if needed.
+
+        Raises:
+            HTTPException: 503 when the IMAP host already has the maximum number of IDLE sessions
+        """
+        subscription = MailboxSubscription(asyncio.get_running_loop(), settings.IMAP_STREAM_QUEUE_SIZE)
+        with self._lock:
+            watcher = self._watchers.get(key)
+            if watcher is None:
+                if self._sessions_per_host.get(key[0], 0) >= self.max_per_host:
+                    raise HTTPException(
+                        status_code=503,
+                        detail="Too many mailboxes are being watched on this mail server, please poll instead"
+                    )
+                watcher = MailboxWatcher(key, connect, self._forget)
+                self._watchers[key] = watcher
+                self._sessions_per_host[key[0]] = self._sessions_per_host.get(key[0], 0) + 1
+                watcher.add(subscription)
+                watcher.start()
+            else:
+                watcher.add(subscription)
+        return subscription
+
+    def unsubscribe(self, key: PoolKey, subscription: MailboxSubscription) -> None:
+        with self._lock:
+            watcher = self._watchers.get(key)
+            if watcher is None:
+                return
+            if watcher.remove(subscription) == 0:
+                # Let a new subscriber start a fresh watcher right away
+                del self._watchers[key]
+
+    def stop_all(self) -> None:
+        with self._lock:
+            watchers = list(self._watchers.values())
+            self._watchers.clear()
+        for watcher in watchers:
+            watcher.stop()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "watched_mailboxes": len(self._watchers),
+                "idle_sessions_per_host": dict(self._sessions_per_host),
+            }
+
+    def _forget(self, watcher: MailboxWatcher) -> None:
+        """Called from the watcher thread once its IDLE session is closed."""
+        with self._lock:
+            if self._watchers.get(watcher.key) is watcher:
+                del self._watchers[watcher.key]
+            remaining = self._sessions_per_host.get(watcher.host, 1) - 1
+            if remaining > 0:
+                self._sessions_per_host[watcher.host] = remaining
+            else:
+                self._sessions_per_host.pop(watcher.host, None)
+
+
+mailbox_watchers = MailboxWatcherRegistry(max_per_host=settings.IMAP_IDLE_MAX_SESSIONS_PER_HOST)
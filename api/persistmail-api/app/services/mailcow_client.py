@@ -1,9 +1,10 @@
 import httpx
 import secrets
 import string
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from fastapi import HTTPException
 from app.core.config import settings
+from app.services.http_client import http_client
 
 class MailcowClient:
     def __init__(self, api_url: str, api_key: str):
@@ -53,39 +54,39 @@ class MailcowClient:
         }
 
         try:
-            async with httpx.AsyncClient(timeout=settings.HTTP_TIMEOUT_SECONDS) as client:
-                response = await client.post(
-                    f"{self.api_url}/api/v1/add/mailbox",
-                    json=mailbox_data,
-                    headers=self.headers
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    # Check if any success responses exist
-                    success_responses = [r for r in result if r.get("type") == "success"]
-                    if success_responses:
-                        return {
-                            "email": email,
-                            "password": password,
-                            "quota": quota,
-                            "created": True,
-                            "mailcow_response": result
-                        }
-                    else:
-                        # Look for error messages
-                        error_msgs = [r.get("msg", []) for r in result if r.get("type") == "error"]
-                        error_text = str(error_msgs) if error_msgs else f"Unknown error - Full response: {result}"
-                        raise HTTPException(
-                            status_code=400,
-                            detail=f"Mailcow API error: {error_text}"
-                        )
+            client = http_client.get()
+            response = await client.post(
+                f"{self.api_url}/api/v1/add/mailbox",
+                json=mailbox_data,
+                headers=self.headers
+            )
+            
+            if response.status_code == 200:
+                result = response.json()
+                # Check if any success responses exist
+                success_responses = [r for r in result if r.get("type") == "success"]
+                if success_responses:
+                    return {
+                        "email": email,
+                        "password": password,
+                        "quota": quota,
+                        "created": True,
+                        "mailcow_response": result
+                    }
                 else:
+                    # Look for error messages
+                    error_msgs = [r.get("msg", []) for r in result if r.get("type") == "error"]
+                    error_text = str(error_msgs) if error_msgs else f"Unknown error - Full response: {result}"
                     raise HTTPException(
-                        status_code=response.status_code,
-                        detail=f"Mailcow API request failed: {response.text}"
+                        status_code=400,
+                        detail=f"Mailcow API error: {error_text}"
                     )
-                    
+            else:
+                raise HTTPException(
+                    status_code=response.status_code,
+                    detail=f"Mailcow API request failed: {response.text}"
+                )
+                
         except httpx.RequestError as e:
             raise HTTPException(
                 status_code=500,
@@ -102,26 +103,82 @@ class MailcowClient:
         Returns:
             True if successful
         """
-        try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
+        results = await self.delete_mailboxes([email])
+        return results[email] is None
+
+    async def delete_mailboxes(self, emails: List[str], batch_size: Optional[int] = None) -> Dict[str, Optional[str]]:
+        """
+        Delete many mailboxes, sending up to batch_size addresses per Mailcow call.
+        
+        Args:
+            emails: Full email addresses to delete
+            batch_size: Addresses per request (default: MAILCOW_DELETE_BATCH_SIZE)
+            
+        Returns:
+            Dict mapping every address to None if Mailcow confirmed the
+            deletion, or to the error reported for it otherwise
+        """
+        if batch_size is None:
+            batch_size = settings.MAILCOW_DELETE_BATCH_SIZE
+        results: Dict[str, Optional[str]] = {}
+        
+        for start in range(0, len(emails), batch_size):
+            chunk = emails[start:start + batch_size]
+            try:
+                client = http_client.get()
                 response = await client.post(
                     f"{self.api_url}/api/v1/delete/mailbox",
-                    json=[email],  # Mailcow expects an array
+                    json=chunk,  # Mailcow expects an array
                     headers=self.headers
                 )
                 
                 if response.status_code == 200:
-                    result = response.json()
-                    # Check for success responses in the array
-                    success_responses = [r for r in result if r.get("type") == "success"]
-                    return len(success_responses) > 0
+                    results.update(self._match_delete_results(chunk, response.json()))
                 else:
-                    print(f"Failed to delete mailbox {email}: {response.text}")
-                    return False
+                    print(f"Failed to delete {len(chunk)} mailboxes: {response.text}")
+                    results.update((email, f"HTTP {response.status_code}") for email in chunk)
                     
-        except httpx.RequestError as e:
-            print(f"Failed to connect to Mailcow API for deletion: {str(e)}")
-            return False
+            except (httpx.RequestError, ValueError) as e:
+                print(f"Failed to connect to Mailcow API for deletion: {str(e)}")
+                results.update((email, str(e)) for email in chunk)
+        
+        return results
+
+    @staticmethod
+    def _match_delete_results(chunk: List[str], result: Any) -> Dict[str, Optional[str]]:
+        """
+        Attribute each entry of a delete/mailbox response to its address.
+        
+        Mailcow answers with one entry per address, e.g.
+        {"type": "success", "msg": ["mailbox_removed", "a@domain.com"]}. An
+        entry that names no address from the chunk (a bare "access_denied")
+        is attributed only when the chunk has a single address; otherwise it
+        becomes the error of every address left unconfirmed.
+        """
+        entries = result if isinstance(result, list) else [result]
+        pending = {email.lower(): email for email in chunk}
+        results: Dict[str, Optional[str]] = {}
+        unmatched = []
+        
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            msg = entry.get("msg")
+            words = msg if isinstance(msg, list) else [msg]
+            email = next((pending[w.lower()] for w in words if isinstance(w, str) and w.lower() in pending), None)
+            if email is None and len(chunk) == 1:
+                email = chunk[0]
+            if email is None:
+                unmatched.append(str(msg))
+            elif entry.get("type") == "success":
+                results[email] = None
+            elif email not in results:
+                results[email] = str(msg)
+        
+        error = "; ".join(unmatched) or "No confirmation from Mailcow"
+        for email in chunk:
+            results.setdefault(email, error)
+        return results
 
     async def get_mailbox_info(self, email: str) -> Optional[Dict[str, Any]]:
         """
@@ -134,17 +191,17 @@ class MailcowClient:
             Mailbox information or None if not found
         """
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(
-                    f"{self.api_url}/api/v1/get/mailbox/{email}",
-                    headers=self.headers
-                )
+            client = http_client.get()
+            response = await client.get(
+                f"{self.api_url}/api/v1/get/mailbox/{email}",
+                headers=self.headers
+            )
+            
+            if response.status_code == 200:
+                return response.json()
+            else:
+                return None
                 
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    return None
-                    
         except httpx.RequestError:
             return None
 
@@ -166,41 +223,89 @@ class MailcowClient:
             }
         return None
 
+    async def get_mailbox_quotas(self, domain: str) -> Optional[Dict[str, int]]:
+        """
+        Get quota usage of every mailbox in a domain with one listing call.
+        
+        Args:
+            domain: Domain name
+            
+        Returns:
+            Dict mapping lower-cased email addresses to used quota in bytes,
+            or None if the API could not be queried
+        """
+        try:
+            client = http_client.get()
+            response = await client.get(
+                f"{self.api_url}/api/v1/get/mailbox/all/{domain}",
+                headers=self.headers
+            )
+            
+            if response.status_code != 200:
+                print(f"Failed to list Mailcow mailboxes of {domain}: {response.text}")
+                return None
+            mailboxes = response.json()
+            if isinstance(mailboxes, dict):
+                # Single mailbox response (or {} for an empty domain)
+                mailboxes = [mailboxes] if mailboxes.get("username") else []
+            
+            quotas = {}
+            for mailbox_info in mailboxes if isinstance(mailboxes, list) else []:
+                username = mailbox_info.get("username")
+                if username:
+                    quotas[username.lower()] = int(mailbox_info.get("quota_used") or 0)
+            return quotas
+                
+        except (httpx.RequestError, ValueError) as e:
+            print(f"Failed to connect to Mailcow API for mailbox list: {str(e)}")
+            return None
+
+    async def get_domains(self) -> Optional[List[Dict[str, Any]]]:
+        """
+        Get every domain configured in Mailcow.
+        
+        Returns:
+            List of Mailcow domain records, or None if the API could not be queried
+        """
+        try:
+            client = http_client.get()
+            response = await client.get(
+                f"{self.api_url}/api/v1/get/domain/all",
+                headers=self.headers
+            )
+            
+            if response.status_code != 200:
+                print(f"Failed to list Mailcow domains: {response.text}")
+                return None
+            domains = response.json()
+            if isinstance(domains, dict):
+                # Single domain response
+                return [domains]
+            return domains if isinstance(domains, list) else []
+                
+        except (httpx.RequestError, ValueError) as e:
+            print(f"Failed to connect to Mailcow API for domain list: {str(e)}")
+            return None
+
     async def check_domain_exists(self, domain: str) -> bool:
         """
         Check if a domain exists in Mailcow.
         
+        Downloads the whole domain list; mailbox creation uses the cached
+        copy in mailcow_domains instead.
+        
         Args:
             domain: Domain name to check
             
         Returns:
             True if domain exists and is active
         """
-        try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                # Get all domains and check if our domain is in the list
-                response = await client.get(
-                    f"{self.api_url}/api/v1/get/domain/all",
-                    headers=self.headers
-                )
-                
-                if response.status_code == 200:
-                    domains = response.json()
-                    if isinstance(domains, list):
-                        for domain_info in domains:
-                            if (domain_info.get("domain_name") == domain and 
-                                domain_info.get("active") in ["1", 1, True]):
-                                return True
-                    elif isinstance(domains, dict):
-                        # Single domain response
-                        return (domains.get("domain_name") == domain and 
-                               domains.get("active") in ["1", 1, True])
-                    return False
-                else:
-                    return False
-                    
-        except httpx.RequestError:
-            return False
+        domains = await self.get_domains()
+        for domain_info in domains or []:
+            if (domain_info.get("domain_name") == domain and 
+                domain_info.get("active") in ["1", 1, True]):
+                return True
+        return False
 
     async def health_check(self) -> bool:
         """
@@ -210,12 +315,12 @@ class MailcowClient:
             True if API is accessible
         """
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                # Use a simple endpoint that should work with any API key
-                response = await client.get(
-                    f"{self.api_url}/api/v1/get/mailq/all",
-                    headers=self.headers
-                )
-                return response.status_code == 200
+            client = http_client.get()
+            # Use a simple endpoint that should work with any API key
+            response = await client.get(
+                f"{self.api_url}/api/v1/get/mailq/all",
+                headers=self.headers
+            )
+            return response.status_code == 200
         except httpx.RequestError:
             return False
@@ -0,0 +1,118 @@
+"""
+In-process cache of Mailcow domain state.
+
+Mailcow only lists domains as a whole (get/domain/all), which is large on
+a busy server and was downloaded for every auto-created mailbox. The list
+is kept here for MAILCOW_DOMAIN_CACHE_TTL_SECONDS. After that it is still
+served for up to MAILCOW_DOMAIN_CACHE_STALE_SECONDS while one background
+refresh replaces it (stale-while-revalidate), so mailbox creation never
+waits on the download once the cache is warm. Admin domain changes
+invalidate it.
+"""
+
+import asyncio
+import time
+from typing import Any, Dict, Optional, Set
+
+from app.core.config import settings
+from app.services.mailcow_client import MailcowClient
+
+
+class MailcowDomain:
+    """What mailbox creation needs to know about one Mailcow domain."""
+
+    def __init__(self, info: Dict[str, Any]):
+        self.name: str = info.get("domain_name", "")
+        self.active: bool = info.get("active") in ["1", 1, True]
+        # Mailcow reports quotas in bytes; 0 means unlimited
+        self.max_quota_mb: int = _int(info.get("max_quota_for_mbox")) // (1024 * 1024)
+
+    def clamp_quota(self, quota_mb: int) -> int:
+        """Largest quota up to quota_mb that the domain accepts for a mailbox."""
+        if self.max_quota_mb > 0:
+            return min(quota_mb, self.max_quota_mb)
+        return quota_mb
+
+
+def _int(value: Any) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class MailcowDomainCache:
+    """Domain name -> MailcowDomain, refreshed from Mailcow in the background."""
+
+    def __init__(self, ttl_seconds: int, stale_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self._domains: Optional[Dict[str, MailcowDomain]] = None
+        self._loaded_at = 0.0
+        self._refresh: Optional[asyncio.Task] = None
+        # Strong references: the loop only keeps weak ones, and invalidate() drops _refresh
+        self._tasks: Set[asyncio.Task] = set()
+        self._generation = 0
+
+    async def get(self, client: MailcowClient, name: str) -> Optional[MailcowDomain]:
+        """
+        Look up a domain, downloading the domain list only when the cache is cold or too old.
+
+        Args:
+            client: Mailcow client used for refreshes
+            name: Domain name
+
+        Returns:
+            MailcowDomain, or None if Mailcow does not know the domain (or
+            could not be reached and nothing is cached)
+        """
+        age = time.monotonic() - self._loaded_at
+        if self._domains is None or age > self.ttl_seconds + self.stale_seconds:
+            # Shielded: one waiter being cancelled must not cancel the refresh for the others
+            await asyncio.shield(self._start_refresh(client))
+        elif age > self.ttl_seconds:
+            # Serve what we have; the next lookups see the new list
+            self._start_refresh(client)
+
+        if self._domains is None:
+            return None
+        return self._domains.get(name.lower())
+
+    def invalidate(self) -> None:
+        """Forget the domain list; the next lookup downloads it again."""
+        self._domains = None
+        self._loaded_at = 0.0
+        # A refresh already in flight may predate the change: it runs to completion
+        # but the generation check discards its result
+        self._generation += 1
+        self._refresh = None
+
+    def _start_refresh(self, client: MailcowClient) -> asyncio.Task:
+        """Start a refresh unless one is already running on this loop; await the result to wait for it."""
+        refresh = self._refresh
+        if refresh is None or refresh.done() or refresh.get_loop() is not asyncio.get_running_loop():
+            refresh = self._refresh = asyncio.create_task(self._load(client, self._generation))
+            self._tasks.add(refresh)
+            refresh.add_done_callback(self._tasks.discard)
+        return refresh
+
+    async def _load(self, client: MailcowClient, generation: int) -> None:
+        try:
+            domains = await client.get_domains()
+        except Exception as e:
+            print(f"Error refreshing Mailcow domain list: {str(e)}")
+            domains = None
+        if domains is None:
+            # Keep serving the old list; the next lookup tries again
+            print("Failed to refresh Mailcow domain list")
+            return
+        if generation != self._generation:
+            return
+        self._domains = {domain.name.lower(): domain for domain in map(MailcowDomain, domains)}
+        self._loaded_at = time.monotonic()
+
+
+mailcow_domains = MailcowDomainCache(
+    ttl_seconds=settings.MAILCOW_DOMAIN_CACHE_TTL_SECONDS,
+    stale_seconds=settings.MAILCOW_DOMAIN_CACHE_STALE_SECONDS,
+)
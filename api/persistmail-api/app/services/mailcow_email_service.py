@@ -2,16 +2,18 @@
 Enhanced email service for Mailcow integration.
 """
 
-from typing import List, Optional
-from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from imapclient import IMAPClient
 from fastapi import HTTPException
-from app.models.schemas import EmailList, EmailDetail
+from app.models.schemas import EmailDetail
 from app.core.config import settings
-import email
+from app.services.imap_pool import imap_pool
+from app.services.imap_executor import imap_executor
+from app.services.imap_fetch import EmailPage, fetch_email_page, fetch_mailbox_status, fetch_message_structure
+from app.services.attachment_stream import AttachmentDownload
+from app.services.email_detail import load_email_detail, stream_email_details
+from app.services.mailbox_sync import IndexSeed, SyncResult, mailbox_sync_cache, sync_mailbox
 import ssl
-from email.header import decode_header
-import base64
 
 class MailcowEmailService:
     """Enhanced email service for Mailcow integration with individual credentials."""
@@ -21,10 +23,11 @@ class MailcowEmailService:
         self.imap_port = imap_port
         self.email_address = email_address
         self.password = password
-        self._server = None
+        self.pool_key = imap_pool.make_key(imap_host, imap_port, email_address, password)
 
-    async def connect(self) -> IMAPClient:
-        """Connect to the IMAP server with individual mailbox credentials."""
+    def connect(self) -> IMAPClient:
+        """Open a new IMAP session with individual mailbox credentials."""
+        server = None
         try:
             print(f"Connecting to {self.imap_host}:{self.imap_port} for {self.email_address}")
             
@@ -43,16 +46,14 @@ class MailcowEmailService:
             # Use individual mailbox credentials instead of shared secret
             server.login(self.email_address, self.password)
             print(f"Login successful for {self.email_address}")
-            
-            self._server = server
-            return self._server
+            return server
             
         except Exception as e:
             print(f"Connection/login failed: {str(e)}")
             print(f"Debug info: Host={self.imap_host}, Port={self.imap_port}, Email={self.email_address}")
-            if self._server:
+            if server:
                 try:
-                    self._server.logout()
+                    server.logout()
                 except:
                     pass
             raise HTTPException(
@@ -60,179 +61,144 @@ class MailcowEmailService:
                 detail=f"Failed to connect to mail server: {str(e)}"
             )
 
-    async def fetch_emails(self, hours: int = 24, limit: int = 25) -> List[EmailList]:
-        """Fetch emails from the IMAP server."""
-        server = None
+    async def mailbox_status(self) -> Dict[str, int]:
+        """Get the INBOX change counters (UIDVALIDITY, UIDNEXT, MESSAGES, HIGHESTMODSEQ)."""
+        return await imap_executor.run(self._mailbox_status)
+
+    def _mailbox_status(self) -> Dict[str, int]:
         try:
-            server = await self.connect()
-            server.select_folder('INBOX')
-            
-            # Calculate the date from hours ago
-            date_from = (datetime.now() - timedelta(hours=hours)).strftime("%d-%b-%Y")
-            messages = server.search(['SINCE', date_from])
-            
-            # Fetch only the most recent emails up to the limit
-            messages = messages[-limit:] if messages else []
+            with imap_pool.session(self.pool_key, self.connect) as server:
+                return fetch_mailbox_status(server)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to get mailbox status: {str(e)}"
+            )
+
+    async def sync_emails(self, hours: int = 24, limit: int = 25, seed: Optional[IndexSeed] = None) -> SyncResult:
+        """Sync the INBOX listing from the IMAP server, optionally re-seeding from the message index."""
+        return await imap_executor.run(self._sync_emails, hours, limit, seed)
+
+    def _sync_emails(self, hours: int, limit: int, seed: Optional[IndexSeed]) -> SyncResult:
+        try:
+            with imap_pool.session(self.pool_key, self.connect) as server:
+                return sync_mailbox(server, mailbox_sync_cache.get(self.pool_key), hours, limit, seed)
             
-            if not messages:
-                return []
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error fetching emails: {str(e)}")
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to fetch emails: {str(e)}"
+            )
 
-            email_list = []
-            for msg_id, data in server.fetch(messages, ['ENVELOPE', 'FLAGS', 'RFC822.SIZE']).items():
-                envelope = data[b'ENVELOPE']
-                
-                # Handle None values safely
-                subject = "No Subject"
-                if envelope.subject:
-                    subject = envelope.subject.decode() if isinstance(envelope.subject, bytes) else str(envelope.subject)
-                
-                sender = "Unknown Sender"
-                if envelope.from_ and len(envelope.from_) > 0:
-                    from_addr = envelope.from_[0]
-                    if from_addr.mailbox and from_addr.host:
-                        mailbox = from_addr.mailbox.decode() if isinstance(from_addr.mailbox, bytes) else str(from_addr.mailbox)
-                        host = from_addr.host.decode() if isinstance(from_addr.host, bytes) else str(from_addr.host)
-                        sender = f"{mailbox}@{host}"
-                
-                email_data = EmailList(
-                    id=str(msg_id),
-                    subject=subject,
+    async def fetch_email_page(
+        self,
+        hours: int = 24,
+        limit: int = 25,
+        before_uid: Optional[int] = None,
+        after_uid: Optional[int] = None,
+        sender: Optional[str] = None,
+        subject: Optional[str] = None,
+        text: Optional[str] = None,
+        unseen: bool = False
+    ) -> EmailPage:
+        """Fetch one filtered or cursor-paged page of emails with UID SEARCH."""
+        return await imap_executor.run(
+            self._fetch_email_page, hours, limit, before_uid, after_uid, sender, subject, text, unseen
+        )
+
+    def _fetch_email_page(self, hours, limit, before_uid, after_uid, sender, subject, text, unseen) -> EmailPage:
+        try:
+            with imap_pool.session(self.pool_key, self.connect) as server:
+                return fetch_email_page(
+                    server, hours, limit,
+                    before_uid=before_uid,
+                    after_uid=after_uid,
                     sender=sender,
-                    received_date=envelope.date or datetime.now(),
-                    has_attachments=self._has_attachments(data),
-                    snippet=self._get_snippet(msg_id, server)
+                    subject=subject,
+                    text=text,
+                    unseen=unseen
                 )
-                email_list.append(email_data)
-                
-            return email_list
-            
+        except HTTPException:
+            raise
         except Exception as e:
-            print(f"Error fetching emails: {str(e)}")
             raise HTTPException(
                 status_code=500,
                 detail=f"Failed to fetch emails: {str(e)}"
             )
-        finally:
-            if server and server != self._server:
-                try:
-                    server.logout()
-                except:
-                    pass
 
     async def get_email(self, message_id: str) -> Optional[EmailDetail]:
         """Get detailed email content."""
-        server = None
+        return await imap_executor.run(self._get_email, message_id)
+
+    def _get_email(self, message_id: str) -> Optional[EmailDetail]:
         try:
-            server = await self.connect()
-            server.select_folder('INBOX')
-            
-            # Fetch the specific message
-            messages = server.fetch([int(message_id)], ['RFC822'])
-            if not messages:
-                return None
-                
-            raw_email = messages[int(message_id)][b'RFC822']
-            msg = email.message_from_bytes(raw_email)
-            
-            # Extract email details
-            subject = self._decode_header(msg.get('Subject', 'No Subject'))
-            sender = msg.get('From', 'Unknown Sender')
-            received_date = datetime.now()  # You might want to parse the Date header
-            
-            # Extract body content
-            body_text = ""
-            body_html = ""
-            attachments = []
-            
-            if msg.is_multipart():
-                for part in msg.walk():
-                    content_type = part.get_content_type()
-                    content_disposition = str(part.get('Content-Disposition', ''))
-                    
-                    if 'attachment' in content_disposition:
-                        filename = part.get_filename()
-                        if filename:
-                            attachments.append(filename)
-                    elif content_type == 'text/plain':
-                        charset = part.get_content_charset() or 'utf-8'
-                        body_text = part.get_payload(decode=True).decode(charset, errors='ignore')
-                    elif content_type == 'text/html':
-                        charset = part.get_content_charset() or 'utf-8'
-                        body_html = part.get_payload(decode=True).decode(charset, errors='ignore')
-            else:
-                # Non-multipart message
-                charset = msg.get_content_charset() or 'utf-8'
-                content = msg.get_payload(decode=True).decode(charset, errors='ignore')
-                content_type = msg.get_content_type()
-                
-                if content_type == 'text/html':
-                    body_html = content
-                else:
-                    body_text = content
-            
-            return EmailDetail(
-                id=message_id,
-                subject=subject,
-                sender=sender,
-                received_date=received_date,
-                has_attachments=len(attachments) > 0,
-                body_text=body_text,
-                body_html=body_html,
-                attachments=attachments
+            return load_email_detail(
+                self.pool_key, self.connect, self.imap_host, self.email_address, int(message_id)
             )
-            
+        except HTTPException:
+            raise
         except Exception as e:
             print(f"Error getting email detail: {str(e)}")
             raise HTTPException(
                 status_code=500,
                 detail=f"Failed to get email detail: {str(e)}"
             )
-        finally:
-            if server and server != self._server:
-                try:
-                    server.logout()
-                except:
-                    pass
 
-    def _has_attachments(self, data) -> bool:
-        """Check if email has attachments (simplified implementation)."""
-        # This is a simplified check - you might want to implement a more thorough check
-        return False
+    def get_emails(self, uids: List[int]) -> AsyncIterator[Tuple[int, Optional[EmailDetail]]]:
+        """
+        Get several emails over one IMAP session, without marking them read.
 
-    def _get_snippet(self, msg_id: int, server: IMAPClient) -> str:
-        """Get email snippet/preview."""
-        try:
-            # Fetch body structure to get a snippet
-            messages = server.fetch([msg_id], ['BODY[TEXT]'])
-            if messages and msg_id in messages:
-                body_data = messages[msg_id].get(b'BODY[TEXT]')
-                if body_data:
-                    # Try to decode and get first 100 characters
-                    try:
-                        text = body_data.decode('utf-8', errors='ignore')
-                        return text[:100] + "..." if len(text) > 100 else text
-                    except:
-                        return "Preview not available"
-            return "No content"
-        except:
-            return "Preview not available"
-
-    def _decode_header(self, header_value: str) -> str:
-        """Decode email header that might be encoded."""
-        if not header_value:
-            return ""
-        
+        Args:
+            uids: Message UIDs, in the order they should be looked at
+
+        Returns:
+            Async iterator of (uid, EmailDetail or None when the email is gone),
+            in the order the details become available
+        """
+        return stream_email_details(self.pool_key, self.connect, self.imap_host, self.email_address, uids)
+
+    async def open_attachment(self, message_id: str, part: str) -> Optional[AttachmentDownload]:
+        """
+        Look up one attachment and reserve an IMAP session for streaming it.
+
+        Args:
+            message_id: Message UID
+            part: IMAP section number of the attachment, e.g. "2"
+
+        Returns:
+            AttachmentDownload to stream or close, or None if there is no such part
+        """
+        return await imap_executor.run(self._open_attachment, int(message_id), part)
+
+    def _open_attachment(self, uid: int, section: str) -> Optional[AttachmentDownload]:
         try:
-            decoded_parts = decode_header(header_value)
-            decoded_string = ""
-            for part, encoding in decoded_parts:
-                if isinstance(part, bytes):
-                    if encoding:
-                        decoded_string += part.decode(encoding)
-                    else:
-                        decoded_string += part.decode('utf-8', errors='ignore')
-                else:
-                    decoded_string += str(part)
-            return decoded_string
-        except:
-            return str(header_value)
+            server = imap_pool.acquire(self.pool_key, self.connect)
+            try:
+                server.select_folder('INBOX', readonly=True)
+                structure = fetch_message_structure(server, uid)
+                parts = structure.parts if structure else []
+                part = next((p for p in parts if p.section == section), None)
+                if part is None:
+                    imap_pool.release(self.pool_key, server)
+                    return None
+                
+                download = AttachmentDownload(self.pool_key, server, uid, part)
+                download.prepare()
+                return download
+            except BaseException:
+                imap_pool.discard(server)
+                raise
+            
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error opening attachment: {str(e)}")
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to open attachment: {str(e)}"
+            )
@@ -0,0 +1,306 @@
+"""
+Durable queue (outbox) of Mailcow mailbox creations and deletions.
+
+API handlers add a MailcowJob row in the same transaction as their own
+database change and return without waiting on Mailcow. A worker started
+from the app lifespan claims due jobs in batches, runs the deletions
+through one bulk delete call per MAILCOW_DELETE_BATCH_SIZE addresses and
+the creations MAILCOW_JOB_CONCURRENCY at a time, and retries failures
+with exponential backoff until MAILCOW_JOB_MAX_ATTEMPTS.
+
+Jobs are idempotent. Each one checks the mailbox table before calling
+Mailcow: a creation whose mailbox row is gone and a deletion whose address
+has a mailbox row again are skipped. Mailcow's "object_exists" counts as
+a successful creation, and deleting a missing mailbox already succeeds.
+Claims are made with conditional UPDATEs, so several workers can share
+the queue, and a job left running by a dead worker is picked up again
+after MAILCOW_JOB_LOCK_SECONDS.
+"""
+
+import asyncio
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import and_, delete, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.models import Domain, Mailbox, MailcowJob
+from app.services.email_detail import forget_cached_mail
+from app.services.mailcow_client import MailcowClient
+
+CREATE_MAILBOX = "create_mailbox"
+DELETE_MAILBOX = "delete_mailbox"
+
+# Finished jobs are purged at most this often
+PURGE_INTERVAL_SECONDS = 3600
+
+
+class MailcowJobQueue:
+    """Outbox of Mailcow calls and the worker that carries them out."""
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_purge = 0.0
+        self.stats = {"done": 0, "skipped": 0, "retried": 0, "failed": 0}
+
+    async def enqueue(self, db: AsyncSession, kind: str, emails: Iterable[str], quota_mb: Optional[int] = None) -> int:
+        """
+        Queue jobs in the caller's transaction; they run once the caller commits.
+
+        Args:
+            db: Session the caller commits
+            kind: CREATE_MAILBOX or DELETE_MAILBOX
+            emails: Mailbox addresses
+            quota_mb: Quota for creations
+
+        Returns:
+            Number of jobs added (identical jobs still waiting are not added again)
+        """
+        emails = list(dict.fromkeys(emails))
+        if not emails:
+            return 0
+        queued = set(await db.scalars(
+            select(MailcowJob.email).where(
+                MailcowJob.kind == kind,
+                MailcowJob.email.in_(emails),
+                MailcowJob.status.in_(("pending", "running"))
+            )
+        ))
+        jobs = [
+            {"kind": kind, "email": email, "quota_mb": quota_mb, "status": "pending",
+             "attempts": 0, "run_after": datetime.utcnow()}
+            for email in emails if email not in queued
+        ]
+        if jobs:
+            await db.execute(insert(MailcowJob), jobs)
+        return len(jobs)
+
+    def notify(self) -> None:
+        """Wake the worker after committing new jobs."""
+        if self._wake is not None:
+            self._wake.set()
+
+    def start(self) -> None:
+        """Start the worker on the running loop."""
+        if self._task is not None:
+            return
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._wake = None
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(self.stats)
+
+    async def _run(self) -> None:
+        client = MailcowClient(settings.MAILCOW_API_URL, settings.MAILCOW_API_KEY)
+        while True:
+            try:
+                if await self.run_once(client):
+                    # Keep going while there is work; more may have come due meanwhile
+                    continue
+            except Exception as e:
+                print(f"Error running Mailcow jobs: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=settings.MAILCOW_JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def run_once(self, client: MailcowClient) -> int:
+        """
+        Claim one batch of due jobs and run it.
+
+        Args:
+            client: Mailcow client used for the calls
+
+        Returns:
+            Number of jobs run
+        """
+        jobs = await self._claim()
+        if not jobs:
+            await self._purge()
+            return 0
+
+        outcomes: Dict[int, Optional[str]] = {}
+        await self._run_deletes(client, [job for job in jobs if job.kind == DELETE_MAILBOX], outcomes)
+        await self._run_creates(client, [job for job in jobs if job.kind == CREATE_MAILBOX], outcomes)
+        await self._finish(jobs, outcomes)
+        return len(jobs)
+
+    async def _claim(self) -> List[MailcowJob]:
+        async with AsyncSessionLocal() as db:
+            now = datetime.utcnow()
+            due = or_(
+                and_(MailcowJob.status == "pending", MailcowJob.run_after <= now),
+                and_(
+                    MailcowJob.status == "running",
+                    MailcowJob.locked_at < now - timedelta(seconds=settings.MAILCOW_JOB_LOCK_SECONDS)
+                ),
+            )
+            ids = list(await db.scalars(
+                select(MailcowJob.id).where(due)
+                .order_by(MailcowJob.id).limit(settings.MAILCOW_JOB_BATCH_SIZE)
+            ))
+            if not ids:
+                return []
+            # Rows another worker claimed first no longer match `due`
+            await db.execute(
+                update(MailcowJob).where(MailcowJob.id.in_(ids), due)
+                .values(status="running", locked_by=self.worker_id, locked_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            return list(await db.scalars(
+                select(MailcowJob).where(
+                    MailcowJob.id.in_(ids),
+                    MailcowJob.status == "running",
+                    MailcowJob.locked_by == self.worker_id
+                )
+            ))
+
+    async def _run_deletes(self, client: MailcowClient, jobs: List[MailcowJob], outcomes: Dict[int, Optional[str]]) -> None:
+        if not jobs:
+            return
+        # A mailbox created again since the deletion was queued must stay
+        recreated = await _existing_mailboxes([job.email for job in jobs])
+        pending = []
+        for job in jobs:
+            if job.email in recreated:
+                outcomes[job.id] = None
+                self.stats["skipped"] += 1
+            else:
+                pending.append(job)
+        if not pending:
+            return
+
+        results = await client.delete_mailboxes(list(dict.fromkeys(job.email for job in pending)))
+        for job in pending:
+            outcomes[job.id] = results.get(job.email)
+
+        # The API forgot cached mail in its own process; this worker may be another one
+        deleted = [job.email for job in pending if results.get(job.email) is None]
+        if deleted:
+            hosts = await _imap_hosts(deleted)
+            await forget_cached_mail((hosts[email], email) for email in deleted if email in hosts)
+
+    async def _run_creates(self, client: MailcowClient, jobs: List[MailcowJob], outcomes: Dict[int, Optional[str]]) -> None:
+        if not jobs:
+            return
+        # A mailbox deleted before its creation ran is not created
+        wanted = await _existing_mailboxes([job.email for job in jobs])
+        limit = asyncio.Semaphore(settings.MAILCOW_JOB_CONCURRENCY)
+
+        async def create(job: MailcowJob) -> Optional[str]:
+            if job.email not in wanted:
+                self.stats["skipped"] += 1
+                return None
+            async with limit:
+                try:
+                    await client.create_mailbox(
+                        email=job.email,
+                        domain=job.email.rsplit('@', 1)[-1],
+                        quota=job.quota_mb or settings.MAILCOW_DEFAULT_QUOTA_MB
+                    )
+                    return None
+                except HTTPException as e:
+                    if "object_exists" in str(e.detail):
+                        return None
+                    return str(e.detail)
+                except Exception as e:
+                    return str(e)
+
+        errors = await asyncio.gather(*(create(job) for job in jobs))
+        outcomes.update((job.id, error) for job, error in zip(jobs, errors))
+
+    async def _finish(self, jobs: List[MailcowJob], outcomes: Dict[int, Optional[str]]) -> None:
+        now = datetime.utcnow()
+        changes = []
+        abandoned = []
+        for job in jobs:
+            error = outcomes.get(job.id, "Not run")
+            attempts = job.attempts + 1
+            change = {"id": job.id, "attempts": attempts, "locked_by": None, "locked_at": None, "last_error": error}
+            if error is None:
+                change.update(status="done", finished_at=now)
+                self.stats["done"] += 1
+            elif attempts >= settings.MAILCOW_JOB_MAX_ATTEMPTS:
+                change.update(status="failed", finished_at=now)
+                self.stats["failed"] += 1
+                print(f"Giving up on {job.kind} for {job.email} after {attempts} attempts: {error}")
+                if job.kind == CREATE_MAILBOX:
+                    abandoned.append(job.email)
+            else:
+                delay = min(
+                    settings.MAILCOW_JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1),
+                    settings.MAILCOW_JOB_RETRY_MAX_SECONDS
+                )
+                # Jitter keeps jobs that failed together from retrying together
+                change.update(status="pending", run_after=now + timedelta(seconds=delay * random.uniform(0.5, 1.0)))
+                self.stats["retried"] += 1
+            changes.append(change)
+
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(MailcowJob), changes)
+            if abandoned:
+                # The mailbox never came to exist; don't leave a row that can't log in
+                await db.execute(
+                    delete(Mailbox).where(Mailbox.email.in_(abandoned))
+                    .execution_options(synchronize_session=False)
+                )
+            await db.commit()
+        if abandoned:
+            hosts = await _imap_hosts(abandoned)
+            await forget_cached_mail((hosts[email], email) for email in abandoned if email in hosts)
+
+    async def _purge(self) -> None:
+        if time.monotonic() - self._last_purge < PURGE_INTERVAL_SECONDS:
+            return
+        self._last_purge = time.monotonic()
+        async with AsyncSessionLocal() as db:
+            try:
+                await db.execute(
+                    delete(MailcowJob).where(
+                        MailcowJob.status == "done",
+                        MailcowJob.finished_at < datetime.utcnow() - timedelta(hours=settings.MAILCOW_JOB_RETENTION_HOURS)
+                    ).execution_options(synchronize_session=False)
+                )
+                await db.commit()
+            except Exception as e:
+                print(f"Error purging finished Mailcow jobs: {str(e)}")
+                await db.rollback()
+
+
+async def _existing_mailboxes(emails: List[str]) -> set:
+    async with AsyncSessionLocal() as db:
+        return set(await db.scalars(select(Mailbox.email).where(Mailbox.email.in_(emails))))
+
+
+async def _imap_hosts(emails: List[str]) -> Dict[str, str]:
+    """Address -> IMAP host of its domain, for mailboxes whose row is already gone."""
+    names = {email.rsplit('@', 1)[-1].lower() for email in emails}
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(select(Domain.domain, Domain.imap_host).where(Domain.domain.in_(names)))).all()
+    hosts = {name.lower(): imap_host for name, imap_host in rows}
+    return {
+        email: hosts[email.rsplit('@', 1)[-1].lower()]
+        for email in emails if email.rsplit('@', 1)[-1].lower() in hosts
+    }
+
+
+mailcow_jobs = MailcowJobQueue()
@@ -0,0 +1,163 @@
+"""
+Persistent header index of mailbox contents.
+
+The list endpoints page and sort from the messages table. IMAP is only
+asked for what changed since the index was last brought up to date: UIDs
+above the last indexed one, and indexed UIDs that have since been expunged.
+Rows belong to their mailbox and go away with it (ON DELETE CASCADE).
+"""
+
+from datetime import datetime, time, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import delete, func, or_, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.models import Mailbox, Message
+from app.models.schemas import EmailList
+from app.services.mailbox_sync import IndexSeed, SyncResult, mailbox_sync_cache
+
+
+class MessageIndexService:
+    """Keeps the messages table in step with IMAP and serves listings from it."""
+
+    async def list_emails(self, mailbox: Mailbox, email_service, hours: int, limit: int) -> List[EmailList]:
+        """
+        Bring the index up to date and list from it.
+
+        The index is read and written in short sessions of its own, so no
+        pooled connection is held while IMAP is synced.
+
+        Args:
+            mailbox: Mailbox row being listed
+            email_service: EmailService or MailcowEmailService for the mailbox
+            hours: Time window of the listing
+            limit: Maximum number of entries
+
+        Returns:
+            EmailList entries, oldest first
+        """
+        state = mailbox_sync_cache.get(email_service.pool_key)
+        async with AsyncSessionLocal() as db:
+            cursor = await self.cursor(db, mailbox.id) or (state.uidvalidity, 0)
+            # The sync state only reports changes relative to itself; if the index
+            # moved independently (restart, other worker, recreated mailbox) re-seed it
+            seed = await self.snapshot(db, mailbox.id) if state.indexed != cursor else None
+
+        result = await email_service.sync_emails(hours=hours, limit=limit, seed=seed)
+
+        async with AsyncSessionLocal() as db:
+            try:
+                await self.apply(db, mailbox.id, result)
+            except SQLAlchemyError as e:
+                # Most likely a concurrent request indexed the same UIDs first
+                print(f"Failed to update message index for {mailbox.email}: {str(e)}")
+                await db.rollback()
+                state.indexed = None
+                return result.entries
+            state.indexed = await self.cursor(db, mailbox.id) or (result.uidvalidity, 0)
+
+            return await self.listing(db, mailbox.id, result.uidvalidity, hours, limit)
+
+    async def cursor(self, db: AsyncSession, mailbox_id: int) -> Optional[Tuple[int, int]]:
+        """Return (uidvalidity, last indexed UID), or None for an empty index."""
+        row = (await db.execute(
+            select(Message.uidvalidity, func.max(Message.uid))
+            .where(Message.mailbox_id == mailbox_id)
+            .group_by(Message.uidvalidity)
+            .order_by(func.max(Message.uid).desc())
+            .limit(1)
+        )).first()
+        return (row[0], row[1]) if row else None
+
+    async def snapshot(self, db: AsyncSession, mailbox_id: int) -> IndexSeed:
+        """Return the indexed UIDs the sync state should start from."""
+        cursor = await self.cursor(db, mailbox_id)
+        if cursor is None:
+            return (None, [])
+        uids = await db.scalars(
+            select(Message.uid)
+            .where(Message.mailbox_id == mailbox_id, Message.uidvalidity == cursor[0])
+            .order_by(Message.uid.desc())
+            .limit(settings.MAX_EMAIL_LIMIT)
+        )
+        return (cursor[0], list(uids))
+
+    async def apply(self, db: AsyncSession, mailbox_id: int, result: SyncResult) -> None:
+        """Write the changes reported by a sync and commit."""
+        await db.execute(
+            delete(Message)
+            .where(Message.mailbox_id == mailbox_id, Message.uidvalidity != result.uidvalidity)
+            .execution_options(synchronize_session=False)
+        )
+
+        if result.vanished:
+            await db.execute(
+                delete(Message)
+                .where(
+                    Message.mailbox_id == mailbox_id,
+                    Message.uidvalidity == result.uidvalidity,
+                    Message.uid.in_(result.vanished),
+                )
+                .execution_options(synchronize_session=False)
+            )
+
+        if result.added:
+            # Seeded UIDs can be fetched again after a full sync
+            existing = set(await db.scalars(
+                select(Message.uid).where(
+                    Message.mailbox_id == mailbox_id,
+                    Message.uidvalidity == result.uidvalidity,
+                    Message.uid.in_([summary.uid for summary in result.added]),
+                )
+            ))
+            db.add_all(
+                Message(
+                    mailbox_id=mailbox_id,
+                    uidvalidity=result.uidvalidity,
+                    uid=summary.uid,
+                    subject=summary.entry.subject,
+                    sender=summary.entry.sender,
+                    received_date=summary.entry.received_date,
+                    internal_date=summary.internal_date,
+                    size=summary.size,
+                    has_attachments=summary.entry.has_attachments,
+                    snippet=summary.entry.snippet,
+                )
+                for summary in result.added
+                if summary.uid not in existing
+            )
+
+        await db.commit()
+
+    async def listing(self, db: AsyncSession, mailbox_id: int, uidvalidity: int, hours: int, limit: int) -> List[EmailList]:
+        """Indexed entries inside the SEARCH SINCE window, oldest first, at most limit."""
+        if limit <= 0:
+            return []
+        since = datetime.combine((datetime.now() - timedelta(hours=hours)).date(), time.min)
+        rows = (await db.scalars(
+            select(Message)
+            .where(
+                Message.mailbox_id == mailbox_id,
+                Message.uidvalidity == uidvalidity,
+                or_(Message.internal_date.is_(None), Message.internal_date >= since),
+            )
+            .order_by(Message.uid.desc())
+            .limit(limit)
+        )).all()
+        return [
+            EmailList(
+                id=str(row.uid),
+                subject=row.subject,
+                sender=row.sender,
+                received_date=row.received_date,
+                has_attachments=row.has_attachments,
+                snippet=row.snippet,
+            )
+            for row in reversed(rows)
+        ]
+
+
+message_index = MessageIndexService()
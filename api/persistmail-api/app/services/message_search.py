@@ -0,0 +1,114 @@
+"""
+Full-text search over messages the API has already indexed.
+
+On SQLite, queries go through the FTS5 mirror of the messages table
+(app/db/search_index.py). Listing adds subject, sender and snippet;
+opening an email adds its decoded body text.
+
+Other databases, or SQLite builds without FTS5, fall back to LIKE matching
+on the same columns.
+"""
+
+import re
+from typing import List
+
+from sqlalchemy import and_, or_, select, text, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.db.session import FTS_ENABLED
+from app.models.models import Message
+from app.models.schemas import EmailDetail, EmailList
+from app.services.imap_fetch import html_to_text
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class MessageSearchService:
+    """Search indexed messages of one mailbox."""
+
+    def __init__(self, fts_enabled: bool):
+        self.fts_enabled = fts_enabled
+
+    async def search(self, db: AsyncSession, mailbox_id: int, query: str, limit: int) -> List[EmailList]:
+        """
+        Find indexed messages of a mailbox matching every word of the query.
+
+        Words match as prefixes, so "12" finds a code like "123456".
+
+        Args:
+            db: Database session
+            mailbox_id: Mailbox to search
+            query: Free text typed by the user
+            limit: Maximum number of results
+
+        Returns:
+            Matching EmailList entries, newest first
+        """
+        tokens = _TOKEN_RE.findall(query.lower())
+        if not tokens or limit <= 0:
+            return []
+
+        matches = select(Message).where(Message.mailbox_id == mailbox_id)
+        if self.fts_enabled:
+            # Restrict to the mailbox inside FTS so other mailboxes' postings are never visited
+            expression = (
+                f'mailbox_id : "{mailbox_id}" AND {{subject sender snippet body_text}} : ('
+                + " ".join(f'"{token}"*' for token in tokens)
+                + ")"
+            )
+            matches = matches.where(
+                text("messages.rowid IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH :expression)")
+                .bindparams(expression=expression)
+            )
+        else:
+            matches = matches.where(and_(*[
+                or_(
+                    Message.subject.ilike(f"%{token}%"),
+                    Message.sender.ilike(f"%{token}%"),
+                    Message.snippet.ilike(f"%{token}%"),
+                    Message.body_text.ilike(f"%{token}%"),
+                )
+                for token in tokens
+            ]))
+
+        rows = await db.scalars(matches.order_by(Message.uidvalidity.desc(), Message.uid.desc()).limit(limit))
+        return [
+            EmailList(
+                id=str(row.uid),
+                subject=row.subject,
+                sender=row.sender,
+                received_date=row.received_date,
+                has_attachments=row.has_attachments,
+                snippet=row.snippet,
+            )
+            for row in rows
+        ]
+
+    async def store_body(self, db: AsyncSession, mailbox_id: int, detail: EmailDetail) -> None:
+        """Add the body of an opened email to the index, if the email is indexed under its UIDVALIDITY."""
+        body_text = (detail.body_text or html_to_text(detail.body_html or "")).strip()
+        body_text = body_text[:settings.SEARCH_BODY_MAX_CHARS]
+        if not body_text or not detail.id.isdigit() or detail.uidvalidity is None:
+            return
+        uid = int(detail.id)
+        try:
+            await db.execute(
+                update(Message)
+                .where(
+                    Message.mailbox_id == mailbox_id,
+                    Message.uidvalidity == detail.uidvalidity,
+                    Message.uid == uid,
+                    or_(Message.body_text.is_(None), Message.body_text != body_text),
+                )
+                .values(body_text=body_text)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        except SQLAlchemyError as e:
+            # Search just misses this body until the email is opened again
+            print(f"Failed to index email body {uid}: {str(e)}")
+            await db.rollback()
+
+
+message_search = MessageSearchService(fts_enabled=FTS_ENABLED)
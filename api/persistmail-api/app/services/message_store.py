@@ -0,0 +1,248 @@
+"""
+Local on-disk cache of raw RFC822 messages.
+
+Messages are split into a header block and a body, and each half is stored
+once under its SHA-256. The per-mailbox headers (Received, Delivered-To)
+differ between copies of the same newsletter, but the bodies do not, so
+the large half is shared. A small index file maps (mailbox, uidvalidity,
+uid) to the two blobs.
+
+Every file under the cache directory counts against one byte budget and is
+evicted least recently used first. Evicting a blob leaves dangling index
+entries behind; those read as a miss and are removed on the next lookup.
+Deleting a mailbox forgets its index entries at once, so an address that
+is created again never sees the previous owner's mail. Each process keeps
+its own LRU bookkeeping, which it rebuilds from file mtimes on first use.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+
+
+class MessageStore:
+    """Content-addressed raw message cache with a size-bounded LRU."""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._files: "OrderedDict[str, int]" = OrderedDict()  # relative path -> size
+        self._total_bytes = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stored": 0, "deduplicated": 0, "evicted": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, imap_host: str, mailbox: str, uidvalidity: Optional[int], uid: int) -> Optional[bytes]:
+        """
+        Return the cached raw message, or None on a miss.
+
+        Args:
+            imap_host: IMAP server the mailbox lives on
+            mailbox: Mailbox address
+            uidvalidity: UIDVALIDITY the uid belongs to
+            uid: Message UID
+        """
+        if not self.enabled or uidvalidity is None:
+            return None
+        self._load()
+        index_path = self._index_path(imap_host, mailbox, uidvalidity, uid)
+        entry = self._read(index_path)
+        if entry is not None:
+            try:
+                header_hash, body_hash = entry.decode("ascii").split()
+                header = self._read(self._blob_path(header_hash))
+                body = self._read(self._blob_path(body_hash))
+            except ValueError:
+                header = body = None
+            if header is not None and body is not None:
+                self._touch(index_path, self._blob_path(header_hash), self._blob_path(body_hash))
+                with self._lock:
+                    self.stats["hits"] += 1
+                return header + body
+            # One of the blobs was evicted
+            self._remove(index_path)
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def put(self, imap_host: str, mailbox: str, uidvalidity: Optional[int], uid: int, raw: bytes) -> None:
+        """Store a raw message; failures only cost a future cache miss."""
+        if not self.enabled or uidvalidity is None or len(raw) > self.max_bytes:
+            return
+        self._load()
+        try:
+            header, body = split_message(raw)
+            hashes = []
+            for blob in (header, body):
+                digest = hashlib.sha256(blob).hexdigest()
+                self._write(self._blob_path(digest), blob)
+                hashes.append(digest)
+            self._write(
+                self._index_path(imap_host, mailbox, uidvalidity, uid),
+                " ".join(hashes).encode("ascii"),
+                replace=True,
+            )
+            with self._lock:
+                self.stats["stored"] += 1
+        except OSError as e:
+            print(f"Failed to cache message {uid} for {mailbox}: {str(e)}")
+        self._evict()
+
+    def forget(self, imap_host: str, mailbox: str) -> None:
+        """
+        Drop every cached message of a mailbox (its index entries; unshared blobs age out).
+
+        Args:
+            imap_host: IMAP server the mailbox lives on
+            mailbox: Mailbox address
+        """
+        if not self.enabled:
+            return
+        self._load()
+        directory = self._owner_dir(imap_host, mailbox)
+        with self._lock:
+            for relative_path in [path for path in self._files if path.startswith(directory + os.sep)]:
+                self._total_bytes -= self._files.pop(relative_path)
+        shutil.rmtree(os.path.join(self.root, directory), ignore_errors=True)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Return cache counters for monitoring."""
+        with self._lock:
+            return {
+                **self.stats,
+                "files": len(self._files),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _owner_dir(self, imap_host: str, mailbox: str) -> str:
+        owner = hashlib.sha256(f"{imap_host}\0{mailbox.lower()}".encode()).hexdigest()
+        return os.path.join("index", owner[:2], owner)
+
+    def _index_path(self, imap_host: str, mailbox: str, uidvalidity: int, uid: int) -> str:
+        return os.path.join(self._owner_dir(imap_host, mailbox), f"{uidvalidity}-{uid}")
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join("blobs", digest[:2], digest)
+
+    def _read(self, relative_path: str) -> Optional[bytes]:
+        try:
+            with open(os.path.join(self.root, relative_path), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write(self, relative_path: str, data: bytes, replace: bool = False) -> None:
+        path = os.path.join(self.root, relative_path)
+        with self._lock:
+            if relative_path in self._files and not replace:
+                # Same content already stored (content-addressed)
+                self._files.move_to_end(relative_path)
+                self.stats["deduplicated"] += 1
+                return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            self._total_bytes += len(data) - self._files.pop(relative_path, 0)
+            self._files[relative_path] = len(data)
+
+    def _touch(self, *relative_paths: str) -> None:
+        with self._lock:
+            for relative_path in relative_paths:
+                if relative_path in self._files:
+                    self._files.move_to_end(relative_path)
+        for relative_path in relative_paths:
+            try:
+                # Keeps the LRU order across restarts
+                os.utime(os.path.join(self.root, relative_path))
+            except OSError:
+                pass
+
+    def _remove(self, relative_path: str) -> None:
+        with self._lock:
+            self._total_bytes -= self._files.pop(relative_path, 0)
+        try:
+            os.unlink(os.path.join(self.root, relative_path))
+        except OSError:
+            pass
+
+    def _evict(self) -> None:
+        while True:
+            with self._lock:
+                if self._total_bytes <= self.max_bytes or not self._files:
+                    return
+                relative_path, size = self._files.popitem(last=False)
+                self._total_bytes -= size
+                self.stats["evicted"] += 1
+            try:
+                os.unlink(os.path.join(self.root, relative_path))
+            except OSError:
+                pass
+
+    def _load(self) -> None:
+        """Build the LRU order from what is already on disk."""
+        with self._lock:
+            if self._loaded:
+                return
+            found = []
+            for directory, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    path = os.path.join(directory, filename)
+                    try:
+                        info = os.stat(path)
+                    except OSError:
+                        continue
+                    if filename.startswith(".tmp-"):
+                        # Left behind by an interrupted write
+                        try:
+                            os.unlink(path)
+                        except OSError:
+                            pass
+                        continue
+                    found.append((info.st_mtime, os.path.relpath(path, self.root), info.st_size))
+            for _, relative_path, size in sorted(found):
+                self._files[relative_path] = size
+                self._total_bytes += size
+            self._loaded = True
+        self._evict()
+
+
+def split_message(raw: bytes) -> Tuple[bytes, bytes]:
+    """Split a raw message after the blank line that ends its header block."""
+    ends = [
+        position + len(separator)
+        for separator in (b"\r\n\r\n", b"\n\n")
+        for position in (raw.find(separator),)
+        if position != -1
+    ]
+    if not ends:
+        return raw, b""
+    end = min(ends)
+    return raw[:end], raw[end:]
+
+
+message_store = MessageStore(
+    root=settings.MESSAGE_CACHE_DIR,
+    max_bytes=settings.MESSAGE_CACHE_MAX_BYTES,
+)
@@ -0,0 +1,183 @@
+"""
+Single-pass decoding of complete raw messages.
+
+A message is parsed once with BytesParser(policy=default). Its headers are
+decoded once and every leaf part is visited once, collecting the first
+inline text and HTML bodies and describing the parts with the same section
+numbers as BODYSTRUCTURE. The list entry and the detail view are both built
+from that one ParsedMessage, so nothing is parsed or decoded twice.
+"""
+
+from datetime import datetime
+from email.message import EmailMessage
+from email.parser import BytesParser
+from email.policy import EmailPolicy, default
+from email.utils import parseaddr, parsedate_to_datetime
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from app.models.schemas import AttachmentInfo, EmailDetail, EmailList
+from app.services.imap_fetch import BodyPart, attachment_info, decode_mime_words, html_to_text, make_snippet
+
+# Headers the parser and the Message accessors read again and again per part
+_MIME_HEADERS = frozenset({"content-type", "content-disposition", "content-transfer-encoding"})
+
+
+class _ReusingPolicy(EmailPolicy):
+    """
+    policy.default, except that MIME headers are parsed once per distinct value.
+
+    Every get_content_type(), get_param() or get_filename() call parses the
+    raw header again through the header registry; the feed parser alone does
+    so several times per part. Parsed headers are immutable, so identical
+    values (and most parts say "text/plain; charset=utf-8") share one.
+    """
+
+    def header_fetch_parse(self, name, value):
+        if not hasattr(value, "name") and name.lower() in _MIME_HEADERS:
+            return _parsed_header(self, name, value)
+        return super().header_fetch_parse(name, value)
+
+
+@lru_cache(maxsize=1024)
+def _parsed_header(policy: EmailPolicy, name: str, value: str):
+    return EmailPolicy.header_fetch_parse(policy, name, value)
+
+
+_PARSER = BytesParser(policy=_ReusingPolicy(**default.__dict__))
+
+
+class ParsedMessage:
+    """Decoded headers, bodies and leaf parts of one message."""
+
+    def __init__(
+        self,
+        subject: str,
+        sender: str,
+        received_date: datetime,
+        body_text: str,
+        body_html: str,
+        parts: List[BodyPart],
+    ):
+        self.subject = subject
+        self.sender = sender
+        self.received_date = received_date
+        self.body_text = body_text
+        self.body_html = body_html
+        self.parts = parts
+        self.attachments: List[AttachmentInfo] = attachment_info(parts)
+
+    @property
+    def snippet(self) -> str:
+        """Preview text, taken from the HTML body when there is no plain text."""
+        return make_snippet(self.body_text or html_to_text(self.body_html))
+
+    def list_entry(self, message_id: str) -> EmailList:
+        return EmailList(
+            id=message_id,
+            subject=self.subject,
+            sender=self.sender,
+            received_date=self.received_date,
+            has_attachments=len(self.attachments) > 0,
+            snippet=self.snippet,
+        )
+
+    def detail(self, message_id: str, uidvalidity: Optional[int] = None) -> EmailDetail:
+        return EmailDetail(
+            id=message_id,
+            subject=self.subject,
+            sender=self.sender,
+            received_date=self.received_date,
+            has_attachments=len(self.attachments) > 0,
+            body_text=self.body_text,
+            body_html=self.body_html,
+            attachments=[a.filename for a in self.attachments],
+            attachment_parts=self.attachments,
+            uidvalidity=uidvalidity,
+        )
+
+
+def parse_message(raw: bytes) -> ParsedMessage:
+    """
+    Decode a complete RFC822 message.
+
+    Args:
+        raw: Message bytes as returned by FETCH RFC822 or the message cache
+
+    Returns:
+        ParsedMessage for building list and detail views
+    """
+    msg = _PARSER.parsebytes(raw)
+    headers = _top_headers(msg)
+    bodies = {"text/plain": None, "text/html": None}
+    parts: List[BodyPart] = []
+    _walk(msg, "", bodies, parts)
+
+    return ParsedMessage(
+        subject=" ".join(decode_mime_words(headers.get("subject")).split()) or "No Subject",
+        sender=parseaddr(headers.get("from", ""))[1] or "Unknown Sender",
+        received_date=_received_date(headers.get("date")),
+        body_text=bodies["text/plain"] or "",
+        body_html=bodies["text/html"] or "",
+        parts=parts,
+    )
+
+
+def _walk(part: EmailMessage, prefix: str, bodies: dict, parts: List[BodyPart]) -> None:
+    """Visit each leaf once, numbering sections like BODYSTRUCTURE."""
+    payload = part.get_payload()
+    if part.get_content_maintype() == "multipart" and isinstance(payload, list):
+        for index, child in enumerate(payload, start=1):
+            _walk(child, f"{prefix}.{index}" if prefix else str(index), bodies, parts)
+        return
+
+    content_type = part.get_content_type()
+    charset = part.get_content_charset()
+    if isinstance(payload, str):
+        # The parser keeps one character per raw byte, so this is the encoded size
+        size = len(payload)
+    else:
+        # message/rfc822 is kept as one leaf, as in BODYSTRUCTURE
+        size = sum(len(child.as_bytes()) for child in payload or [] if isinstance(child, EmailMessage))
+    filename = part.get_filename()
+    leaf = BodyPart(
+        section=prefix or "1",
+        content_type=content_type,
+        params={"charset": charset} if charset else {},
+        encoding=part.get("Content-Transfer-Encoding", "").strip().lower() or "7bit",
+        size=size,
+        disposition=part.get_content_disposition(),
+        filename=decode_mime_words(filename) if filename else None,
+    )
+    parts.append(leaf)
+
+    if content_type in bodies and bodies[content_type] is None and not leaf.is_attachment:
+        data = part.get_payload(decode=True) or b""
+        try:
+            bodies[content_type] = data.decode(leaf.charset, errors="ignore")
+        except LookupError:
+            bodies[content_type] = data.decode("utf-8", errors="ignore")
+
+
+def _top_headers(msg: EmailMessage) -> Dict[str, str]:
+    """
+    Raw Subject, From and Date, collected in one pass over the header block.
+
+    The header registry's address and date parsers cost more than the whole
+    rest of a small message; these three are only displayed, so the lighter
+    decoders used for ENVELOPE data are enough.
+    """
+    wanted = {}
+    for name, value in msg.raw_items():
+        name = name.lower()
+        if name in ("subject", "from", "date") and name not in wanted:
+            wanted[name] = value
+    return wanted
+
+
+def _received_date(value: Optional[str]) -> datetime:
+    """Date header in local naive time, like the IMAP ENVELOPE date used elsewhere."""
+    try:
+        return parsedate_to_datetime(value).astimezone().replace(tzinfo=None)
+    except (TypeError, ValueError, IndexError):
+        return datetime.now()
@@ -1,14 +1,61 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.routes import email_router
 from app.api.admin_routes import admin_router
 from app.api.mailbox_routes import mailbox_router  # New Mailcow routes
 from app.core.config import settings
+from app.db.session import async_engine
+from app.services.imap_pool import imap_pool
+from app.services.imap_executor import imap_executor
+from app.services.mailbox_watcher import mailbox_watchers
+from app.services.mailbox_sync import mailbox_sync_cache
+from app.services.message_store import message_store
+from app.services.http_client import http_client
+from app.services.mailbox_pool import mailbox_pool
+from app.services.mailbox_provisioning import mailbox_provisioner
+from app.services.mailcow_jobs import mailcow_jobs
+from app.services.last_access import last_access
+
+async def prune_idle_imap_sessions():
+    """Periodically close pooled IMAP sessions that have gone idle."""
+    while True:
+        await asyncio.sleep(settings.IMAP_POOL_PRUNE_INTERVAL_SECONDS)
+        try:
+            # Logging out idle sessions is network I/O, keep it off the event loop
+            await imap_executor.run(imap_pool.prune_idle)
+        except Exception as e:
+            print(f"Error pruning IMAP sessions: {str(e)}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await http_client.start()
+    prune_task = asyncio.create_task(prune_idle_imap_sessions())
+    last_access.start()
+    if settings.MAILCOW_ENABLED and settings.MAILCOW_API_URL and settings.MAILCOW_API_KEY:
+        mailcow_jobs.start()
+        mailbox_pool.start()
+    try:
+        yield
+    finally:
+        prune_task.cancel()
+        await mailbox_pool.stop()
+        await mailcow_jobs.stop()
+        await http_client.close()
+        # Write pending last access times before the engine goes away
+        await last_access.stop()
+        await async_engine.dispose()
+        mailbox_watchers.stop_all()
+        imap_executor.shutdown()
+        # Log out pooled IMAP sessions so they don't linger on the mail server
+        imap_pool.close_all()
 
 app = FastAPI(
     title="PersistMail API",
     description="Temporary Email Service API with Mailcow Integration",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware configuration
@@ -18,6 +65,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let browser clients read the caching, paging and download headers
+    expose_headers=["ETag", "X-Next-Cursor", "Content-Range", "Content-Disposition"],
 )
 
 # Include routers
@@ -42,7 +91,18 @@ async def health_check():
                 "database_configured": bool(settings.DATABASE_URL),
                 "mailcow_configured": bool(settings.MAILCOW_API_URL and settings.MAILCOW_API_KEY),
                 "domain_configured": bool(settings.MAIL_DOMAIN and settings.IMAP_HOST),
-            }
+            },
+            "imap": {
+                "workers": imap_executor.get_stats(),
+                "sessions": imap_pool.get_stats(),
+                "idle": mailbox_watchers.get_stats(),
+                "sync_cache": mailbox_sync_cache.get_stats(),
+                "message_cache": message_store.get_stats(),
+            },
+            "mailbox_pool": mailbox_pool.get_stats(),
+            "mailbox_provisioning": mailbox_provisioner.get_stats(),
+            "mailcow_jobs": mailcow_jobs.get_stats(),
+            "last_access": last_access.get_stats(),
         }
     except Exception as e:
         return {
@@ -28,6 +28,11 @@ def migrate_database():
         "ALTER TABLE mailboxes ADD COLUMN quota_used_mb INTEGER DEFAULT 0",
         "ALTER TABLE mailboxes ADD COLUMN expires_at DATETIME",
         "ALTER TABLE mailboxes ADD COLUMN mailcow_managed BOOLEAN DEFAULT 1",
+        "ALTER TABLE mailboxes ADD COLUMN pooled BOOLEAN DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS ix_mailboxes_domain_pooled ON mailboxes (domain_id, pooled)",
+        
+        # Add searchable body text to the message index
+        "ALTER TABLE messages ADD COLUMN body_text TEXT",
         
         # Make credentials_key nullable for Mailcow domains
         # Note: SQLite doesn't support ALTER COLUMN, so we'll handle this differently
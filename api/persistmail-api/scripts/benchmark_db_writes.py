@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Benchmark database writes under concurrent load.
+
+Runs the write pattern of a busy API process against the database twice,
+once with SQLAlchemy's default engine settings and once with the engine
+profile from app/db/profile.py (WAL, synchronous=NORMAL, busy_timeout and
+mmap_size for SQLite; pool size, pre-ping and statement timeout for
+PostgreSQL). Writers update last_accessed of random mailboxes, and one
+write in CLEANUP_EVERY deletes a batch of mailboxes and inserts them again,
+like a cleanup sweep. Readers list mailboxes at the same time. Reports
+committed writes per second, "database is locked" and other errors, and
+write latency.
+
+Usage:
+    python scripts/benchmark_db_writes.py [--url DATABASE_URL] [--writers 16] [--readers 4] [--seconds 10]
+
+Without --url each profile gets a fresh SQLite file in a temporary
+directory. With a PostgreSQL URL the benchmark creates the tables if
+needed and removes its rows (domain benchmark.invalid) afterwards.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+# Add the parent directory to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, delete, func, insert, select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine
+from app.db.profile import apply_profile, async_database_url, engine_options
+from app.models.models import Base, Domain, Mailbox
+
+DOMAIN = "benchmark.invalid"
+# One write in this many is a cleanup batch instead of a last_accessed update
+CLEANUP_EVERY = 20
+CLEANUP_BATCH = 20
+
+
+def seed(url: str, mailboxes: int) -> int:
+    """Create the tables and the benchmark domain with its mailboxes; return the domain id."""
+    engine = create_engine(url)
+    try:
+        Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            conn.execute(delete(Domain).where(Domain.domain == DOMAIN))
+            domain_id = conn.execute(
+                insert(Domain).values(
+                    domain=DOMAIN, imap_host=f"imap.{DOMAIN}", imap_port=993, is_active=True, is_mailcow_managed=True
+                ).returning(Domain.id)
+            ).scalar_one()
+            conn.execute(insert(Mailbox), [_mailbox_row(domain_id, i) for i in range(mailboxes)])
+        return domain_id
+    finally:
+        engine.dispose()
+
+
+def cleanup(url: str) -> None:
+    engine = create_engine(url)
+    try:
+        with engine.begin() as conn:
+            domain_id = conn.execute(select(Domain.id).where(Domain.domain == DOMAIN)).scalar()
+            conn.execute(delete(Mailbox).where(Mailbox.domain_id == domain_id))
+            conn.execute(delete(Domain).where(Domain.id == domain_id))
+    finally:
+        engine.dispose()
+
+
+def _mailbox_row(domain_id: int, index: int) -> Dict:
+    return {
+        "email": f"bench{index}@{DOMAIN}",
+        "domain_id": domain_id,
+        "password": "benchmark",
+        "quota_mb": 25,
+        "quota_used_mb": 0,
+        "mailcow_managed": True,
+        "pooled": False,
+        "created_at": datetime.utcnow(),
+        "last_accessed": datetime.utcnow(),
+    }
+
+
+async def run_profile(label: str, url: str, tuned: bool, writers: int, readers: int, seconds: float, mailboxes: int):
+    domain_id = seed(url, mailboxes)
+    async_url = async_database_url(url)
+    if tuned:
+        engine = create_async_engine(async_url, **engine_options(async_url))
+        apply_profile(engine.sync_engine)
+    else:
+        engine = create_async_engine(async_url)
+
+    stop_at = time.monotonic() + seconds
+    latencies: List[float] = []
+    counts = {"writes": 0, "reads": 0, "locked": 0, "errors": 0}
+
+    async def writer(worker: int) -> None:
+        rng = random.Random(worker)
+        ops = 0
+        while time.monotonic() < stop_at:
+            ops += 1
+            started = time.perf_counter()
+            try:
+                async with engine.begin() as conn:
+                    if ops % CLEANUP_EVERY == 0:
+                        start = rng.randrange(mailboxes - CLEANUP_BATCH)
+                        emails = [f"bench{i}@{DOMAIN}" for i in range(start, start + CLEANUP_BATCH)]
+                        await conn.execute(delete(Mailbox).where(Mailbox.email.in_(emails)))
+                        await conn.execute(
+                            insert(Mailbox), [_mailbox_row(domain_id, i) for i in range(start, start + CLEANUP_BATCH)]
+                        )
+                    else:
+                        await conn.execute(
+                            update(Mailbox)
+                            .where(Mailbox.email == f"bench{rng.randrange(mailboxes)}@{DOMAIN}")
+                            .values(last_accessed=datetime.utcnow())
+                        )
+                counts["writes"] += 1
+                latencies.append(time.perf_counter() - started)
+            except OperationalError as e:
+                counts["locked" if "locked" in str(e) else "errors"] += 1
+            except Exception:
+                counts["errors"] += 1
+
+    async def reader() -> None:
+        while time.monotonic() < stop_at:
+            try:
+                async with engine.connect() as conn:
+                    await conn.execute(
+                        select(Mailbox.email, Mailbox.last_accessed)
+                        .where(Mailbox.domain_id == domain_id)
+                        .order_by(Mailbox.last_accessed.desc()).limit(50)
+                    )
+                    await conn.execute(select(func.count(Mailbox.id)).where(Mailbox.domain_id == domain_id))
+                counts["reads"] += 1
+            except OperationalError as e:
+                counts["locked" if "locked" in str(e) else "errors"] += 1
+
+    started = time.monotonic()
+    await asyncio.gather(*(writer(i) for i in range(writers)), *(reader() for _ in range(readers)))
+    elapsed = time.monotonic() - started
+    await engine.dispose()
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0.0
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0
+    print(f"{label:<8} writes/s={counts['writes'] / elapsed:<9.0f} reads/s={counts['reads'] / elapsed:<9.0f} "
+          f"locked={counts['locked']:<6} errors={counts['errors']:<4} p50={p50:.1f}ms p99={p99:.1f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent database writes")
+    parser.add_argument("--url", help="Database URL (default: a fresh SQLite file per profile)")
+    parser.add_argument("--writers", type=int, default=16, help="Concurrent writers")
+    parser.add_argument("--readers", type=int, default=4, help="Concurrent readers")
+    parser.add_argument("--seconds", type=float, default=10, help="Duration of each run")
+    parser.add_argument("--mailboxes", type=int, default=1000, help="Mailbox rows to write to")
+    args = parser.parse_args()
+
+    print(f"{args.writers} writers, {args.readers} readers, {args.seconds:.0f}s per profile")
+    print("=" * 50)
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, tuned in (("default", False), ("profile", True)):
+            url = args.url or f"sqlite:///{os.path.join(tmp, label + '.db')}"
+            try:
+                await run_profile(label, url, tuned, args.writers, args.readers, args.seconds, args.mailboxes)
+            finally:
+                if args.url:
+                    cleanup(url)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
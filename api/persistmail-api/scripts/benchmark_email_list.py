@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Benchmark IMAP traffic for one /emails/{mailbox} listing.
+
+Compares the legacy list path (one FETCH BODY[] per message for snippets)
+with the batched FETCH used by the email services, counting IMAP commands
+and bytes on the wire for each.
+
+Usage:
+    python scripts/benchmark_email_list.py user@domain.com [--limit 25] [--hours 24]
+
+The mailbox password defaults to IMAP_SECRET from the environment.
+"""
+
+import argparse
+import email
+import os
+import ssl
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Add the parent directory to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from imapclient import IMAPClient
+from app.core.config import settings
+from app.services.imap_fetch import fetch_email_list
+
+
+class TrafficCounter:
+    """Wrap the imaplib connection inside an IMAPClient to count traffic."""
+
+    def __init__(self, client: IMAPClient):
+        self.commands = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        imap = client._imap
+
+        original_command = imap._command
+        original_read = imap.read
+        original_readline = imap.readline
+        original_send = imap.send
+
+        def command(name, *args):
+            self.commands += 1
+            return original_command(name, *args)
+
+        def read(size):
+            data = original_read(size)
+            self.bytes_in += len(data)
+            return data
+
+        def readline():
+            data = original_readline()
+            self.bytes_in += len(data)
+            return data
+
+        def send(data):
+            self.bytes_out += len(data)
+            return original_send(data)
+
+        imap._command = command
+        imap.read = read
+        imap.readline = readline
+        imap.send = send
+
+    def snapshot(self):
+        return self.commands, self.bytes_in, self.bytes_out
+
+
+def connect(mailbox: str, password: str) -> IMAPClient:
+    context = ssl.create_default_context()
+    if not settings.SSL_VERIFY_CERTS:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    client = IMAPClient(
+        settings.IMAP_HOST,
+        port=settings.IMAP_PORT,
+        ssl_context=context,
+        use_uid=True,
+        timeout=settings.IMAP_TIMEOUT_SECONDS
+    )
+    client.login(mailbox, password)
+    return client
+
+
+def legacy_list(server: IMAPClient, uids):
+    """The list path as it was before batching: one BODY[] fetch per message."""
+    results = []
+    for msg_id, data in server.fetch(uids, ['ENVELOPE', 'FLAGS', 'RFC822.SIZE']).items():
+        # PEEK so the benchmark doesn't mark messages as read
+        message = server.fetch([msg_id], ['BODY.PEEK[]'])[msg_id][b'BODY[]']
+        parsed = email.message_from_bytes(message)
+        snippet = "No preview available"
+        for part in parsed.walk():
+            if part.get_content_type() == "text/plain":
+                snippet = part.get_payload(decode=True).decode(errors="ignore")[:settings.EMAIL_SNIPPET_LENGTH]
+                break
+        results.append((msg_id, snippet))
+    return results
+
+
+def measure(label: str, server: IMAPClient, counter: TrafficCounter, func, uids):
+    before = counter.snapshot()
+    started = time.perf_counter()
+    results = func(server, uids)
+    elapsed = (time.perf_counter() - started) * 1000
+    after = counter.snapshot()
+    commands, bytes_in, bytes_out = (a - b for a, b in zip(after, before))
+    print(f"{label:<10} messages={len(results):<4} commands={commands:<4} "
+          f"bytes_in={bytes_in:<10} bytes_out={bytes_out:<8} time={elapsed:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark IMAP list traffic")
+    parser.add_argument("mailbox", help="Mailbox address to list")
+    parser.add_argument("--password", default=settings.IMAP_SECRET)
+    parser.add_argument("--hours", type=int, default=settings.DEFAULT_HOURS_RETENTION)
+    parser.add_argument("--limit", type=int, default=settings.DEFAULT_EMAIL_LIMIT)
+    args = parser.parse_args()
+
+    if not settings.IMAP_HOST:
+        print("❌ IMAP_HOST not configured")
+        sys.exit(1)
+
+    server = connect(args.mailbox, args.password)
+    counter = TrafficCounter(server)
+    try:
+        server.select_folder('INBOX')
+        date_from = (datetime.now() - timedelta(hours=args.hours)).strftime("%d-%b-%Y")
+        uids = server.search(['SINCE', date_from])[-args.limit:]
+        print(f"Listing {len(uids)} messages from {args.mailbox}")
+        print("=" * 50)
+
+        measure("legacy", server, counter, legacy_list, uids)
+        measure("batched", server, counter, fetch_email_list, uids)
+    finally:
+        server.logout()
+
+
+if __name__ == "__main__":
+    main()
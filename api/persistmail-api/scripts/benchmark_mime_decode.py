@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Benchmark decoding of complete raw messages.
+
+Builds a synthetic corpus covering the shapes a disposable inbox receives
+(plain text, HTML only, multipart/alternative, attachments, nested and
+forwarded messages, quoted-printable, legacy charsets, encoded headers) and
+decodes it with the legacy detail parser (compat32 message_from_bytes, a
+walk for bodies and a second walk for attachments) and with the single-pass
+parse_message(). Reports messages per second and the peak memory allocated
+while decoding one message, as traced by tracemalloc.
+
+Usage:
+    python scripts/benchmark_mime_decode.py [--copies 50] [--rounds 5] [--dump DIR]
+
+No mail server is needed.
+"""
+
+import argparse
+import email
+import os
+import sys
+import time
+import tracemalloc
+from email.header import decode_header
+from email.message import EmailMessage
+from email.utils import format_datetime, parseaddr, parsedate_to_datetime
+from datetime import datetime, timedelta, timezone
+
+# Add the parent directory to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.imap_fetch import BodyPart, attachment_info, html_to_text, make_snippet
+from app.services.mime_decode import parse_message
+
+PARAGRAPH = (
+    "Thanks for signing up. Your verification code is 482913 and it expires in "
+    "ten minutes. If you did not request this code you can ignore this email. "
+)
+
+
+def _base(index: int, subject: str) -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"] = f"Service {index} <no-reply{index}@service.example>"
+    msg["To"] = "inbox@test.persistmail.site"
+    msg["Subject"] = subject
+    sent = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=index)
+    msg["Date"] = format_datetime(sent)
+    msg["Message-ID"] = f"<{index}@service.example>"
+    return msg
+
+
+def build_corpus(copies: int):
+    """Return (name, raw bytes) pairs; each shape is repeated copies times."""
+    corpus = []
+    for i in range(copies):
+        msg = _base(i, f"Your code {i}")
+        msg.set_content(PARAGRAPH * 3)
+        corpus.append(("plain", msg.as_bytes()))
+
+        msg = _base(i, "Welcome aboard")
+        msg.set_content(f"<html><body><h1>Welcome</h1><p>{PARAGRAPH * 5}</p></body></html>", subtype="html")
+        corpus.append(("html", msg.as_bytes()))
+
+        msg = _base(i, "Confirm your address")
+        msg.set_content(PARAGRAPH * 4)
+        msg.add_alternative(f"<html><body><p>{PARAGRAPH * 4}</p></body></html>", subtype="html")
+        corpus.append(("alternative", msg.as_bytes()))
+
+        msg = _base(i, "Your invoice")
+        msg.set_content(PARAGRAPH)
+        msg.add_alternative(f"<p>{PARAGRAPH}</p>", subtype="html")
+        msg.add_attachment(bytes(range(256)) * 200, maintype="application", subtype="pdf", filename=f"invoice-{i}.pdf")
+        msg.add_attachment(b"id,amount\n1,9.99\n" * 50, maintype="text", subtype="csv", filename="items.csv")
+        corpus.append(("attachments", msg.as_bytes()))
+
+        inner = _base(i + 1000, "Original message")
+        inner.set_content(PARAGRAPH * 2)
+        msg = _base(i, "Fwd: Original message")
+        msg.set_content("See the forwarded message below.")
+        msg.add_attachment(inner)
+        corpus.append(("forwarded", msg.as_bytes()))
+
+        msg = _base(i, "Ünïcödé sübjéct – ✓ bestätigt")
+        msg.replace_header("From", f"Bäckerei Müller <info{i}@baeckerei.example>")
+        msg.set_content(("Grüße aus Köln. " + PARAGRAPH) * 3, cte="quoted-printable")
+        corpus.append(("quoted-printable", msg.as_bytes()))
+
+        msg = _base(i, "Заказ оформлен")
+        msg.set_content("Ваш заказ оформлен. " * 40, charset="koi8-r", cte="base64")
+        corpus.append(("koi8-r", msg.as_bytes()))
+    return corpus
+
+
+def legacy_parse(raw: bytes):
+    """The detail parser as it was before the single-pass module."""
+    msg = email.message_from_bytes(raw)
+
+    def decode(value):
+        decoded = ""
+        for part, encoding in decode_header(value):
+            if isinstance(part, bytes):
+                decoded += part.decode(encoding or "utf-8", errors="ignore")
+            else:
+                decoded += str(part)
+        return decoded
+
+    subject = decode(msg.get("Subject", "No Subject"))
+    sender = parseaddr(msg.get("From", ""))[1] or "Unknown Sender"
+    try:
+        received_date = parsedate_to_datetime(msg["Date"]).astimezone().replace(tzinfo=None)
+    except (TypeError, ValueError):
+        received_date = datetime.now()
+
+    body_text = ""
+    body_html = ""
+    for part in msg.walk():
+        if "attachment" in str(part.get("Content-Disposition", "")):
+            continue
+        if part.get_content_type() == "text/plain":
+            body_text = part.get_payload(decode=True).decode(part.get_content_charset() or "utf-8", errors="ignore")
+        elif part.get_content_type() == "text/html":
+            body_html = part.get_payload(decode=True).decode(part.get_content_charset() or "utf-8", errors="ignore")
+
+    def leaves(node, prefix=""):
+        if node.is_multipart():
+            for index, child in enumerate(node.get_payload(), start=1):
+                yield from leaves(child, f"{prefix}.{index}" if prefix else str(index))
+            return
+        payload = node.get_payload()
+        size = len(payload.encode("utf-8", errors="surrogateescape")) if isinstance(payload, str) else 0
+        filename = node.get_filename()
+        yield BodyPart(
+            section=prefix or "1",
+            content_type=node.get_content_type(),
+            params={},
+            encoding=str(node.get("Content-Transfer-Encoding", "7bit")).lower(),
+            size=size,
+            disposition=node.get_content_disposition(),
+            filename=decode(filename) if filename else None,
+        )
+
+    attachments = attachment_info(list(leaves(msg)))
+    snippet = make_snippet(body_text or html_to_text(body_html))
+    return subject, sender, received_date, body_text, body_html, attachments, snippet
+
+
+def single_pass(raw: bytes):
+    parsed = parse_message(raw)
+    return parsed.detail("1"), parsed.list_entry("1")
+
+
+def measure(label: str, func, corpus, rounds: int):
+    messages = [raw for _, raw in corpus]
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for raw in messages:
+            func(raw)
+    elapsed = time.perf_counter() - started
+    rate = len(messages) * rounds / elapsed
+
+    # One extra round under tracemalloc; tracing slows it down, so it is not timed.
+    # The peak above the starting point is what decoding one message needs at once.
+    tracemalloc.start()
+    peaks = []
+    for raw in messages:
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func(raw)
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+
+    print(f"{label:<12} msgs/s={rate:<10.0f} alloc/msg={sum(peaks) / len(peaks) / 1024:<8.1f}KiB "
+          f"max={max(peaks) / 1024:.1f}KiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark raw message decoding")
+    parser.add_argument("--copies", type=int, default=50, help="Copies of each message shape")
+    parser.add_argument("--rounds", type=int, default=5, help="Timed passes over the corpus")
+    parser.add_argument("--dump", help="Also write the corpus as .eml files to this directory")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.copies)
+    total_bytes = sum(len(raw) for _, raw in corpus)
+    print(f"Corpus: {len(corpus)} messages, {total_bytes / 1024:.0f} KiB")
+
+    if args.dump:
+        os.makedirs(args.dump, exist_ok=True)
+        for index, (name, raw) in enumerate(corpus):
+            with open(os.path.join(args.dump, f"{index:05d}-{name}.eml"), "wb") as f:
+                f.write(raw)
+        print(f"Wrote corpus to {args.dump}")
+
+    # Both parsers must agree before their speed is worth comparing. The legacy
+    # walk kept the last text part it saw, which for forwarded mail is the
+    # forwarded message's text, so bodies are only compared for the others.
+    for name, raw in corpus[:7]:
+        detail, entry = single_pass(raw)
+        subject, sender, _, body_text, body_html, attachments, legacy_snippet = legacy_parse(raw)
+        same = (detail.subject, detail.sender) == (subject, sender)
+        same = same and [a.part for a in detail.attachment_parts] == [a.part for a in attachments]
+        if name != "forwarded":
+            same = same and (detail.body_text, detail.body_html, entry.snippet) == (body_text, body_html, legacy_snippet)
+        if not same:
+            print(f"⚠️  Parsers disagree on the {name} message")
+
+    print("=" * 50)
+    measure("legacy", legacy_parse, corpus, args.rounds)
+    measure("single-pass", single_pass, corpus, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -61,7 +61,7 @@ def migrate_database():
 def backup_database():
     """Create a backup of the current database (SQLite only)."""
     if "sqlite" in settings.DATABASE_URL.lower():
-        import shutil
+        import sqlite3
         from datetime import datetime
         
         db_path = settings.DATABASE_URL.replace("sqlite:///", "").replace("sqlite://", "")
@@ -69,7 +69,14 @@ def backup_database():
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             backup_path = f"{db_path}.backup_{timestamp}"
             try:
-                shutil.copy2(db_path, backup_path)
+                # Online backup: in WAL mode recent commits may still be in the -wal file
+                source = sqlite3.connect(db_path)
+                target = sqlite3.connect(backup_path)
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                    source.close()
                 print(f"✅ Database backed up to: {backup_path}")
                 return True
             except Exception as e: